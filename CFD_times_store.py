@@ -0,0 +1,98 @@
+from pathlib import Path
+import numpy
+import pandas
+from waveforms_store import INDEX_COLUMNS
+
+CFD_TIMES_DIRECTORY_NAME = 'CFD_times'
+VARIABLES = ['t (s)','Time over threshold (s)']
+
+def _path_to_chunk_file(path_to_directory:Path, n_chunk:int)->Path:
+	return path_to_directory/f'chunk_{n_chunk:06d}.npz'
+
+def append_CFD_times(path_to_directory:Path, n_trigger:numpy.ndarray, slot_number:numpy.ndarray, CFD_times:dict):
+	"""Stores the times at many CFD thresholds of some waveforms, as
+	returned by `waveform_features.compute_CFD_times`, in a new chunk file.
+	Each time is stored as a 32 bits float relative to a 64 bits float
+	reference per waveform, which takes about half the space of 64 bits
+	floats without losing resolution, and much less than one column
+	per threshold in an SQLite file.
+
+	Arguments
+	---------
+	path_to_directory: Path
+		The directory where the chunks are, it is created if it does not
+		exist.
+	n_trigger, slot_number: numpy.ndarray
+		The index of each waveform, i.e. of each row of the arrays in
+		`CFD_times`.
+	CFD_times: dict
+		What `waveform_features.compute_CFD_times` returned.
+	"""
+	path_to_directory.mkdir(parents=True, exist_ok=True)
+	n_chunk = 1 + max([int(_.name[len('chunk_'):-len('.npz')]) for _ in path_to_directory.glob('chunk_*.npz') if not _.name.endswith('.tmp.npz')], default=-1) # Leftover temporary files from an interrupted call are not chunks.
+	reference_time = numpy.nan_to_num(numpy.nanmin(CFD_times['t (s)'], axis=1, initial=numpy.inf), posinf=0)
+	path_to_chunk = _path_to_chunk_file(path_to_directory, n_chunk)
+	path_to_temporary_file = path_to_chunk.with_suffix('.tmp.npz')
+	numpy.savez(
+		path_to_temporary_file,
+		n_trigger = numpy.asarray(n_trigger),
+		slot_number = numpy.asarray(slot_number),
+		percentages = CFD_times['percentages'],
+		reference_time = reference_time,
+		t = (CFD_times['t (s)'] - reference_time[:,numpy.newaxis]).astype(numpy.float32),
+		time_over_threshold = CFD_times['Time over threshold (s)'].astype(numpy.float32),
+	)
+	path_to_temporary_file.rename(path_to_chunk)
+
+def read_CFD_times(path_to_directory:Path, slots_numbers:list=None)->dict:
+	"""Reads everything stored by `append_CFD_times`.
+
+	Arguments
+	---------
+	path_to_directory: Path
+		The directory where the chunks are.
+	slots_numbers: list of int, optional
+		If given, only the waveforms of these slots are read.
+
+	Returns
+	-------
+	CFD_times: dict
+		A dictionary with `'n_trigger'`, `'slot_number'` and `'percentages'`,
+		1D arrays, and `'t (s)'` and `'Time over threshold (s)'`, 2D arrays
+		with one row per waveform and one column per percentage.
+	"""
+	chunks = []
+	for path_to_chunk in sorted(path_to_directory.glob('chunk_*.npz')):
+		if path_to_chunk.name.endswith('.tmp.npz'):
+			continue
+		with numpy.load(path_to_chunk) as npz:
+			rows = numpy.isin(npz['slot_number'], slots_numbers) if slots_numbers is not None else slice(None)
+			chunks.append(
+				{
+					'n_trigger': npz['n_trigger'][rows],
+					'slot_number': npz['slot_number'][rows],
+					'percentages': npz['percentages'],
+					't (s)': npz['reference_time'][rows][:,numpy.newaxis] + npz['t'][rows].astype(float),
+					'Time over threshold (s)': npz['time_over_threshold'][rows].astype(float),
+				}
+			)
+	if len(chunks) == 0:
+		raise FileNotFoundError(f'Cannot find CFD times in {path_to_directory}.')
+	if any([not numpy.array_equal(chunk['percentages'], chunks[0]['percentages']) for chunk in chunks]):
+		raise RuntimeError(f'The CFD times in {path_to_directory} were not all computed for the same thresholds.')
+	CFD_times = {key: numpy.concatenate([chunk[key] for chunk in chunks]) for key in INDEX_COLUMNS+VARIABLES}
+	CFD_times['percentages'] = chunks[0]['percentages']
+	return CFD_times
+
+def read_CFD_times_as_dataframe(path_to_directory:Path, variable:str='t (s)', slots_numbers:list=None)->pandas.DataFrame:
+	"""Same as `read_CFD_times` but returns a data frame with `INDEX_COLUMNS`
+	as index and one column per threshold, named as in `parse_waveforms.parse_waveform`,
+	i.e. `'t_20 (s)'` or `'Time over 20% (s)'`, for the given `variable`."""
+	if variable not in VARIABLES:
+		raise ValueError(f'`variable` must be one of {VARIABLES}, received {repr(variable)}.')
+	CFD_times = read_CFD_times(path_to_directory, slots_numbers=slots_numbers)
+	return pandas.DataFrame(
+		CFD_times[variable],
+		index = pandas.MultiIndex.from_arrays([CFD_times[_] for _ in INDEX_COLUMNS], names=INDEX_COLUMNS),
+		columns = [f't_{p:g} (s)' if variable=='t (s)' else f'Time over {p:g}% (s)' for p in CFD_times['percentages']],
+	)
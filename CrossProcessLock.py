@@ -1,85 +1,193 @@
-from pathlib import Path
+import threading
 import time
-import atexit
-import datetime
-
-SEPARATION_STRING = '<-->' # This just has to be a very weird string that will never appear in the name of whoever wants to acquire the lock.
+from collections import deque
+from multiprocessing.managers import BaseProxy
 
 def _check_name(name:str):
 	if not isinstance(name, str):
 		raise TypeError(f'`name` must be a string.')
-	if name == SEPARATION_STRING:
-		raise ValueError(f'`name` cannot be "{SEPARATION_STRING}", please use another.')
 
 class CrossProcessNamedLock:
 	"""This class implements a named lock, i.e. you can lock it or not
-	depending on your name. The lock is process safe and thread safe.
+	depending on your name. Whoever has the same name as the current
+	owner can acquire it again (re-entrant), the others have to wait
+	their turn, which is given in the same order in which they asked
+	for it.
+
+	The lock lives in one process (i.e. the one running the setup) and
+	other processes use it through a `NamedLockHolderProxy`, so waiting
+	is done by the operating system and not by polling.
 	"""
-	def __init__(self, path_to_a_directory_with_writing_permission:Path):
-		self._path_to_this_lock_file = path_to_a_directory_with_writing_permission/Path(f'NamedLock_{datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")}.txt')
-		time.sleep(1e-3) # This is to be sure that the timestamp in the previous line does not repeat.
-		def release_lock_at_exit():
-			if self._path_to_this_lock_file.is_file():
-				self._path_to_this_lock_file.unlink()
-		atexit.register(release_lock_at_exit)
-	
-	def locked(self):
+	def __init__(self, lock_name:str=None, n_events_to_keep:int=999):
+		"""
+		Arguments
+		---------
+		lock_name: str, optional
+			A name for this lock, just to identify it in the statistics.
+		n_events_to_keep: int, default 999
+			Number of acquisitions for which to keep the wait and hold
+			times, see `events`.
+		"""
+		self.lock_name = lock_name
+		self._condition = threading.Condition()
+		self._owner = None
+		self._depth = 0
+		self._waiting_tickets = deque()
+		self._next_ticket = 0
+		self._acquired_when = None
+		self._events = deque(maxlen=n_events_to_keep)
+		self._statistics = {
+			'n_acquisitions': 0,
+			'n_timeouts': 0,
+			'Total wait time (s)': 0,
+			'Max wait time (s)': 0,
+			'Total hold time (s)': 0,
+			'Max hold time (s)': 0,
+		}
+
+	def locked(self)->bool:
 		"""Return `True` if the lock is acquired."""
-		return self._path_to_this_lock_file.is_file()
-	
-	def locked_by(self, name:str):
+		with self._condition:
+			return self._owner is not None
+
+	def locked_by(self, name:str)->bool:
 		"""Return `True` if the lock is acquired by `name`."""
 		_check_name(name)
-		if self.locked():
-			return self._acquired_by()==name
-		return False
-	
-	def _acquired_by(self):
-		"""Returns the name of the whoever acquires the lock, or `None` if
-		it is not acquired by anyone."""
-		if self.locked():
-			with open(self._path_to_this_lock_file, 'r') as f:
-				return f.read().split(SEPARATION_STRING)[0]
-		else:
-			return None
-	
-	def acquire(self, name:str):
-		"""Acquire the lock, or wait indefinitely until it can be acquired."""
+		with self._condition:
+			return self._owner == name
+
+	def acquire(self, name:str, timeout:float=None)->bool:
+		"""Acquire the lock, or wait until it can be acquired.
+
+		Arguments
+		---------
+		name: str
+			The name of whoever wants to acquire the lock.
+		timeout: float, optional
+			Maximum number of seconds to wait. If `None`, waits forever.
+
+		Returns
+		-------
+		acquired: bool
+			`True` if the lock was acquired, `False` if the timeout expired.
+		"""
 		_check_name(name)
-		if self.locked_by(name):
-			with open(self._path_to_this_lock_file, 'a') as f:
-				print(name, file=f, end=SEPARATION_STRING)
-		else:
-			while self.locked():
-				time.sleep(.1)
-			with open(self._path_to_this_lock_file, 'w') as f:
-				print(name, file=f, end=SEPARATION_STRING)
-	
+		started_waiting = time.time()
+		with self._condition:
+			if self._owner == name:
+				self._depth += 1
+				return True
+			ticket = self._next_ticket
+			self._next_ticket += 1
+			self._waiting_tickets.append(ticket)
+			try:
+				acquired = self._condition.wait_for(
+					lambda: self._owner == name or (self._owner is None and self._waiting_tickets[0] == ticket),
+					timeout = timeout,
+				)
+				if not acquired:
+					self._statistics['n_timeouts'] += 1
+					return False
+				if self._owner == name: # Someone with our same name got it while we were waiting.
+					self._depth += 1
+					return True
+				self._owner = name
+				self._depth = 1
+				self._acquired_when = time.time()
+				waited = self._acquired_when - started_waiting
+				self._statistics['n_acquisitions'] += 1
+				self._statistics['Total wait time (s)'] += waited
+				self._statistics['Max wait time (s)'] = max(self._statistics['Max wait time (s)'], waited)
+				self._events.append({'name': name, 'Wait time (s)': waited, 'Hold time (s)': float('NaN')})
+				return True
+			finally:
+				self._waiting_tickets.remove(ticket)
+				self._condition.notify_all()
+
 	def release(self, name:str):
-		"""Release the lock (only one recursive acquisition level)."""
+		"""Release the lock (only one recursive acquisition level). Raises
+		`RuntimeError` if the lock is not held by `name`."""
 		_check_name(name)
-		if self.locked_by(name):
-			with open(self._path_to_this_lock_file, 'r') as f:
-				locks = f.read().split(SEPARATION_STRING)
-			locks = locks[:-2]
-			if len(locks) == 0: # Release the lock.
-				self._path_to_this_lock_file.unlink()
-			else:
-				with open(self._path_to_this_lock_file, 'w') as f:
-					print(SEPARATION_STRING.join(locks), file=f, end=SEPARATION_STRING)
-	
-	def __call__(self, name:str):
+		with self._condition:
+			if self._owner != name:
+				raise RuntimeError(f'Cannot release lock {repr(self.lock_name)} by {repr(name)} because it is held by {repr(self._owner)}.')
+			self._depth -= 1
+			if self._depth == 0:
+				held = time.time() - self._acquired_when
+				self._statistics['Total hold time (s)'] += held
+				self._statistics['Max hold time (s)'] = max(self._statistics['Max hold time (s)'], held)
+				self._events[-1]['Hold time (s)'] = held
+				self._owner = None
+				self._condition.notify_all()
+
+	def statistics(self)->dict:
+		"""Returns a dictionary with the number of acquisitions, timeouts,
+		and the total and maximum wait and hold times."""
+		with self._condition:
+			statistics = dict(self._statistics)
+			statistics['Owner'] = self._owner
+			statistics['n_waiting'] = len(self._waiting_tickets)
+		return statistics
+
+	def events(self)->list:
+		"""Returns a list with the name, wait time and hold time of the
+		last acquisitions, from older to newer."""
+		with self._condition:
+			return [dict(e) for e in self._events]
+
+	def __call__(self, name:str, timeout:float=None):
+		"""Returns a `NamedLockHolder` to be used in a `with` statement,
+		e.g. `with my_named_lock("a name"):`."""
 		_check_name(name)
-		self._wants_to_acquire = name
+		return NamedLockHolder(self, name, timeout)
+
+class NamedLockHolder:
+	"""Acquires and releases a `CrossProcessNamedLock` on behalf of `name`.
+	If it is destroyed while still holding the lock, e.g. because the
+	process using it died, the lock is released."""
+	def __init__(self, lock:CrossProcessNamedLock, name:str, timeout:float=None):
+		self._lock = lock
+		self._name = name
+		self._timeout = timeout
+		self._depth = 0
+		self._depth_Lock = threading.Lock()
+
+	def acquire(self):
+		if not self._lock.acquire(self._name, self._timeout):
+			raise TimeoutError(f'Could not acquire lock {repr(self._lock.lock_name)} by {repr(self._name)} within {self._timeout} seconds.')
+		with self._depth_Lock:
+			self._depth += 1
+
+	def release(self):
+		with self._depth_Lock:
+			self._depth -= 1
+		self._lock.release(self._name)
+
+	def __enter__(self):
+		self.acquire()
 		return self
-	
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+
+	def __del__(self):
+		while self._depth > 0 and self._lock.locked_by(self._name):
+			self.release()
+
+class NamedLockHolderProxy(BaseProxy):
+	"""Proxy to use a `NamedLockHolder` living in the setup server from
+	another process."""
+	_exposed_ = ('acquire','release')
+
+	def acquire(self):
+		return self._callmethod('acquire')
+
+	def release(self):
+		return self._callmethod('release')
+
 	def __enter__(self):
-		if not hasattr(self, '_wants_to_acquire'):
-			raise RuntimeError(f'To use with a `with` statement you have to call the `NamedLock` object with a name, e.g.: `with my_named_lock("a name"):`.')
-		self.acquire(f'{self._wants_to_acquire}')
-		if hasattr(self, '_wants_to_acquire'): # We have to check because in the meantime someone else could have change this.
-			delattr(self, '_wants_to_acquire')
+		self.acquire()
 		return self
-	
+
 	def __exit__(self, exc_type, exc_value, traceback):
-		self.release(self._acquired_by())
+		self.release()
@@ -1,19 +1,145 @@
-import TeledyneLeCroyPy # https://github.com/SengerM/TeledyneLeCroyPy
 from time import sleep
-from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply, OneCAENChannel # https://github.com/SengerM/CAENpy
 from pathlib import Path
 import pandas
-from CrossProcessLock import CrossProcessNamedLock
+from CrossProcessLock import CrossProcessNamedLock, NamedLockHolderProxy
 from threading import RLock
+import threading
+from collections import deque
+from contextlib import ExitStack
+import time
 from multiprocessing.managers import BaseManager
+import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from shared_memory_waveforms import SharedMemoryWaveformsRing
+import warnings
 
 PATH_TO_CONFIGURATION_FILES_DIRECTORY = Path('/home/sengerm/scripts_and_codes/repos/220921_test_beam/configuration_files')
 
+class SlotsConfigurationSnapshot:
+	"""An immutable copy of the slots configuration. Clients of the setup
+	can get one with `the_setup.get_slots_configuration_snapshot()` and 
+	keep it, instead of asking the setup each time, which is slow because
+	each call goes through the network. A snapshot is valid as long as
+	its `version` is equal to `the_setup.get_slots_configuration_version()`.
+	
+	Example
+	-------
+	```
+	slots_configuration = the_setup.get_slots_configuration_snapshot()
+	for slot_number in slots_configuration.slots_numbers:
+		print(slot_number, slots_configuration.device_name(slot_number))
+	```
+	"""
+	def __init__(self, slots_configuration_df:pandas.DataFrame, version:int):
+		object.__setattr__(self, '_version', version)
+		object.__setattr__(self, '_slots_configuration_df', slots_configuration_df.copy())
+		object.__setattr__(self, '_slots', {int(slot_number): row.to_dict() for slot_number,row in slots_configuration_df.iterrows()})
+	
+	def __setattr__(self, name, value):
+		raise AttributeError(f'`{type(self).__name__}` objects are immutable.')
+	
+	@property
+	def version(self)->int:
+		"""The version of the slots configuration in the setup at the 
+		moment this snapshot was taken."""
+		return self._version
+	
+	@property
+	def slots_numbers(self)->list:
+		"""A list with all the slots numbers."""
+		return list(self._slots)
+	
+	def to_df(self)->pandas.DataFrame:
+		"""Returns the slots configuration as a data frame, as in
+		`TheRobocoldBetaSetup.slots_configuration_df`."""
+		return self._slots_configuration_df.copy()
+	
+	def oscilloscope_channel_number(self, slot_number:int)->int:
+		"""Returns the oscilloscope channel number for the given slot."""
+		return int(self._slots[slot_number]['oscilloscope_channel_number'])
+	
+	def caen_serial_number(self, slot_number:int)->str:
+		"""Returns the serial number of the CAEN used in the given slot."""
+		return self._slots[slot_number]['caen_serial_number']
+	
+	def caen_channel_number(self, slot_number:int)->int:
+		"""Returns the CAEN channel number for the given slot."""
+		return int(self._slots[slot_number]['caen_channel_number'])
+	
+	def device_name(self, slot_number:int)->str:
+		"""Returns the name of the device in the given slot."""
+		return self._slots[slot_number]['device_name']
+	
+	def signal_name(self, slot_number:int)->str:
+		"""Returns the name of the signal in the given slot."""
+		return self._slots[slot_number]['signal_name']
+
+class BiasTelemetryPoller(threading.Thread):
+	"""Thread that periodically measures the bias voltage and current of
+	all the slots and keeps the measurements in a ring buffer, so they
+	can be read without talking to the CAEN each time."""
+	def __init__(self, the_setup, polling_period_seconds:float, buffer_length:int):
+		threading.Thread.__init__(self, daemon=True)
+		self._the_setup = the_setup
+		self.polling_period_seconds = polling_period_seconds
+		self._buffer = deque(maxlen=buffer_length)
+		self._buffer_Lock = RLock()
+		self._stop_Event = threading.Event()
+		self.last_error = None
+	
+	def run(self):
+		while not self._stop_Event.is_set():
+			try:
+				measured = self._the_setup.measure_bias_all_slots()
+			except Exception as e:
+				self.last_error = e
+			else:
+				with self._buffer_Lock:
+					self._buffer.append(measured)
+			self._stop_Event.wait(self.polling_period_seconds)
+	
+	def stop(self):
+		self._stop_Event.set()
+	
+	def latest(self)->dict:
+		"""Returns the last measurement, or `None` if there is none yet."""
+		with self._buffer_Lock:
+			return self._buffer[-1] if len(self._buffer) > 0 else None
+	
+	def window(self, since:datetime.datetime=None, until:datetime.datetime=None)->list:
+		"""Returns a list with all the measurements in the buffer taken
+		between `since` and `until`."""
+		with self._buffer_Lock:
+			measurements = list(self._buffer)
+		return [m for m in measurements if (since is None or m['When'] >= since) and (until is None or m['When'] <= until)]
+
 class TheRobocoldBetaSetup:
 	"""This class wraps all the hardware so if there are changes it is 
 	easy to adapt. It should be thread safe.
 	"""
-	def __init__(self, path_to_slots_configuration_file:Path=None):
+	def __init__(self, path_to_slots_configuration_file:Path=None, bias_telemetry_polling_period_seconds:float=1, bias_telemetry_buffer_length:int=3600, oscilloscope=None, caens:dict=None, caen_channel_class=None):
+		"""
+		Parameters
+		----------
+		path_to_slots_configuration_file: Path, optional
+			Path to the CSV file with the slots configuration.
+		bias_telemetry_polling_period_seconds: float, default 1
+			Period with which the bias voltage and current of all the slots
+			are measured in the background, see `get_latest_bias_telemetry`.
+			If `None`, there is no background measurement.
+		bias_telemetry_buffer_length: int, default 3600
+			Number of background measurements to keep in memory.
+		oscilloscope: optional
+			The oscilloscope to use. If `None`, the LeCroy of the setup.
+			This is to use simulated hardware, see `simulated_hardware.py`.
+		caens: dict, optional
+			A dictionary of the form `{serial_number: CAEN}` with the CAEN
+			power supplies to use. If `None`, the ones of the setup.
+		caen_channel_class: optional
+			The class used to access one channel of a CAEN, it is called
+			as `caen_channel_class(caen, channel_number)`. If `None`, `CAENpy`'s
+			`OneCAENChannel`.
+		"""
 		if path_to_slots_configuration_file is None:
 			path_to_slots_configuration_file = Path('slots_configuration.csv')
 		for name in {'path_to_slots_configuration_file'}:
@@ -24,10 +150,20 @@ class TheRobocoldBetaSetup:
 		self.slots_configuration_df # This will trigger the load of the file, so if it fails it does now.
 		
 		# Hardware elements ---
-		self._oscilloscope = TeledyneLeCroyPy.LeCroyWaveRunner('USB0::0x05ff::0x1023::4751N40408::INSTR')
-		self._caens = {
-			'13398': CAENDesktopHighVoltagePowerSupply(port='/dev/ttyACM0'), # DT1470ET, the new one.
-		}
+		if oscilloscope is None:
+			import TeledyneLeCroyPy # https://github.com/SengerM/TeledyneLeCroyPy
+			oscilloscope = TeledyneLeCroyPy.LeCroyWaveRunner('USB0::0x05ff::0x1023::4751N40408::INSTR')
+		if caens is None:
+			from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePowerSupply # https://github.com/SengerM/CAENpy
+			caens = {
+				'13398': CAENDesktopHighVoltagePowerSupply(port='/dev/ttyACM0'), # DT1470ET, the new one.
+			}
+		if caen_channel_class is None:
+			from CAENpy.CAENDesktopHighVoltagePowerSupply import OneCAENChannel # https://github.com/SengerM/CAENpy
+			caen_channel_class = OneCAENChannel
+		self._oscilloscope = oscilloscope
+		self._caens = caens
+		self._caen_channel_class = caen_channel_class
 		
 		# Locks for hardware ---
 		# These locks ensure that each hardware is accessed only once at
@@ -37,10 +173,26 @@ class TheRobocoldBetaSetup:
 		# Locks for the user to hold ---
 		# These locks are so the user can hold the control of a part of
 		# the setup for an extended period of time. I had to write my own
-		# lock because the ones existing in Python are not compatible
-		# with multiple processes.
-		self._bias_for_slot_Lock = {slot_number: CrossProcessNamedLock(Path.home()) for slot_number in self.slots_configuration_df.index}
-		self._signal_acquisition_Lock = CrossProcessNamedLock(Path.home())
+		# lock because the ones existing in Python are owned by threads,
+		# while here the owner is whoever has a given name, no matter from
+		# which process or thread. Clients use them through proxies, see
+		# `connect_me_with_the_setup`.
+		self._bias_for_slot_Lock = {slot_number: CrossProcessNamedLock(f'bias for slot {slot_number}') for slot_number in self.slots_configuration_df.index}
+		self._signal_acquisition_Lock = CrossProcessNamedLock('signal acquisition')
+		
+		# Shared memory for waveforms ---
+		self._shared_memory_waveforms_ring = None # Created the first time it is needed, see `get_waveform_in_shared_memory`.
+		self._shared_memory_waveforms_ring_Lock = RLock()
+		
+		# Background monitoring ---
+		self._bias_telemetry_poller = None
+		if bias_telemetry_polling_period_seconds is not None:
+			self._bias_telemetry_poller = BiasTelemetryPoller(
+				the_setup = self,
+				polling_period_seconds = bias_telemetry_polling_period_seconds,
+				buffer_length = bias_telemetry_buffer_length,
+			)
+			self._bias_telemetry_poller.start()
 	
 	@property
 	def description(self) -> str:
@@ -54,12 +206,12 @@ class TheRobocoldBetaSetup:
 					'object': self._oscilloscope,
 					'lock': self._oscilloscope_Lock,
 				},
-			'caen 1': 
-				{
-					'object': self._caens['13398'],
-					'lock': self._caen_Lock,
-				},
 		}
+		for caen_serial_number in sorted(self._caens):
+			instruments[f'caen {caen_serial_number}'] = {
+				'object': self._caens[caen_serial_number],
+				'lock': self._caen_Lock,
+			}
 		string =  'Instruments\n'
 		string += '-----------\n\n'
 		for instrument in instruments:
@@ -74,23 +226,50 @@ class TheRobocoldBetaSetup:
 	def slots_configuration_df(self):
 		"""Returns a data frame with the configuration as specified in
 		the slots configuration file."""
-		if not hasattr(self, '_slots_configuration_df'):
-			self._slots_configuration_df = pandas.read_csv(
-				self.path_to_slots_configuration_file,
-				dtype = {
-					'slot_number': int,
-					'device_name': str,
-					'caen_serial_number': str,
-					'caen_channel_number': int,
-					'oscilloscope_channel_number': int,
-				},
-				index_col = 'slot_number',
+		return self.slots_configuration_snapshot.to_df()
+	
+	@property
+	def slots_configuration_snapshot(self)->SlotsConfigurationSnapshot:
+		"""Returns a `SlotsConfigurationSnapshot` with the configuration
+		as specified in the slots configuration file."""
+		if not hasattr(self, '_slots_configuration_snapshot'):
+			self._slots_configuration_snapshot = SlotsConfigurationSnapshot(
+				slots_configuration_df = self._read_slots_configuration_file(),
+				version = 0,
 			)
-		return self._slots_configuration_df.copy()
+		return self._slots_configuration_snapshot
+	
+	def _read_slots_configuration_file(self)->pandas.DataFrame:
+		return pandas.read_csv(
+			self.path_to_slots_configuration_file,
+			dtype = {
+				'slot_number': int,
+				'device_name': str,
+				'caen_serial_number': str,
+				'caen_channel_number': int,
+				'oscilloscope_channel_number': int,
+			},
+			index_col = 'slot_number',
+		)
+	
+	def reload_slots_configuration(self):
+		"""Reads again the slots configuration file. If it changed, the
+		version of the slots configuration is increased, so the clients
+		know that their snapshots are outdated."""
+		slots_configuration_df = self._read_slots_configuration_file()
+		if slots_configuration_df.equals(self.slots_configuration_snapshot.to_df()):
+			return
+		self._slots_configuration_snapshot = SlotsConfigurationSnapshot(
+			slots_configuration_df = slots_configuration_df,
+			version = self.slots_configuration_snapshot.version + 1,
+		)
+		for slot_number in self._slots_configuration_snapshot.slots_numbers:
+			if slot_number not in self._bias_for_slot_Lock:
+				self._bias_for_slot_Lock[slot_number] = CrossProcessNamedLock(f'bias for slot {slot_number}')
 	
 	# Bias voltage power supply ----------------------------------------
 	
-	def hold_control_of_bias_for_slot_number(self, slot_number:int, who:str):
+	def hold_control_of_bias_for_slot_number(self, slot_number:int, who:str, timeout:float=None):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the bias conditions for the slot. Note 
 		that others will be able to measure, but not change the voltage/current.
@@ -106,6 +285,10 @@ class TheRobocoldBetaSetup:
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		timeout: float, optional
+			Maximum number of seconds to wait for the control. If it cannot
+			be acquired within this time, `TimeoutError` is raised. If `None`,
+			waits forever.
 		
 		Example
 		-------
@@ -115,7 +298,7 @@ class TheRobocoldBetaSetup:
 			the_setup.set_bias_voltage(slot_number, volts, my_name) # This will not change unless you change it here.
 		```
 		"""
-		return self._bias_for_slot_Lock[slot_number](who)
+		return self._bias_for_slot_Lock[slot_number](who, timeout=timeout)
 	
 	def is_bias_slot_number_being_hold_by_someone(self, slot_number:int):
 		"""Returns `True` if anybody is holding the control of the bias
@@ -152,7 +335,7 @@ class TheRobocoldBetaSetup:
 			are not multiprocess friendly.
 		freeze_until_not_ramping_anymore: bool, default True
 			If `True`, the method will hold the execution frozen until the
-			CAEN says it has stopped ramping the voltage. If `False`, returns
+			voltage is settled, see `set_bias_voltages`. If `False`, returns
 			immediately after setting the voltage. This function is "thread
 			friendly" in the sense that it will not block the whole access
 			to the CAEN power supplies while it waits for the ramping to
@@ -162,17 +345,91 @@ class TheRobocoldBetaSetup:
 			raise TypeError(f'`volts` must be a float number, received object of type {type(volts)}.')
 		if not isinstance(block_until_not_ramping_anymore, bool):
 			raise TypeError(f'`block_until_not_ramping_anymore` must be boolean.')
-		with self._bias_for_slot_Lock[slot_number](who):
-			caen_channel = self._caen_channel_given_slot_number(slot_number)
+		if block_until_not_ramping_anymore:
+			self.set_bias_voltages({slot_number: volts}, who)
+		else:
+			with self._bias_for_slot_Lock[slot_number](who):
+				caen_channel = self._caen_channel_given_slot_number(slot_number)
+				with self._caen_Lock:
+					caen_channel.V_set = volts
+	
+	def set_bias_voltages(self, bias_voltages:dict, who:str, timeout_seconds:float=999, settle_window_seconds:float=3, voltage_tolerance:float=1, current_relative_tolerance:float=.1, current_absolute_tolerance:float=1e-9, polling_period_seconds:float=.5)->dict:
+		"""Set the bias voltage of many slots at once, and wait until all
+		of them are settled. All the slots ramp at the same time. A slot
+		is considered settled when the CAEN says it is not ramping and its
+		voltage and current have been stable during the last `settle_window_seconds`.
+		A slot that settles at a voltage different from the one set, e.g.
+		because it is in current compliance, is not waited for: a warning
+		is issued instead.
+		
+		Parameters
+		----------
+		bias_voltages: dict
+			A dictionary of the form `{slot_number: volts}`.
+		who: str
+			A string identifying you, see `set_bias_voltage`.
+		timeout_seconds: float, default 999
+			If not all the slots are settled after this time, `TimeoutError`
+			is raised.
+		settle_window_seconds: float, default 3
+			Time during which the voltage and current have to be stable.
+		voltage_tolerance: float, default 1
+			During the settle window the measured voltage must not change
+			by more than this. If, once settled, it is not within this from
+			the set voltage, a warning is issued.
+		current_relative_tolerance: float, default 0.1
+			During the settle window the measured current must not change
+			by more than this fraction of its value...
+		current_absolute_tolerance: float, default 1e-9
+			...or by more than this, whichever is greater.
+		polling_period_seconds: float, default 0.5
+			Time between measurements of the voltage and current.
+		
+		Returns
+		-------
+		ramp_durations: dict
+			A dictionary of the form `{slot_number: seconds}` with the time
+			it took for each slot to be settled.
+		"""
+		if not isinstance(bias_voltages, dict):
+			raise TypeError(f'`bias_voltages` must be a dictionary, received object of type {type(bias_voltages)}.')
+		for slot_number,volts in bias_voltages.items():
+			if not isinstance(volts, (int, float)):
+				raise TypeError(f'The voltages in `bias_voltages` must be float numbers, received object of type {type(volts)} for slot {slot_number}.')
+		with ExitStack() as stack:
+			for slot_number in bias_voltages:
+				stack.enter_context(self._bias_for_slot_Lock[slot_number](who))
+			caen_channels = {slot_number: self._caen_channel_given_slot_number(slot_number) for slot_number in bias_voltages}
 			with self._caen_Lock:
-				caen_channel.V_set = volts
-			if block_until_not_ramping_anymore:
-				sleep(1) # It takes a while for the CAEN to realize that it has to change the voltage...
-				while True:
-					if self.is_ramping_bias_voltage(slot_number) == False:
-						break
-					sleep(1)
-				sleep(3) # Empirically, after CAEN says it is not ramping anymore, you have to wait 3 seconds to be sure it actually stopped ramping...
+				for slot_number,volts in bias_voltages.items():
+					caen_channels[slot_number].V_set = volts
+			started = time.time()
+			
+			history = {slot_number: deque() for slot_number in bias_voltages} # `(time, voltage, current)` measured for each slot.
+			ramp_durations = {}
+			while len(ramp_durations) < len(bias_voltages):
+				if time.time() - started > timeout_seconds:
+					raise TimeoutError(f'Slots {sorted(set(bias_voltages)-set(ramp_durations))} did not settle after {timeout_seconds} s. Is the output on?')
+				sleep(polling_period_seconds)
+				not_settled_yet = [slot_number for slot_number in bias_voltages if slot_number not in ramp_durations]
+				measured = self.measure_bias_all_slots(not_settled_yet)
+				with self._caen_Lock:
+					is_ramping = [caen_channels[slot_number].is_ramping for slot_number in not_settled_yet]
+				now = time.time()
+				for slot_number,V,I,ramping in zip(not_settled_yet, measured['Bias voltage (V)'], measured['Bias current (A)'], is_ramping):
+					history[slot_number].append((now,V,I))
+					while history[slot_number][0][0] < now - settle_window_seconds - polling_period_seconds/2:
+						history[slot_number].popleft() # Keep only the samples in the settle window.
+					if ramping or history[slot_number][0][0] > now - settle_window_seconds + polling_period_seconds/2:
+						continue # Still ramping, or not enough samples yet to cover the whole window.
+					_, voltages, currents = zip(*history[slot_number])
+					is_voltage_stable = max(voltages) - min(voltages) <= voltage_tolerance
+					is_current_stable = max(currents) - min(currents) <= max(current_relative_tolerance*max(abs(I) for I in currents), current_absolute_tolerance)
+					if is_voltage_stable and is_current_stable:
+						ramp_durations[slot_number] = now - started
+						if abs(sum(voltages)/len(voltages) - bias_voltages[slot_number]) > voltage_tolerance: # E.g. in compliance or in breakdown, it will not get any closer.
+							warnings.warn(f'Slot {slot_number} settled at {sum(voltages)/len(voltages):.1f} V while it was set to {bias_voltages[slot_number]} V, the current is {currents[-1]:.2e} A.')
+			return ramp_durations
 	
 	def is_ramping_bias_voltage(self, slot_number:int)->bool:
 		caen_channel = self._caen_channel_given_slot_number(slot_number)
@@ -185,6 +442,100 @@ class TheRobocoldBetaSetup:
 		with self._caen_Lock:
 			return caen_channel.I_mon
 	
+	def measure_bias_all_slots(self, slots_numbers:list=None)->dict:
+		"""Measures the bias voltage and current of many slots at once.
+		This is faster than calling `measure_bias_voltage` and 
+		`measure_bias_current` for each slot because the access to the 
+		CAEN is acquired only once.
+		
+		Parameters
+		----------
+		slots_numbers: list of int, optional
+			The slots to measure. If nothing is passed, all the slots are
+			measured.
+		
+		Returns
+		-------
+		measured: dict
+			A dictionary of the form
+			```
+			{
+				'Bias voltage (V)': [float, float, ...],
+				'Bias current (A)': [float, float, ...],
+				'slot_number': [int, int, ...],
+				'When': datetime.datetime,
+			}
+			```
+			which can be directly converted into a `pandas.DataFrame`.
+		"""
+		if slots_numbers is None:
+			slots_numbers = self.slots_configuration_snapshot.slots_numbers
+		caen_channels = [self._caen_channel_given_slot_number(slot_number) for slot_number in slots_numbers]
+		with self._caen_Lock:
+			when = datetime.datetime.now()
+			bias_voltages = [caen_channel.V_mon for caen_channel in caen_channels]
+			bias_currents = [caen_channel.I_mon for caen_channel in caen_channels]
+		return {
+			'Bias voltage (V)': bias_voltages,
+			'Bias current (A)': bias_currents,
+			'slot_number': list(slots_numbers),
+			'When': when,
+		}
+	
+	def get_latest_bias_telemetry(self, slots_numbers:list=None, max_age_seconds:float=None)->dict:
+		"""Returns the most recent bias voltage and current measured in 
+		the background, without talking to the CAEN. If there is no
+		background measurement or it is older than `max_age_seconds`,
+		a new measurement is performed instead.
+		
+		Parameters
+		----------
+		slots_numbers: list of int, optional
+			The slots for which you want the measurements. If nothing is
+			passed, all the slots are returned.
+		max_age_seconds: float, optional
+			If given, measurements older than this are not used.
+		
+		Returns
+		-------
+		measured: dict
+			A dictionary in the same format as `measure_bias_all_slots`.
+		"""
+		if slots_numbers is None:
+			slots_numbers = self.slots_configuration_snapshot.slots_numbers
+		latest = self._bias_telemetry_poller.latest() if self._bias_telemetry_poller is not None else None
+		if latest is None or not set(slots_numbers).issubset(latest['slot_number']) or (max_age_seconds is not None and (datetime.datetime.now()-latest['When']).total_seconds() > max_age_seconds):
+			return self.measure_bias_all_slots(slots_numbers)
+		positions = [latest['slot_number'].index(slot_number) for slot_number in slots_numbers]
+		return {
+			'Bias voltage (V)': [latest['Bias voltage (V)'][i] for i in positions],
+			'Bias current (A)': [latest['Bias current (A)'][i] for i in positions],
+			'slot_number': list(slots_numbers),
+			'When': latest['When'],
+		}
+	
+	def get_bias_telemetry(self, since:datetime.datetime=None, until:datetime.datetime=None)->pandas.DataFrame:
+		"""Returns all the bias voltage and current measurements done in
+		the background between `since` and `until` that are still in 
+		memory, as a data frame with the columns `When`, `slot_number`,
+		`Bias voltage (V)` and `Bias current (A)`. This does not talk to
+		the CAEN."""
+		if self._bias_telemetry_poller is None:
+			raise RuntimeError(f'The bias telemetry is disabled.')
+		measurements = self._bias_telemetry_poller.window(since=since, until=until)
+		if len(measurements) == 0:
+			return pandas.DataFrame(columns=['When','slot_number','Bias voltage (V)','Bias current (A)'])
+		return pandas.concat([pandas.DataFrame(m) for m in measurements], ignore_index=True)[['When','slot_number','Bias voltage (V)','Bias current (A)']]
+	
+	def set_bias_telemetry_polling_period(self, seconds:float):
+		"""Change the period with which the bias voltage and current are
+		measured in the background."""
+		if self._bias_telemetry_poller is None:
+			raise RuntimeError(f'The bias telemetry is disabled.')
+		if not isinstance(seconds, (int, float)) or seconds <= 0:
+			raise ValueError(f'`seconds` must be a positive number, received {repr(seconds)}.')
+		self._bias_telemetry_poller.polling_period_seconds = seconds
+	
 	def set_current_compliance(self, slot_number:int, amperes:float, who:str):
 		"""Set the current compliance for the given slot."""
 		if not isinstance(amperes, (int, float)):
@@ -226,7 +577,7 @@ class TheRobocoldBetaSetup:
 	
 	# Signal acquiring -------------------------------------------------
 	
-	def hold_signal_acquisition(self, who:str):
+	def hold_signal_acquisition(self, who:str, timeout:float=None):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the signal acquisition system, i.e. the
 		oscilloscope and the RF multiplexer (The Castle).
@@ -237,6 +588,10 @@ class TheRobocoldBetaSetup:
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		timeout: float, optional
+			Maximum number of seconds to wait for the control. If it cannot
+			be acquired within this time, `TimeoutError` is raised. If `None`,
+			waits forever.
 		
 		Example
 		-------
@@ -245,7 +600,7 @@ class TheRobocoldBetaSetup:
 			# Nobody else from other thread can change anything from the oscilloscope or The Castle.
 		```
 		"""
-		return self._signal_acquisition_Lock(who)
+		return self._signal_acquisition_Lock(who, timeout=timeout)
 	
 	def set_oscilloscope_vdiv(self, oscilloscope_channel_number:int, vdiv:float, who:str):
 		"""Set the vertical scale of the given channel in the oscilloscope."""
@@ -279,6 +634,52 @@ class TheRobocoldBetaSetup:
 		with self._oscilloscope_Lock:
 			return self._oscilloscope.get_waveform(channel=oscilloscope_channel_number)
 	
+	def get_waveform_in_shared_memory(self, oscilloscope_channel_number:int, timeout:float=None)->dict:
+		"""Same as `get_waveform` but the waveforms are not returned, instead
+		they are placed in shared memory and only a small descriptor is
+		returned. This avoids sending all the data through the connection
+		with the setup, but only works for clients running in the same
+		computer. Read them with `shared_memory_waveforms.read_shared_memory_waveforms`
+		and then call `release_waveform_in_shared_memory`.
+		
+		Parameters
+		----------
+		oscilloscope_channel_number: int
+			The number of channel you want to read from the oscilloscope.
+		timeout: float, optional
+			Maximum number of seconds to wait for a free shared memory buffer.
+			If `None`, waits forever.
+		
+		Returns
+		-------
+		descriptor: dict
+			See `SharedMemoryWaveformsRing.write`.
+		"""
+		with self._shared_memory_waveforms_ring_Lock:
+			if self._shared_memory_waveforms_ring is None:
+				self._shared_memory_waveforms_ring = SharedMemoryWaveformsRing()
+		return self._shared_memory_waveforms_ring.write(
+			segments = self.get_waveform(oscilloscope_channel_number),
+			timeout = timeout,
+		)
+	
+	def release_waveform_in_shared_memory(self, descriptor:dict):
+		"""Releases the shared memory buffer given by `get_waveform_in_shared_memory`,
+		so it can be used again."""
+		self._shared_memory_waveforms_ring.release(descriptor)
+	
+	def close(self):
+		"""Stops the background monitoring and frees the shared memory
+		used by `get_waveform_in_shared_memory`. Call it when the setup
+		is not going to be used anymore, e.g. when the server shuts down,
+		otherwise the shared memory is leaked."""
+		if self._bias_telemetry_poller is not None:
+			self._bias_telemetry_poller.stop()
+		with self._shared_memory_waveforms_ring_Lock:
+			if self._shared_memory_waveforms_ring is not None:
+				self._shared_memory_waveforms_ring.close()
+				self._shared_memory_waveforms_ring = None
+	
 	# Temperature and humidity sensor ----------------------------------
 	
 	def measure_temperature(self):
@@ -293,12 +694,21 @@ class TheRobocoldBetaSetup:
 	
 	def get_name_of_device_in_slot_number(self, slot_number:int)->str:
 		"""Get the name of the device in the given slot."""
-		return self.slots_configuration_df.loc[slot_number,'device_name']
+		return self.slots_configuration_snapshot.device_name(slot_number)
 	
 	def _caen_channel_given_slot_number(self, slot_number:int):
-		caen_serial_number = self.slots_configuration_df.loc[slot_number,'caen_serial_number']
-		caen_channel_number = int(self.slots_configuration_df.loc[slot_number,'caen_channel_number'])
-		return OneCAENChannel(self._caens[caen_serial_number], caen_channel_number)
+		caen_serial_number = self.slots_configuration_snapshot.caen_serial_number(slot_number)
+		caen_channel_number = self.slots_configuration_snapshot.caen_channel_number(slot_number)
+		return self._caen_channel_class(self._caens[caen_serial_number], caen_channel_number)
+	
+	def get_locks_statistics(self)->pandas.DataFrame:
+		"""Returns a data frame with one row per lock that users can hold,
+		with the number of times it was acquired, the number of timeouts,
+		the total and maximum wait and hold times, who owns it now and how
+		many are waiting for it."""
+		locks = [self._signal_acquisition_Lock] + [self._bias_for_slot_Lock[slot_number] for slot_number in sorted(self._bias_for_slot_Lock)]
+		statistics = pandas.DataFrame.from_records([dict(lock_name=lock.lock_name, **lock.statistics()) for lock in locks])
+		return statistics.set_index('lock_name')
 	
 	def get_description(self)->str:
 		"""Same as `.description` but without the property decorator,
@@ -315,12 +725,161 @@ class TheRobocoldBetaSetup:
 		because the properties fail in multiprocess applications."""
 		return self.slots_configuration_df
 	
-def connect_me_with_the_setup():
+	def get_slots_configuration_snapshot(self)->SlotsConfigurationSnapshot:
+		"""Same as `.slots_configuration_snapshot` but without the property decorator,
+		because the properties fail in multiprocess applications."""
+		return self.slots_configuration_snapshot
+	
+	def get_slots_configuration_version(self)->int:
+		"""Returns the version of the slots configuration. If it is 
+		different from the `version` of a `SlotsConfigurationSnapshot`,
+		such snapshot is outdated."""
+		return self.slots_configuration_snapshot.version
+	
+	# Batched calls ----------------------------------------------------
+	
+	def call_batch(self, calls:list, parallel:bool=False)->list:
+		"""Executes several methods of the setup within a single call, so
+		clients connected through `connect_me_with_the_setup` pay only
+		one round trip for all of them. Normally you don't use this
+		directly but through `SetupCallsBatch`.
+		
+		Arguments
+		---------
+		calls: list
+			A list of `(method_name, args, kwargs)` tuples, where `method_name`
+			is the name of any of the public methods of the setup.
+		parallel: bool, default False
+			If `False`, the calls are executed one after the other in the
+			given order and once one of them fails the next ones are not
+			executed. If `True`, they are all executed at the same time,
+			use this only for calls that don't depend on each other.
+		
+		Returns
+		-------
+		results: list
+			One dictionary per call, in the same order, of the form
+			`{'result': object, 'exception': Exception, 'Elapsed time (s)': float}`
+			where `'exception'` is `None` if the call succeeded.
+		"""
+		methods = []
+		for method_name, args, kwargs in calls:
+			if method_name.startswith('_') or method_name in METHODS_RETURNING_LOCK_HOLDERS or method_name == 'call_batch' or not callable(getattr(self, method_name, None)):
+				raise ValueError(f'Method {repr(method_name)} cannot be called in a batch.')
+			methods.append(getattr(self, method_name))
+		
+		def execute(method, args, kwargs)->dict:
+			started = time.time()
+			try:
+				result = {'result': method(*args, **kwargs), 'exception': None}
+			except Exception as e:
+				result = {'result': None, 'exception': e}
+			result['Elapsed time (s)'] = time.time() - started
+			return result
+		
+		if parallel:
+			with ThreadPoolExecutor(max_workers=len(calls) or 1) as executor:
+				futures = [executor.submit(execute, method, args, kwargs) for method, (_, args, kwargs) in zip(methods, calls)]
+				return [future.result() for future in futures]
+		
+		results = []
+		for method, (method_name, args, kwargs) in zip(methods, calls):
+			if len(results) > 0 and results[-1]['exception'] is not None:
+				results.append({'result': None, 'exception': RuntimeError(f'{repr(method_name)} was not executed because a previous call in the batch failed.'), 'Elapsed time (s)': 0})
+				continue
+			results.append(execute(method, args, kwargs))
+		return results
+	
+class SetupCallsBatch:
+	"""Collects calls to methods of the setup and sends all of them in
+	a single request, instead of one request per call. The methods have
+	the same names and arguments as in `TheRobocoldBetaSetup` but each
+	call returns a `concurrent.futures.Future` that will have the result
+	once the batch is executed.
+	
+	Example
+	-------
+	```
+	batch = SetupCallsBatch(the_setup)
+	batch.wait_for_trigger(who=my_name)
+	waveforms = {n_channel: batch.get_waveform(n_channel) for n_channel in [1,2,3,4]}
+	bias = batch.get_latest_bias_telemetry([1,2,3,4])
+	batch.execute() # Everything is done here, in one round trip.
+	waveforms = {n_channel: waveforms[n_channel].result() for n_channel in waveforms}
+	```
+	Use `.submit()` instead of `.execute()` to send the batch without
+	waiting for it, e.g. to send another batch in the meantime.
+	"""
+	_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='SetupCallsBatch') # Shared by all batches, so each of its threads keeps its connection with the setup open.
+	
+	def __init__(self, the_setup, parallel:bool=False):
+		"""
+		Arguments
+		---------
+		the_setup:
+			The object returned by `connect_me_with_the_setup`, or a
+			`TheRobocoldBetaSetup`.
+		parallel: bool, default False
+			See `TheRobocoldBetaSetup.call_batch`.
+		"""
+		self._the_setup = the_setup
+		self._parallel = parallel
+		self._calls = []
+		self._futures = []
+		self._batch_future = None
+		self.elapsed_seconds = None
+	
+	def __getattr__(self, method_name:str):
+		if method_name.startswith('_'):
+			raise AttributeError(method_name)
+		def add_call(*args, **kwargs)->Future:
+			if self._batch_future is not None:
+				raise RuntimeError(f'This batch was already sent, create a new one.')
+			self._calls.append((method_name, args, kwargs))
+			self._futures.append(Future())
+			return self._futures[-1]
+		return add_call
+	
+	def _send(self):
+		try:
+			results = self._the_setup.call_batch(self._calls, parallel=self._parallel)
+		except Exception as e:
+			for future in self._futures:
+				future.set_exception(e)
+			raise
+		self.elapsed_seconds = [result['Elapsed time (s)'] for result in results]
+		for future, result in zip(self._futures, results):
+			if result['exception'] is None:
+				future.set_result(result['result'])
+			else:
+				future.set_exception(result['exception'])
+	
+	def submit(self)->Future:
+		"""Sends the batch in the background and returns immediately.
+		Returns a `concurrent.futures.Future` that is done when the whole
+		batch is done."""
+		if self._batch_future is None:
+			self._batch_future = self._executor.submit(self._send)
+		return self._batch_future
+	
+	def execute(self)->list:
+		"""Sends the batch, waits for it to finish and returns the results
+		of all the calls. If any of them failed, its exception is raised."""
+		self.submit().result()
+		return [future.result() for future in self._futures]
+	
+METHODS_RETURNING_LOCK_HOLDERS = {
+	'hold_signal_acquisition': 'NamedLockHolder',
+	'hold_control_of_bias_for_slot_number': 'NamedLockHolder',
+} # The objects returned by these methods stay in the server and the clients get a proxy, so they all use the same lock.
+
+def connect_me_with_the_setup(address:tuple=('', 50000)):
 	class TheSetup(BaseManager):
 		pass
 
-	TheSetup.register('get_the_setup')
-	m = TheSetup(address=('', 50000), authkey=b'abracadabra')
+	TheSetup.register('get_the_setup', method_to_typeid=METHODS_RETURNING_LOCK_HOLDERS)
+	TheSetup.register('NamedLockHolder', proxytype=NamedLockHolderProxy, create_method=False)
+	m = TheSetup(address=address, authkey=b'abracadabra')
 	m.connect()
 	the_setup = m.get_the_setup()
 	return the_setup
@@ -345,7 +904,8 @@ if __name__=='__main__':
 		path_to_slots_configuration_file = Path('configuration_files/slots_configuration.csv'),
 	)
 	
-	TheSetupManager.register('get_the_setup', callable=lambda:the_setup)
+	TheSetupManager.register('get_the_setup', callable=lambda:the_setup, method_to_typeid=METHODS_RETURNING_LOCK_HOLDERS)
+	TheSetupManager.register('NamedLockHolder', proxytype=NamedLockHolderProxy, create_method=False)
 	m = TheSetupManager(address=('', 50000), authkey=b'abracadabra')
 	s = m.get_server()
 	print('Ready!')
@@ -353,3 +913,5 @@ if __name__=='__main__':
 		s.serve_forever()
 	except Exception as e:
 		reporter.send_message(f'🔥 `TheRobocoldBetaSetup` crashed! Reason: `{repr(e)}`.')
+	finally:
+		the_setup.close()
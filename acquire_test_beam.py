@@ -3,56 +3,302 @@ from pathlib import Path
 import pandas
 import datetime
 import time
-from TheSetup import connect_me_with_the_setup
+from TheSetup import connect_me_with_the_setup, SlotsConfigurationSnapshot, SetupCallsBatch
 from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe # https://github.com/SengerM/huge_dataframe
+from waveforms_store import WaveformsDumper, WAVEFORMS_STORE_DIRECTORY_NAME
+from shared_memory_waveforms import read_shared_memory_waveforms
+from stages_timing import StagesTimer, summarize_stages_timing
 import datetime
 import threading
-from parse_waveforms import parse_waveforms
+import queue
+from parse_waveforms import parse_waveforms, start_parsing_while_acquiring, SpillsParser
+from waveforms_gallery import render_waveforms_gallery
 from progressreporting.TelegramProgressReporter import TelegramReporter # https://github.com/SengerM/progressreporting
 from contextlib import nullcontext, ExitStack
 import my_telegram_bots
 import numpy
 import plotly.express as px
+import shutil
+import warnings
 
-def trigger_and_measure_dut_stuff(the_setup, name_to_access_to_the_setup:str, slots_numbers:list)->pandas.DataFrame:
-	elapsed_seconds = 9999
-	while elapsed_seconds > 5: # Because of multiple threads locking the different elements of the_setup, it can happen that this gets blocked for a long time. Thus, the measured data will no longer belong to a single point in time as we expect...:
-		while True:
-			the_setup.wait_for_trigger(who=name_to_access_to_the_setup)
+MAX_AGE_OF_BIAS_TELEMETRY_SECONDS = 3 # Bias voltage and current measured in the background by the setup are used if they are not older than this, so there is no need to talk to the CAEN after each trigger.
+
+def _release_waveforms_in_shared_memory(the_setup, descriptors:list):
+	"""Gives back to the setup the shared memory buffers of `descriptors`,
+	as returned by `get_waveform_in_shared_memory`, without waiting for it."""
+	release = SetupCallsBatch(the_setup)
+	for descriptor in descriptors:
+		release.release_waveform_in_shared_memory(descriptor).add_done_callback(_warn_if_the_release_failed) # If it fails the buffer is lost until its lease expires, so it has to be known.
+	release.submit() # No need to wait for this.
+
+def _warn_if_the_release_failed(future):
+	if future.exception() is not None:
+		warnings.warn(f'Could not release waveforms in shared memory, they will be taken back by the setup when their lease expires. Reason: `{repr(future.exception())}`.')
+
+def trigger_and_read_everything(the_setup, name_to_access_to_the_setup:str, slots_numbers:list, slots_configuration:SlotsConfigurationSnapshot, use_shared_memory:bool=False, timer:StagesTimer=None):
+	"""Waits for the next trigger and reads the waveforms of all the slots
+	together with the latest bias voltage and current of each of them,
+	everything requested to the setup in one single batch, see `SetupCallsBatch`.
+	If the oscilloscope gives a number of waveforms that does not coincide
+	with the number of segments, it waits for the next trigger.
+	
+	Arguments
+	---------
+	use_shared_memory: bool, default False
+		If `True`, the waveforms are transferred through shared memory
+		instead of through the connection with the setup. Only possible
+		if the setup runs in the same computer.
+	timer: StagesTimer, optional
+		If given, the time spent in each stage is added to it.
+	
+	Returns
+	-------
+	measured_stuff: pandas.DataFrame
+		A data frame with one row per slot and the columns `'Bias voltage (V)'`,
+		`'Bias current (A)'`, `'device_name'`, `'slot_number'`, `'signal_name'`
+		and `'When'`.
+	waveforms: dict
+		A dictionary of the form `{slot_number: segments}`, see `build_spill`.
+	"""
+	if timer is None:
+		timer = StagesTimer()
+	while True:
+		batch = SetupCallsBatch(the_setup)
+		batch.wait_for_trigger(who=name_to_access_to_the_setup)
+		get_waveform = batch.get_waveform_in_shared_memory if use_shared_memory else batch.get_waveform
+		waveforms = {slot_number: get_waveform(slots_configuration.oscilloscope_channel_number(slot_number)) for slot_number in slots_numbers}
+		bias_telemetry = batch.get_latest_bias_telemetry(slots_numbers, max_age_seconds=MAX_AGE_OF_BIAS_TELEMETRY_SECONDS)
+		stage_of_each_call = ['Trigger (s)'] + [f'Readout slot {slot_number} (s)' for slot_number in slots_numbers] + ['Bias telemetry (s)'] # In the same order as the calls were added to the batch.
+		executed = False
+		try:
+			with timer('Batch round trip (s)'):
+				batch.execute()
+			executed = True
+		except RuntimeError as e:
+			if 'The number of waveforms does not conincide with the number of segments.' in str(e):
+				continue
+			else:
+				raise e
+		finally:
+			if use_shared_memory and not executed: # The waveforms of the slots read before the failure are in shared memory, and nobody will read them.
+				_release_waveforms_in_shared_memory(the_setup, [future.result() for future in waveforms.values() if future.done() and future.exception() is None])
+			if batch.elapsed_seconds is not None: # Time spent by the setup in each call, one per call even if the batch failed, see `TheRobocoldBetaSetup.call_batch`.
+				for stage,seconds in zip(stage_of_each_call, batch.elapsed_seconds):
+					timer.add(stage, seconds)
+				timer.add('Batch round trip (s)', -sum(batch.elapsed_seconds)) # So it is only the overhead of the communication.
+		break
+	with timer('Measured stuff data frame (s)'):
+		stuff = pandas.DataFrame(bias_telemetry.result())
+		stuff['device_name'] = [slots_configuration.device_name(slot_number) for slot_number in slots_numbers]
+		stuff['signal_name'] = [slots_configuration.signal_name(slot_number) for slot_number in slots_numbers]
+	waveforms = {slot_number: waveforms[slot_number].result() for slot_number in slots_numbers}
+	if use_shared_memory:
+		with timer('Shared memory read (s)'):
+			descriptors = waveforms
 			try:
-				# This is a check to be sure it will work.
-				this_slot_data = the_setup.get_waveform(the_setup.get_slots_configuration_df().loc[slots_numbers[0],'oscilloscope_channel_number'])
-			except RuntimeError as e:
-				if 'The number of waveforms does not conincide with the number of segments.' in str(e):
-					continue
-				else:
-					raise e
-			break
-		trigger_time = time.time()
-		stuff = []
-		for slot_number in slots_numbers:
-			measured_stuff = {
-				'Bias voltage (V)': the_setup.measure_bias_voltage(slot_number),
-				'Bias current (A)': the_setup.measure_bias_current(slot_number),
-				'device_name': the_setup.get_name_of_device_in_slot_number(slot_number),
-				'slot_number': slot_number,
-				'signal_name': the_setup.get_slots_configuration_df().loc[slot_number,'signal_name'],
-				'When': datetime.datetime.now()
-			}
-			measured_stuff = pandas.DataFrame(measured_stuff, index=[0])
-			stuff.append(measured_stuff)
-		elapsed_seconds = trigger_time - time.time()
-	return pandas.concat(stuff)
+				waveforms = {slot_number: read_shared_memory_waveforms(descriptors[slot_number]) for slot_number in slots_numbers}
+			finally:
+				_release_waveforms_in_shared_memory(the_setup, descriptors.values())
+	return stuff[['Bias voltage (V)','Bias current (A)','device_name','slot_number','signal_name','When']], waveforms
 
 INDEX_COLUMNS = ['n_trigger','slot_number']
 
-def test_beam(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers:int, slots_numbers:list, silent:bool=True, reporter:TelegramReporter=None):
+def build_spill(waveforms:dict, first_n_trigger:int)->dict:
+	"""Arranges all the segments of all the slots acquired in one spill
+	into a single columnar block of numpy arrays, already sorted according
+	to `INDEX_COLUMNS`.
+	
+	Arguments
+	---------
+	waveforms: dict
+		A dictionary of the form `{slot_number: segments}` where `segments`
+		is the list returned by `the_setup.get_waveform`, i.e. one 
+		`{'Time (s)': array, 'Amplitude (V)': array}` per segment, or
+		a single `{'Time (s)': array, 'Amplitude (V)': array}` with one
+		row per segment.
+	first_n_trigger: int
+		The `n_trigger` value for the first segment of the spill, the next
+		segments get consecutive values.
+	
+	Returns
+	-------
+	spill: dict
+		A dictionary with the keys `'n_trigger'` and `'slot_number'`, each
+		of them a 1D array with one entry per waveform, and `'Time (s)'`
+		and `'Amplitude (V)'`, each of them a 2D array with one row per
+		waveform.
+	"""
+	slots_numbers = sorted(waveforms)
+	waveforms = {slot_number: _segments_as_2D_arrays(waveforms[slot_number]) for slot_number in slots_numbers}
+	n_segments, n_samples = waveforms[slots_numbers[0]]['Time (s)'].shape
+	if any([waveforms[slot_number]['Time (s)'].shape[0] != n_segments for slot_number in slots_numbers]):
+		raise RuntimeError(f'Not all the slots have the same number of segments, received {({slot_number: waveforms[slot_number]["Time (s)"].shape[0] for slot_number in slots_numbers})}.')
+	n_slots = len(slots_numbers)
+	
+	spill = {
+		'n_trigger': numpy.repeat(numpy.arange(first_n_trigger, first_n_trigger+n_segments), n_slots),
+		'slot_number': numpy.tile(slots_numbers, n_segments),
+		'Time (s)': numpy.empty((n_segments*n_slots, n_samples)),
+		'Amplitude (V)': numpy.empty((n_segments*n_slots, n_samples)),
+	}
+	for i_slot,slot_number in enumerate(slots_numbers):
+		for variable in ['Time (s)','Amplitude (V)']:
+			# Rows are interlaced so the block ends up sorted by `n_trigger` and then by `slot_number`.
+			spill[variable][i_slot::n_slots] = waveforms[slot_number][variable]
+	return spill
+
+def _segments_as_2D_arrays(segments)->dict:
+	if isinstance(segments, dict): # Already as `{'Time (s)': array, 'Amplitude (V)': array}` with one row per segment, e.g. from `read_shared_memory_waveforms`.
+		return segments
+	return {variable: numpy.array([segment[variable] for segment in segments]) for variable in ['Time (s)','Amplitude (V)']}
+
+def iterate_spills(the_setup, name_to_access_to_the_setup:str, n_triggers:int, slots_numbers:list, slots_configuration:SlotsConfigurationSnapshot, silent:bool=True, use_shared_memory:bool=False):
+	"""Waits for each trigger and reads everything from the setup, until
+	`n_triggers` were acquired. For `use_shared_memory` see `trigger_and_read_everything`.
+	
+	Yields
+	------
+	first_n_trigger: int
+		The `n_trigger` corresponding to the first segment of the spill.
+	measured_stuff: pandas.DataFrame
+		What `trigger_and_read_everything` returned for this spill.
+	waveforms: dict
+		A dictionary of the form `{slot_number: segments}`, see `build_spill`.
+	timer: StagesTimer
+		With the time spent in each stage of the acquisition of this spill.
+	"""
+	first_n_trigger = 0
+	while True:
+		if not silent:
+			print(f'Waiting for trigger in the oscilloscope (n_trigger {first_n_trigger})...')
+		timer = StagesTimer()
+		measured_stuff, waveforms = trigger_and_read_everything(
+			the_setup = the_setup,
+			name_to_access_to_the_setup = name_to_access_to_the_setup,
+			slots_numbers = slots_numbers,
+			slots_configuration = slots_configuration,
+			use_shared_memory = use_shared_memory,
+			timer = timer,
+		)
+		if not silent:
+			print(f'Acquired n_trigger {first_n_trigger} out of {n_triggers}...')
+		yield first_n_trigger, measured_stuff, waveforms, timer
+		first_n_trigger += _segments_as_2D_arrays(waveforms[slots_numbers[0]])['Time (s)'].shape[0] # Not `len`, with shared memory this is a dictionary of 2D arrays.
+		if first_n_trigger > n_triggers:
+			break
+
+def iterate_in_background(iterator, max_items_in_queue:int, silent:bool=True):
+	"""Consumes `iterator` in a background thread and yields its items 
+	through a bounded queue. This way whoever produces the items (e.g. 
+	`iterate_spills`, which re-arms the oscilloscope and downloads the
+	data) does not have to wait for whoever consumes them (e.g. storing
+	the data) unless the queue is full, which keeps the memory usage
+	bounded.
+	
+	Arguments
+	---------
+	iterator: iterator
+		The iterator to consume in the background.
+	max_items_in_queue: int
+		Maximum number of items produced and not yet consumed. When the
+		queue is full, the background thread waits.
+	silent: bool, default True
+		If `False`, a message is printed each time the background thread
+		has to wait because the queue is full.
+	"""
+	items_queue = queue.Queue(maxsize=max_items_in_queue)
+	stop_producing = threading.Event()
+	NO_MORE_ITEMS = object()
+	seconds_waiting_for_consumer = 0
+	
+	def put(item):
+		nonlocal seconds_waiting_for_consumer
+		started_waiting = time.time()
+		while not stop_producing.is_set():
+			try:
+				items_queue.put(item, timeout=1)
+				break
+			except queue.Full:
+				if not silent:
+					print(f'Queue is full ({max_items_in_queue} items), producer waiting for the consumer...')
+		seconds_waiting_for_consumer += time.time() - started_waiting
+	
+	def produce():
+		try:
+			for item in iterator:
+				put(item)
+				if stop_producing.is_set():
+					return
+		except Exception as e:
+			put(e)
+		else:
+			put(NO_MORE_ITEMS)
+	
+	producer = threading.Thread(target=produce, daemon=True)
+	producer.start()
+	try:
+		while True:
+			item = items_queue.get()
+			if item is NO_MORE_ITEMS:
+				break
+			if isinstance(item, Exception):
+				raise item
+			yield item
+		producer.join()
+	finally:
+		stop_producing.set()
+		if not silent:
+			print(f'The producer spent {seconds_waiting_for_consumer:.1f} s waiting because the queue was full.')
+
+def test_beam(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers:int, slots_numbers:list, silent:bool=True, reporter:TelegramReporter=None, pipelined:bool=False, max_spills_in_memory:int=2, use_shared_memory:bool=False, parse_spills:bool=False, fraction_of_raw_waveforms_to_keep:float=1, keep_raw_waveforms_if=None, CFD_percentages:list=None, vectorized_parsing:bool=False):
+	"""Acquire a test beam.
+	
+	Arguments
+	---------
+	pipelined: bool, default False
+		If `True`, the oscilloscope is re-armed and read in a separate 
+		thread while the previous spill is processed and stored, so the
+		dead time is given only by the readout.
+	max_spills_in_memory: int, default 2
+		Only used when `pipelined` is `True`. Number of spills that can
+		be waiting to be stored before the readout stops to wait.
+	use_shared_memory: bool, default False
+		If `True`, the waveforms are transferred from the setup through
+		shared memory, see `trigger_and_read_everything`.
+	parse_spills: bool, default False
+		If `True`, the waveforms are parsed as they are acquired, producing
+		also the `parse_waveforms` task, and only some of them are stored.
+		See `parse_waveforms.SpillsParser`.
+	fraction_of_raw_waveforms_to_keep: float, default 1
+		Only used when `parse_spills` is `True`. Fraction of the triggers,
+		randomly selected, whose waveforms are stored.
+	keep_raw_waveforms_if: callable, optional
+		Only used when `parse_spills` is `True`. The waveforms of the
+		triggers for which this is `True` are also stored, see `parse_waveforms.SpillsParser`.
+	CFD_percentages: list of float, optional
+		Only used when `parse_spills` is `True`. See `parse_waveforms.parse_waveforms`.
+	vectorized_parsing: bool, default False
+		Only used when `parse_spills` is `True`. Whether to parse with
+		`waveform_features.compute_features` instead of `PeakSignal`,
+		see the `vectorized` argument of `parse_waveforms.parse_waveforms`.
+	
+	The time spent in each stage of each spill is stored in `stages_timing.sqlite`
+	and a summary in `stages_timing_summary.txt`.
+	"""
 	report_progress = reporter is not None
 	with bureaucrat.handle_task('test_beam') as employee, \
 		the_setup.hold_signal_acquisition(name_to_access_to_the_setup), \
-		SQLiteDataFrameDumper(
-			employee.path_to_directory_of_my_task/'waveforms.sqlite',
-			dump_after_n_appends = 1111,
+		SpillsParser( # Before the `WaveformsDumper`, so it is closed after it.
+			bureaucrat = bureaucrat,
+			path_to_waveforms_store = employee.path_to_directory_of_my_task/WAVEFORMS_STORE_DIRECTORY_NAME,
+			fraction_of_raw_waveforms_to_keep = fraction_of_raw_waveforms_to_keep,
+			keep_raw_waveforms_if = keep_raw_waveforms_if,
+			CFD_percentages = CFD_percentages,
+			vectorized = vectorized_parsing,
+		) if parse_spills else nullcontext() as spills_parser, \
+		WaveformsDumper(
+			employee.path_to_directory_of_my_task/WAVEFORMS_STORE_DIRECTORY_NAME,
+			dump_after_n_waveforms = 11111,
 			dump_after_seconds = 11,
 		) as waveforms_dumper, \
 		SQLiteDataFrameDumper(
@@ -60,75 +306,82 @@ def test_beam(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:s
 			dump_after_n_appends = 1111,
 			dump_after_seconds = 11,
 		) as extra_stuff_dumper, \
+		SQLiteDataFrameDumper(
+			employee.path_to_directory_of_my_task/'stages_timing.sqlite',
+			dump_after_n_appends = 1111,
+			dump_after_seconds = 11,
+		) as stages_timing_dumper, \
 		reporter.report_for_loop(n_triggers, f'{bureaucrat.run_name}') if report_progress else nullcontext() as reporter \
 	:
+		slots_configuration = the_setup.get_slots_configuration_snapshot() # The slots configuration cannot change while we hold the signal acquisition, so one snapshot is enough for the whole run.
 		with open(employee.path_to_directory_of_my_task/'setup_description.txt', 'w') as ofile:
 			print(the_setup.get_description(), file=ofile)
-			the_setup.get_slots_configuration_df().to_csv(employee.path_to_directory_of_my_task/'slots_configuration.csv')
-		n_trigger = -1
-		while n_trigger < n_triggers:
-			n_trigger += 1
-			
-			if not silent:
-				print(f'Waiting for trigger in the oscilloscope (n_trigger {n_trigger})...')
-			measured_stuff = trigger_and_measure_dut_stuff(
-				the_setup = the_setup,
-				name_to_access_to_the_setup = name_to_access_to_the_setup,
-				slots_numbers = slots_numbers,
-			)
-			measured_stuff['n_trigger'] = n_trigger
-			extra_stuff_dumper.append(measured_stuff.set_index(INDEX_COLUMNS))
+			slots_configuration.to_df().to_csv(employee.path_to_directory_of_my_task/'slots_configuration.csv')
+		
+		spills = iterate_spills(
+			the_setup = the_setup,
+			name_to_access_to_the_setup = name_to_access_to_the_setup,
+			n_triggers = n_triggers,
+			slots_numbers = slots_numbers,
+			slots_configuration = slots_configuration,
+			silent = silent,
+			use_shared_memory = use_shared_memory,
+		)
+		if pipelined:
+			spills = iterate_in_background(spills, max_items_in_queue=max_spills_in_memory, silent=silent)
+		
+		stages_timing = []
+		started = time.perf_counter()
+		previous_spill_finished = started
+		for n_trigger, measured_stuff, waveforms, timer in spills:
+			if pipelined:
+				timer.add('Waiting for spill (s)', time.perf_counter()-previous_spill_finished)
+			with timer('Store extra stuff (s)'):
+				measured_stuff['n_trigger'] = n_trigger
+				extra_stuff_dumper.append(measured_stuff.set_index(INDEX_COLUMNS))
 			
 			if not silent:
-				print(f'Acquiring n_trigger {n_trigger} out of {n_triggers}...')
-			this_spill_data = []
-			for slot_number in slots_numbers:
-				this_slot_data = the_setup.get_waveform(the_setup.get_slots_configuration_df().loc[slot_number,'oscilloscope_channel_number'])
-				this_n_trigger = n_trigger
-				for i in range(len(this_slot_data)):
-					if not silent:
-						print(f'Processing n_trigger {this_n_trigger}/{n_triggers}, slot_number {slot_number}...')
-					this_slot_data[i]['n_trigger'] = this_n_trigger
-					this_slot_data[i]['slot_number'] = slot_number
-					this_slot_data[i] = pandas.DataFrame(this_slot_data[i])
-					this_slot_data[i] = this_slot_data[i].set_index(INDEX_COLUMNS)
-					this_n_trigger += 1
-				this_slot_data = pandas.concat(this_slot_data)
-				this_spill_data.append(this_slot_data)
-			this_spill_data = pandas.concat(this_spill_data)
-			this_spill_data.sort_values(INDEX_COLUMNS, inplace=True)
-			waveforms_dumper.append(this_spill_data)
-			increment_n_trigger_by = this_n_trigger-1-n_trigger
+				print(f'Processing spill starting at n_trigger {n_trigger}/{n_triggers}...')
+			with timer('Build spill (s)'):
+				spill = build_spill(waveforms, first_n_trigger=n_trigger)
+			if spills_parser is not None:
+				with timer('Parse (s)'):
+					keep = spills_parser.parse(spill)
+			with timer('Store waveforms (s)'):
+				if spills_parser is None:
+					waveforms_dumper.append(spill)
+				elif keep.any():
+					waveforms_dumper.append({key: values[keep] for key,values in spill.items()})
+			timer.add('Spill (s)', time.perf_counter()-previous_spill_finished)
+			previous_spill_finished = time.perf_counter()
+			stages_timing.append(pandas.DataFrame(timer.seconds, index=pandas.Index([n_trigger], name='n_trigger')))
+			stages_timing_dumper.append(stages_timing[-1])
+			increment_n_trigger_by = int(spill['n_trigger'].max())-n_trigger
 			n_trigger += increment_n_trigger_by
 			if report_progress:
 				reporter.update(increment_n_trigger_by)
 			if not silent:
 				print(f'Finished acquiring n_trigger {n_trigger}.')
+		
+		stages_timing_summary = summarize_stages_timing(pandas.concat(stages_timing), elapsed_seconds=time.perf_counter()-started)
+		with open(employee.path_to_directory_of_my_task/'stages_timing_summary.txt', 'w') as ofile:
+			print(stages_timing_summary, file=ofile)
+		if not silent:
+			print(stages_timing_summary)
 
-def acquire_and_parse(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers:int, slots_numbers:list, delete_waveforms_file:bool, reporter:TelegramReporter=None, silent:bool=True):
-	"""Perform a `TCT_1D_scan` and parse in parallel."""
+def acquire_and_parse(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers:int, slots_numbers:list, delete_waveforms_file:bool, reporter:TelegramReporter=None, silent:bool=True, pipelined:bool=False, use_shared_memory:bool=False, parse_spills:bool=False, fraction_of_raw_waveforms_to_keep:float=1, keep_raw_waveforms_if=None, CFD_percentages:list=None, vectorized_parsing:bool=False):
+	"""Perform a `test_beam` and parse in parallel, in a separate process.
+	If `parse_spills` is `True` the parsing is instead done by `test_beam`
+	itself as the spills are acquired, so the waveforms are not read
+	back from disk and only some of them are stored, see `test_beam`."""
 	Ernestino = bureaucrat
-	still_aquiring_data = True
-	
-	def parsing_thread_function():
-		args = dict(
-			bureaucrat = Ernestino, 
-			name_of_task_that_produced_the_waveforms_to_parse = 'test_beam',
-			silent = True, 
-			continue_from_where_we_left_last_time = True,
-		)
-		while still_aquiring_data:
-			try:
-				parse_waveforms(**args)
-			except:
-				pass
-			time.sleep(1)
-		parse_waveforms(**args) # This last call is in case there is a bunch of waveforms left.
-	
-	parsing_thread = threading.Thread(target=parsing_thread_function)
 	
+	if parse_spills:
+		parsing_process, acquisition_finished = None, None
+	else:
+		parsing_process, acquisition_finished = start_parsing_while_acquiring(Ernestino, 'test_beam')
+	acquisition_error = None
 	try:
-		parsing_thread.start()
 		test_beam(
 			bureaucrat = Ernestino,
 			the_setup = the_setup,
@@ -137,16 +390,40 @@ def acquire_and_parse(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the
 			n_triggers = n_triggers,
 			reporter = reporter,
 			silent = silent,
+			pipelined = pipelined,
+			use_shared_memory = use_shared_memory,
+			parse_spills = parse_spills,
+			fraction_of_raw_waveforms_to_keep = fraction_of_raw_waveforms_to_keep,
+			keep_raw_waveforms_if = keep_raw_waveforms_if,
+			CFD_percentages = CFD_percentages,
+			vectorized_parsing = vectorized_parsing,
 		)
+	except BaseException as e:
+		acquisition_error = e
+		raise
 	finally:
-		still_aquiring_data = False
-		while parsing_thread.is_alive():
-			time.sleep(1)
+		if parsing_process is not None:
+			acquisition_finished.set()
+			parsing_process.join()
+		try:
+			if parsing_process is not None and parsing_process.exitcode != 0 and Ernestino.was_task_run_successfully('test_beam'): # Something went wrong in the parsing process, so parse whatever was left here.
+				parse_waveforms(
+					bureaucrat = Ernestino, 
+					name_of_task_that_produced_the_waveforms_to_parse = 'test_beam',
+					silent = True, 
+					continue_from_where_we_left_last_time = True,
+				)
+			if Ernestino.was_task_run_successfully('parse_waveforms'): # Before the waveforms are deleted.
+				render_waveforms_gallery(Ernestino, 'test_beam')
+		except Exception as e:
+			if acquisition_error is None:
+				raise # The waveforms are not deleted, so they can be parsed again.
+			warnings.warn(f'Could not parse the waveforms or render the gallery of run {repr(Ernestino.run_name)} after the acquisition failed, reason: `{repr(e)}`.') # So it does not hide the reason why the acquisition failed.
 		
-		if delete_waveforms_file == True:
-			(Ernestino.path_to_directory_of_task('acquire_test_beam_data')/'waveforms.sqlite').unlink()
+		if delete_waveforms_file == True and (Ernestino.path_to_directory_of_task('test_beam')/WAVEFORMS_STORE_DIRECTORY_NAME).is_dir():
+			shutil.rmtree(Ernestino.path_to_directory_of_task('test_beam')/WAVEFORMS_STORE_DIRECTORY_NAME)
 
-def test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers_per_voltage:int, slots_numbers:list, bias_voltages:dict, delete_waveforms_file:bool, reporter:TelegramReporter=None, silent:bool=True):
+def test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, name_to_access_to_the_setup:str, n_triggers_per_voltage:int, slots_numbers:list, bias_voltages:dict, delete_waveforms_file:bool, reporter:TelegramReporter=None, silent:bool=True, pipelined:bool=False, use_shared_memory:bool=False, parse_spills:bool=False, fraction_of_raw_waveforms_to_keep:float=1, keep_raw_waveforms_if=None, CFD_percentages:list=None, vectorized_parsing:bool=False):
 	if set(slots_numbers) != set(bias_voltages.keys()):
 		raise ValueError(f'`bias_voltages` must be a dictionary whose keys are the same as the `slots_numbers`.')
 	if any([len(bias_voltages[k])!=len(bias_voltages[list(bias_voltages.keys())[0]]) for k in bias_voltages.keys()]):
@@ -166,22 +443,29 @@ def test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, name_to
 		for i_voltage in range(len(bias_voltages[slots_numbers[0]])):
 			if not silent:
 				print(f'About to measure i_voltage={i_voltage}...')
-			for slot_number in slots_numbers:
-				if not silent:
-					print(f'Setting voltage {bias_voltages[slot_number][i_voltage]} to slot_number {slot_number}...')
-				the_setup.set_bias_voltage(
-					slot_number = slot_number,
-					volts = bias_voltages[slot_number][i_voltage],
-					who = name_to_access_to_the_setup,
-				)
+			if not silent:
+				print(f'Setting voltages {({slot_number: bias_voltages[slot_number][i_voltage] for slot_number in slots_numbers})}...')
+			ramp_durations = the_setup.set_bias_voltages(
+				bias_voltages = {slot_number: bias_voltages[slot_number][i_voltage] for slot_number in slots_numbers},
+				who = name_to_access_to_the_setup,
+			)
+			if not silent:
+				print(f'Voltages settled after {({slot_number: round(seconds,1) for slot_number,seconds in ramp_durations.items()})} seconds.')
 			acquire_and_parse(
 				bureaucrat = employee.create_subrun(f'{bureaucrat.run_name}_i_voltage_{i_voltage}'),
-				name_to_access_to_the_setup = NAME_TO_ACCESS_TO_THE_SETUP,
+				name_to_access_to_the_setup = name_to_access_to_the_setup,
 				n_triggers = n_triggers_per_voltage,
 				the_setup = the_setup,
 				slots_numbers = slots_numbers,
 				delete_waveforms_file = delete_waveforms_file,
 				silent = silent,
+				pipelined = pipelined,
+				use_shared_memory = use_shared_memory,
+				parse_spills = parse_spills,
+				fraction_of_raw_waveforms_to_keep = fraction_of_raw_waveforms_to_keep,
+				keep_raw_waveforms_if = keep_raw_waveforms_if,
+				CFD_percentages = CFD_percentages,
+				vectorized_parsing = vectorized_parsing,
 				reporter = TelegramReporter(
 					telegram_token = my_telegram_bots.robobot.token, 
 					telegram_chat_id = my_telegram_bots.chat_ids['Robobot TCT setup'],
@@ -217,6 +501,7 @@ if __name__=='__main__':
 			},
 			delete_waveforms_file = False,
 			silent = False,
+			pipelined = True,
 			reporter = TelegramReporter(
 				telegram_token = my_telegram_bots.robobot.token, 
 				telegram_chat_id = my_telegram_bots.chat_ids['Robobot TCT setup'],
@@ -0,0 +1,220 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
+from pathlib import Path
+import pandas
+import time
+import os
+import tempfile
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+from TheSetup import METHODS_RETURNING_LOCK_HOLDERS
+from CrossProcessLock import NamedLockHolderProxy
+from simulated_hardware import build_simulated_setup
+from waveforms_store import WaveformsReader
+from acquire_test_beam import test_beam, test_beam_sweeping_bias_voltage
+
+NAME_TO_ACCESS_TO_THE_SETUP = f'benchmark PID: {os.getpid()}'
+SLOTS_NUMBERS = [1,2,3,4]
+
+def _instruments_statistics(the_setup)->pandas.DataFrame:
+	statistics = {'oscilloscope': the_setup._oscilloscope.statistics()}
+	for caen_serial_number,caen in the_setup._caens.items():
+		statistics[f'caen {caen_serial_number}'] = caen.statistics()
+	return pandas.concat(statistics, names=['instrument'])
+
+_simulated_setup_in_this_process = None
+
+def _create_simulated_setup_in_this_process(kwargs:dict):
+	global _simulated_setup_in_this_process
+	_simulated_setup_in_this_process = build_simulated_setup(**kwargs)
+
+def _get_simulated_setup_in_this_process():
+	return _simulated_setup_in_this_process
+
+class _SimulatedInstrumentsInThisProcess:
+	def statistics(self)->pandas.DataFrame:
+		return _instruments_statistics(_simulated_setup_in_this_process)
+
+@contextmanager
+def simulated_setup(through_server:bool=True, **kwargs):
+	"""Creates a simulated setup, see `build_simulated_setup`, and yields
+	`(the_setup, get_instruments_statistics)`. If `through_server` is `True`
+	the setup lives in another process and is accessed through the same
+	kind of proxy as returned by `connect_me_with_the_setup`, so the cost
+	of the communication is also benchmarked."""
+	if not through_server:
+		the_setup = build_simulated_setup(**kwargs)
+		try:
+			yield the_setup, lambda: _instruments_statistics(the_setup)
+		finally:
+			the_setup.close()
+		return
+
+	class SimulatedSetupManager(BaseManager):
+		pass
+
+	SimulatedSetupManager.register('get_the_setup', callable=_get_simulated_setup_in_this_process, method_to_typeid=METHODS_RETURNING_LOCK_HOLDERS)
+	SimulatedSetupManager.register('NamedLockHolder', proxytype=NamedLockHolderProxy, create_method=False)
+	SimulatedSetupManager.register('get_simulated_instruments', callable=_SimulatedInstrumentsInThisProcess)
+	manager = SimulatedSetupManager(address=('localhost',0), authkey=b'abracadabra') # Port 0 so the operating system chooses a free one.
+	manager.start(initializer=_create_simulated_setup_in_this_process, initargs=(kwargs,))
+	the_setup = manager.get_the_setup()
+	try:
+		yield the_setup, manager.get_simulated_instruments().statistics
+	finally:
+		the_setup.close() # Before the server process is terminated, so its shared memory is freed.
+		manager.shutdown()
+
+def _size_of_directory_in_bytes(path:Path)->int:
+	return sum([p.stat().st_size for p in path.rglob('*') if p.is_file()])
+
+def _count_triggers_stored(path:Path)->int:
+	"""Counts the triggers in all the waveforms stores within `path`."""
+	return sum([WaveformsReader(p.parent).index.get_level_values('n_trigger').nunique() for p in path.rglob('manifest.sqlite')])
+
+def _mean_time_per_spill_of_each_stage(path:Path)->pandas.DataFrame:
+	"""Reads all the `stages_timing.sqlite` files written by `test_beam` within `path`."""
+	stages_timing = pandas.concat([load_whole_dataframe(p) for p in path.rglob('stages_timing.sqlite')])
+	return stages_timing.mean().to_frame('Mean time per spill (s)')
+
+def _summarize(elapsed_seconds:float, n_triggers:int, bytes_written:int, instruments_statistics:pandas.DataFrame, stages_timing:pandas.DataFrame)->dict:
+	oscilloscope = instruments_statistics.loc['oscilloscope']
+	armed_seconds = oscilloscope.loc['wait_for_single_trigger','Total time (s)'] if 'wait_for_single_trigger' in oscilloscope.index else 0
+	latencies = (instruments_statistics['Total time (s)']/instruments_statistics['n_calls']).rename('Mean latency (s)')
+	return {
+		'Elapsed time (s)': elapsed_seconds,
+		'n_triggers': n_triggers,
+		'Triggers per second': n_triggers/elapsed_seconds,
+		'Dead time fraction': 1 - armed_seconds/elapsed_seconds,
+		'Bytes written': bytes_written,
+		'Bytes written per second': bytes_written/elapsed_seconds,
+		'Instruments statistics': instruments_statistics.join(latencies),
+		'Stages timing': stages_timing,
+	}
+
+def benchmark_test_beam(path_to_directory:Path, n_triggers:int, through_server:bool=True, pipelined:bool=False, use_shared_memory:bool=False, oscilloscope_kwargs:dict=None, caen_kwargs:dict=None)->dict:
+	"""Runs `test_beam` with a simulated setup and returns a dictionary
+	with the number of triggers per second, the fraction of time in
+	which the oscilloscope was not waiting for triggers (dead time), the
+	bytes per second written to disk, the latency of each call to the
+	simulated instruments and the mean time of each stage per spill."""
+	bureaucrat = RunBureaucrat(path_to_directory)
+	bureaucrat.create_run()
+	with simulated_setup(through_server=through_server, oscilloscope_kwargs=oscilloscope_kwargs, caen_kwargs=caen_kwargs, bias_telemetry_polling_period_seconds=1) as (the_setup, get_instruments_statistics):
+		started = time.time()
+		test_beam(
+			bureaucrat = bureaucrat,
+			the_setup = the_setup,
+			name_to_access_to_the_setup = NAME_TO_ACCESS_TO_THE_SETUP,
+			n_triggers = n_triggers,
+			slots_numbers = SLOTS_NUMBERS,
+			pipelined = pipelined,
+			use_shared_memory = use_shared_memory,
+		)
+		elapsed_seconds = time.time() - started
+		instruments_statistics = get_instruments_statistics()
+	return _summarize(
+		elapsed_seconds = elapsed_seconds,
+		n_triggers = _count_triggers_stored(bureaucrat.path_to_directory_of_task('test_beam')),
+		bytes_written = _size_of_directory_in_bytes(bureaucrat.path_to_directory_of_task('test_beam')),
+		instruments_statistics = instruments_statistics,
+		stages_timing = _mean_time_per_spill_of_each_stage(bureaucrat.path_to_directory_of_task('test_beam')),
+	)
+
+def benchmark_test_beam_sweeping_bias_voltage(path_to_directory:Path, n_triggers_per_voltage:int, bias_voltages:list, through_server:bool=True, pipelined:bool=False, use_shared_memory:bool=False, oscilloscope_kwargs:dict=None, caen_kwargs:dict=None)->dict:
+	"""Same as `benchmark_test_beam` but for `test_beam_sweeping_bias_voltage`,
+	all the slots are set to each of the `bias_voltages`. Note that this
+	includes the time to ramp the voltages and to parse the waveforms."""
+	bureaucrat = RunBureaucrat(path_to_directory)
+	bureaucrat.create_run()
+	with simulated_setup(through_server=through_server, oscilloscope_kwargs=oscilloscope_kwargs, caen_kwargs=caen_kwargs, bias_telemetry_polling_period_seconds=1) as (the_setup, get_instruments_statistics):
+		for slot_number in SLOTS_NUMBERS:
+			the_setup.set_bias_voltage_status(slot_number, 'on', who=NAME_TO_ACCESS_TO_THE_SETUP)
+		started = time.time()
+		test_beam_sweeping_bias_voltage(
+			bureaucrat = bureaucrat,
+			the_setup = the_setup,
+			name_to_access_to_the_setup = NAME_TO_ACCESS_TO_THE_SETUP,
+			n_triggers_per_voltage = n_triggers_per_voltage,
+			slots_numbers = SLOTS_NUMBERS,
+			bias_voltages = {slot_number: bias_voltages for slot_number in SLOTS_NUMBERS},
+			delete_waveforms_file = False,
+			pipelined = pipelined,
+			use_shared_memory = use_shared_memory,
+		)
+		elapsed_seconds = time.time() - started
+		instruments_statistics = get_instruments_statistics()
+	return _summarize(
+		elapsed_seconds = elapsed_seconds,
+		n_triggers = _count_triggers_stored(bureaucrat.path_to_directory_of_task('test_beam_sweeping_bias_voltage')),
+		bytes_written = _size_of_directory_in_bytes(bureaucrat.path_to_directory_of_task('test_beam_sweeping_bias_voltage')),
+		instruments_statistics = instruments_statistics,
+		stages_timing = _mean_time_per_spill_of_each_stage(bureaucrat.path_to_directory_of_task('test_beam_sweeping_bias_voltage')),
+	)
+
+def print_benchmark_results(name:str, results:dict):
+	print(f'{name}')
+	print('-'*len(name))
+	for key,value in results.items():
+		if isinstance(value, pandas.DataFrame):
+			print(f'{key}:')
+			print(value.to_string())
+		else:
+			print(f'{key}: {value:.4g}')
+	print()
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Benchmarks the acquisition using simulated hardware.')
+	parser.add_argument('--n_triggers',
+		metavar = 'N',
+		help = 'Number of triggers to acquire in each benchmark.',
+		default = 2222,
+		dest = 'n_triggers',
+		type = int,
+	)
+	parser.add_argument('--trigger_rate',
+		metavar = 'Hz',
+		help = 'Trigger rate of the simulated oscilloscope.',
+		default = 1000,
+		dest = 'trigger_rate',
+		type = float,
+	)
+	parser.add_argument(
+		'--sweep',
+		help = 'If this flag is passed, `test_beam_sweeping_bias_voltage` is also benchmarked.',
+		required = False,
+		dest = 'sweep',
+		action = 'store_true'
+	)
+	args = parser.parse_args()
+
+	oscilloscope_kwargs = dict(trigger_rate_hz=args.trigger_rate)
+	with tempfile.TemporaryDirectory() as path_to_temporary_directory:
+		path_to_temporary_directory = Path(path_to_temporary_directory)
+		for pipelined in [False, True]:
+			for use_shared_memory in [False, True]:
+				name = f'test_beam pipelined={pipelined} use_shared_memory={use_shared_memory}'
+				print_benchmark_results(
+					name,
+					benchmark_test_beam(
+						path_to_directory = path_to_temporary_directory/name.replace(' ','_'),
+						n_triggers = args.n_triggers,
+						pipelined = pipelined,
+						use_shared_memory = use_shared_memory,
+						oscilloscope_kwargs = oscilloscope_kwargs,
+					),
+				)
+		if args.sweep:
+			print_benchmark_results(
+				'test_beam_sweeping_bias_voltage',
+				benchmark_test_beam_sweeping_bias_voltage(
+					path_to_directory = path_to_temporary_directory/'test_beam_sweeping_bias_voltage',
+					n_triggers_per_voltage = args.n_triggers,
+					bias_voltages = [100,150,200],
+					pipelined = True,
+					oscilloscope_kwargs = oscilloscope_kwargs,
+					caen_kwargs = dict(ramp_speed_volts_per_second=50),
+				),
+			)
@@ -2,7 +2,6 @@ from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/Senger
 from pathlib import Path
 import pandas
 import shutil
-from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
@@ -12,6 +11,39 @@ sys.path.append(str(Path.home()/'scripts_and_codes/repos/robocold_beta_setup/ana
 from plot_beta_scan import draw_histogram_and_langauss_fit
 import multiprocessing
 import warnings
+from parsed_data_loader import load_parsed_from_waveforms, load_analysis_dataset
+from scatter_matrix_plot import scatter_matrix, MAX_POINTS_IN_SCATTER_MATRIX
+
+def _values_of_each_cut(data_df:pandas.DataFrame, cuts_df:pandas.DataFrame)->tuple:
+	"""Returns `(n_triggers, values)` where `values[i,k]` is the value of
+	the variable of the cut in the `k`th row of `cuts_df` for the trigger
+	`n_triggers[i]`, or NaN if that signal is missing in that trigger.
+	This is instead of pivoting the whole `data_df` into a `n_trigger` × `signal_name`
+	table."""
+	set_of_signal_names_on_which_to_apply_cuts = set(cuts_df['signal_name'])
+	set_of_measured_signals = set(data_df['signal_name'])
+	if not set_of_signal_names_on_which_to_apply_cuts.issubset(set_of_measured_signals):
+		raise ValueError(f'One (or more) `signal_name` on which you want to apply cuts is not present in the measurement data. You want to apply cuts on signal_names = {set_of_signal_names_on_which_to_apply_cuts} while the measured signal_names are {set_of_measured_signals}.')
+	
+	if not set(cuts_df['cut_type']).issubset({'lower','higher'}):
+		raise ValueError('Received a cut of type `cut_type={}`, dont know that that is...'.format(sorted(set(cuts_df['cut_type'])-{'lower','higher'})[0]))
+	
+	data_df = data_df.reset_index(drop=False)
+	if data_df.duplicated(['n_trigger','signal_name']).any():
+		raise ValueError('`data_df` has more than one row for some `n_trigger` and `signal_name`.')
+	n_triggers, row_of_each_waveform = np.unique(data_df['n_trigger'].to_numpy(), return_inverse=True)
+	
+	values = np.full((len(n_triggers),len(cuts_df)), float('NaN')) # Missing waveforms stay as NaN, so they fail the cuts.
+	rows_of_each_signal = {signal_name: (data_df['signal_name']==signal_name).to_numpy() for signal_name in set(cuts_df['signal_name'])}
+	for k,(signal_name,variable) in enumerate(zip(cuts_df['signal_name'],cuts_df['variable'])):
+		values[row_of_each_waveform[rows_of_each_signal[signal_name]],k] = data_df.loc[rows_of_each_signal[signal_name],variable].to_numpy(dtype=float)
+	return n_triggers, values
+
+def _passes_each_cut(values:np.ndarray, cuts_df:pandas.DataFrame)->np.ndarray:
+	"""Evaluates all the cuts at once on the output of `_values_of_each_cut`,
+	a "higher" cut `x < cut_value` is the same as `-x > -cut_value`."""
+	sign = np.where(cuts_df['cut_type']=='lower', 1, -1)
+	return sign*values > sign*cuts_df['cut_value'].to_numpy(dtype=float)
 
 def apply_cuts(data_df, cuts_df):
 	"""
@@ -29,26 +61,70 @@ def apply_cuts(data_df, cuts_df):
 	of the variables in any of the channels is outside the range, it will
 	be `False`.
 	"""
-	set_of_signal_names_on_which_to_apply_cuts = set(cuts_df['signal_name'])
-	set_of_measured_signals = set(data_df['signal_name'])
-	if not set_of_signal_names_on_which_to_apply_cuts.issubset(set_of_measured_signals):
-		raise ValueError(f'One (or more) `signal_name` on which you want to apply cuts is not present in the measurement data. You want to apply cuts on signal_names = {set_of_signal_names_on_which_to_apply_cuts} while the measured signal_names are {set_of_measured_signals}.')
+	n_triggers, values = _values_of_each_cut(data_df, cuts_df)
+	is_background = ~_passes_each_cut(values, cuts_df).all(axis=1)
+	return pandas.DataFrame({'is_background': is_background}, index=pandas.Index(n_triggers, name='n_trigger'))
+
+def scan_cuts(data_df:pandas.DataFrame, cuts_df:pandas.DataFrame, candidate_cuts_df:pandas.DataFrame)->tuple:
+	"""Evaluates many candidate values for some cuts, each one together
+	with all the other cuts in `cuts_df`. The values of each scanned
+	variable among the triggers that pass the other cuts are sorted once,
+	and then the number of triggers accepted by every candidate value is
+	obtained by bisection, so it takes about the same time as `apply_cuts`
+	no matter how many candidates there are.
 	
-	data_df = data_df.reset_index(drop=False).pivot(
-		index = 'n_trigger',
-		columns = 'signal_name',
-		values = list(set(data_df.columns) - {'signal_name'}),
-	)
-	triggers_accepted_df = pandas.DataFrame({'is_background': True}, index=data_df.index)
-	for idx, cut_row in cuts_df.iterrows():
-		if cut_row['cut_type'] == 'lower':
-			triggers_accepted_df['is_background'] &= data_df[(cut_row['variable'],cut_row['signal_name'])] > cut_row['cut_value']
-		elif cut_row['cut_type'] == 'higher':
-			triggers_accepted_df['is_background'] &= data_df[(cut_row['variable'],cut_row['signal_name'])] < cut_row['cut_value']
-		else:
-			raise ValueError('Received a cut of type `cut_type={}`, dont know that that is...'.format(cut_row['cut_type']))
-	triggers_accepted_df['is_background'] = ~triggers_accepted_df['is_background']
-	return triggers_accepted_df
+	Arguments
+	---------
+	data_df: pandas.DataFrame
+		Same as in `apply_cuts`.
+	cuts_df: pandas.DataFrame
+		Same as in `apply_cuts`, these are the cuts for which the cut flow
+		is reported and that are applied together with each candidate.
+		May be empty.
+	candidate_cuts_df: pandas.DataFrame
+		Same format as `cuts_df` but with many rows for the same `signal_name`,
+		`variable` and `cut_type`, one per candidate `cut_value`. If there
+		is a cut for the same `signal_name`, `variable` and `cut_type`
+		in `cuts_df`, each candidate replaces it.
+	
+	Returns
+	-------
+	cut_flow_df: pandas.DataFrame
+		`cuts_df` with the columns `n_triggers surviving`, i.e. the triggers
+		passing that cut and all the previous ones, `Efficiency`, the
+		fraction of all the triggers that is surviving, and `Efficiency relative to previous cut`.
+	scan_df: pandas.DataFrame
+		`candidate_cuts_df` with the columns `n_triggers accepted`, `n_triggers rejected`
+		and `Efficiency`, the fraction of all the triggers that is accepted.
+	"""
+	CUT_COLUMNS = ['signal_name','variable','cut_type']
+	cuts_df = cuts_df.reset_index(drop=True)
+	candidate_cuts_df = candidate_cuts_df.reset_index(drop=True)
+	cuts_to_scan = candidate_cuts_df[CUT_COLUMNS].drop_duplicates().reset_index(drop=True)
+	
+	n_triggers, values = _values_of_each_cut(data_df, pandas.concat([cuts_df[CUT_COLUMNS], cuts_to_scan]))
+	values_of_each_cut, values_of_each_cut_to_scan = values[:,:len(cuts_df)], values[:,len(cuts_df):]
+	passes = _passes_each_cut(values_of_each_cut, cuts_df)
+	
+	cut_flow_df = cuts_df.copy()
+	cut_flow_df['n_triggers surviving'] = np.logical_and.accumulate(passes, axis=1).sum(axis=0)
+	cut_flow_df['Efficiency'] = cut_flow_df['n_triggers surviving']/len(n_triggers)
+	cut_flow_df['Efficiency relative to previous cut'] = cut_flow_df['n_triggers surviving']/cut_flow_df['n_triggers surviving'].shift(1, fill_value=len(n_triggers))
+	
+	scan = []
+	for k,cut in cuts_to_scan.iterrows():
+		is_this_cut = (cuts_df[CUT_COLUMNS]==cut).all(axis=1).to_numpy()
+		passes_the_other_cuts = passes[:,~is_this_cut].all(axis=1)
+		sign = 1 if cut['cut_type']=='lower' else -1
+		sorted_values = sign*values_of_each_cut_to_scan[passes_the_other_cuts,k]
+		sorted_values = np.sort(sorted_values[~np.isnan(sorted_values)]) # NaN fail every cut.
+		candidates = candidate_cuts_df.loc[(candidate_cuts_df[CUT_COLUMNS]==cut).all(axis=1)]
+		n_accepted = len(sorted_values) - np.searchsorted(sorted_values, sign*candidates['cut_value'].to_numpy(dtype=float), side='right') # Number of `sign*value > sign*cut_value`.
+		scan.append(candidates.assign(**{'n_triggers accepted': n_accepted, 'n_triggers rejected': len(n_triggers)-n_accepted}))
+	scan_df = pandas.concat(scan) if len(scan) > 0 else candidate_cuts_df.assign(**{'n_triggers accepted': [], 'n_triggers rejected': []})
+	scan_df['Efficiency'] = scan_df['n_triggers accepted']/len(n_triggers)
+	
+	return cut_flow_df, scan_df
 
 def clean_test_beam(bureaucrat:RunBureaucrat, path_to_cuts_file:Path=None)->Path:
 	"""Clean the events from a test beam, i.e. apply cuts to reject/accept 
@@ -84,11 +160,7 @@ def clean_test_beam(bureaucrat:RunBureaucrat, path_to_cuts_file:Path=None)->Path
 		REQUIRED_COLUMNS = {'signal_name','variable','cut_type','cut_value'}
 		if set(cuts_df.columns) != REQUIRED_COLUMNS:
 			raise ValueError(f'The file with the cuts {path_to_cuts_file} must have the following columns: {REQUIRED_COLUMNS}, but it has columns {set(cuts_df.columns)}.')
-		parsed_from_waveforms = load_whole_dataframe(bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
-		extra_stuff = load_whole_dataframe(bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite')
-		signal_names = extra_stuff.reset_index(drop=False).set_index('slot_number')['signal_name']
-		signal_names = signal_names[~signal_names.index.duplicated(keep='first')]
-		data_df = parsed_from_waveforms.join(signal_names, on='slot_number')
+		data_df = load_parsed_from_waveforms(bureaucrat, columns=sorted(set(cuts_df['variable'])))
 		
 		cuts_df.to_csv(task.path_to_directory_of_my_task/Path(f'cuts.backup.csv'), index=False) # Create a backup.
 		filtered_triggers_df = apply_cuts(data_df, cuts_df)
@@ -116,7 +188,127 @@ def clean_test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, path_to_cuts
 		this_run_cuts_df.to_csv(Quique.path_to_temporary_directory/'cuts.cvs',index=False)
 		clean_test_beam(Quique, Quique.path_to_temporary_directory/'cuts.cvs')
 
-def clean_test_beam_plots(bureaucrat:RunBureaucrat, scatter_plot:bool=True, langauss_plots:bool=True, distributions:bool=False):
+def scan_cuts_test_beam(bureaucrat:RunBureaucrat, path_to_cuts_file:Path=None, path_to_cuts_scan_file:Path=None):
+	"""Evaluates many candidate values for some cuts, see `scan_cuts`,
+	and reports the cut flow and the number of triggers accepted and
+	rejected by each candidate, so the cuts can be tuned without running
+	`clean_test_beam` for each of them.
+	
+	Arguments
+	---------
+	bureaucrat: RunBureaucrat
+		The bureaucrat to handle this run.
+	path_to_cuts_file: Path, optional
+		Path to a CSV file with the cuts, as in `clean_test_beam`. If
+		nothing is passed, a file named `cuts.csv` will try to be found
+		in the measurement's base directory, and if there is none no
+		other cuts are applied.
+	path_to_cuts_scan_file: Path, optional
+		Path to a CSV file with the same columns as the cuts file and
+		one row for each candidate value of each cut, e.g.
+		```
+		signal_name       variable cut_type  cut_value
+				DUT  Amplitude (V)    lower       0.05
+				DUT  Amplitude (V)    lower       0.10
+				DUT  Amplitude (V)    lower       0.15
+		```
+		If nothing is passed, a file named `cuts_scan.csv` will try to
+		be found in the measurement's base directory.
+	"""
+	John = bureaucrat
+	
+	John.check_these_tasks_were_run_successfully(['test_beam','parse_waveforms'])
+	
+	REQUIRED_COLUMNS = {'signal_name','variable','cut_type','cut_value'}
+	if path_to_cuts_file is None and not (John.path_to_run_directory/'cuts.csv').is_file():
+		cuts_df = pandas.DataFrame(columns=sorted(REQUIRED_COLUMNS))
+	else:
+		path_to_cuts_file = John.path_to_run_directory/'cuts.csv' if path_to_cuts_file is None else path_to_cuts_file
+		cuts_df = pandas.read_csv(path_to_cuts_file)
+	if path_to_cuts_scan_file is None:
+		path_to_cuts_scan_file = John.path_to_run_directory/'cuts_scan.csv'
+	candidate_cuts_df = pandas.read_csv(path_to_cuts_scan_file)
+	for path,df in {path_to_cuts_file: cuts_df, path_to_cuts_scan_file: candidate_cuts_df}.items():
+		if set(df.columns) != REQUIRED_COLUMNS:
+			raise ValueError(f'The file with the cuts {path} must have the following columns: {REQUIRED_COLUMNS}, but it has columns {set(df.columns)}.')
+	
+	with John.handle_task('scan_cuts_test_beam') as task:
+		data_df = load_parsed_from_waveforms(bureaucrat, columns=sorted(set(cuts_df['variable'])|set(candidate_cuts_df['variable'])))
+		cut_flow_df, scan_df = scan_cuts(data_df, cuts_df, candidate_cuts_df)
+		cut_flow_df.to_csv(task.path_to_directory_of_my_task/'cut_flow.csv', index=False)
+		scan_df.to_csv(task.path_to_directory_of_my_task/'cuts_scan.csv', index=False)
+		
+		for (signal_name,variable,cut_type),df in scan_df.groupby(['signal_name','variable','cut_type']):
+			fig = px.line(
+				df.sort_values('cut_value'),
+				x = 'cut_value',
+				y = 'n_triggers accepted',
+				hover_data = ['n_triggers rejected','Efficiency'],
+				markers = True,
+				title = f'Scan of {cut_type} cut on {variable} of {signal_name}<br><sup>Run: {John.run_name}</sup>',
+				labels = {'cut_value': f'{variable} {cut_type} cut'},
+			)
+			fig.write_html(
+				str(task.path_to_directory_of_my_task/f'scan {signal_name} {variable} {cut_type}.html'),
+				include_plotlyjs = 'cdn',
+			)
+
+def scan_cuts_test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, path_to_cuts_file:Path=None, path_to_cuts_scan_file:Path=None):
+	"""Same as `scan_cuts_test_beam` for all the sub- test beams at once.
+	The files are the same as for `clean_test_beam_sweeping_bias_voltage`,
+	with a `run_name` column, which is optional in the scan file, if it
+	is not there the same candidates are used for all the runs."""
+	Eriberto = bureaucrat
+	Eriberto.check_these_tasks_were_run_successfully('test_beam_sweeping_bias_voltage')
+	
+	if path_to_cuts_file is None:
+		path_to_cuts_file = Eriberto.path_to_run_directory/'cuts.csv'
+	if path_to_cuts_scan_file is None:
+		path_to_cuts_scan_file = Eriberto.path_to_run_directory/'cuts_scan.csv'
+	cuts_df = pandas.read_csv(path_to_cuts_file).set_index('run_name') if path_to_cuts_file.is_file() else None
+	candidate_cuts_df = pandas.read_csv(path_to_cuts_scan_file)
+	
+	with Eriberto.handle_task('scan_cuts_test_beam_sweeping_bias_voltage') as Eribertos_employee:
+		cut_flows = []
+		scans = []
+		for Quique in Eriberto.list_subruns_of_task('test_beam_sweeping_bias_voltage'):
+			if cuts_df is not None:
+				cuts_df.query(f'run_name=={repr(Quique.run_name)}').to_csv(Quique.path_to_temporary_directory/'cuts.csv',index=False)
+			if 'run_name' in candidate_cuts_df.columns:
+				candidate_cuts_df.query(f'run_name=={repr(Quique.run_name)}').drop(columns='run_name').to_csv(Quique.path_to_temporary_directory/'cuts_scan.csv',index=False)
+			else:
+				candidate_cuts_df.to_csv(Quique.path_to_temporary_directory/'cuts_scan.csv',index=False)
+			scan_cuts_test_beam(
+				Quique,
+				path_to_cuts_file = Quique.path_to_temporary_directory/'cuts.csv' if cuts_df is not None else None,
+				path_to_cuts_scan_file = Quique.path_to_temporary_directory/'cuts_scan.csv',
+			)
+			cut_flows.append(pandas.read_csv(Quique.path_to_directory_of_task('scan_cuts_test_beam')/'cut_flow.csv').assign(run_name=Quique.run_name))
+			scans.append(pandas.read_csv(Quique.path_to_directory_of_task('scan_cuts_test_beam')/'cuts_scan.csv').assign(run_name=Quique.run_name))
+		pandas.concat(cut_flows).to_csv(Eribertos_employee.path_to_directory_of_my_task/'cut_flow.csv', index=False)
+		scan_df = pandas.concat(scans)
+		scan_df.to_csv(Eribertos_employee.path_to_directory_of_my_task/'cuts_scan.csv', index=False)
+		
+		for (signal_name,variable,cut_type),df in scan_df.groupby(['signal_name','variable','cut_type']):
+			fig = px.line(
+				df.sort_values(['run_name','cut_value']),
+				x = 'cut_value',
+				y = 'Efficiency',
+				color = 'run_name',
+				hover_data = ['n_triggers accepted','n_triggers rejected'],
+				markers = True,
+				title = f'Scan of {cut_type} cut on {variable} of {signal_name}<br><sup>Run: {Eriberto.run_name}</sup>',
+				labels = {'cut_value': f'{variable} {cut_type} cut'},
+			)
+			fig.write_html(
+				str(Eribertos_employee.path_to_directory_of_my_task/f'scan {signal_name} {variable} {cut_type}.html'),
+				include_plotlyjs = 'cdn',
+			)
+
+def clean_test_beam_plots(bureaucrat:RunBureaucrat, scatter_plot:bool=True, langauss_plots:bool=True, distributions:bool=False, max_points_in_scatter_matrix:int=MAX_POINTS_IN_SCATTER_MATRIX, scatter_matrix_large_data:str='subsample'):
+	"""Plots the data of a test beam tagged as background or not according
+	to `clean_test_beam`. For the arguments `max_points_in_scatter_matrix`
+	and `scatter_matrix_large_data` see `scatter_matrix_plot.scatter_matrix`."""
 	COLOR_DISCRETE_MAP = {
 		True: '#ff5c5c',
 		False: '#27c200',
@@ -127,20 +319,14 @@ def clean_test_beam_plots(bureaucrat:RunBureaucrat, scatter_plot:bool=True, lang
 	John.check_these_tasks_were_run_successfully(['test_beam','parse_waveforms','clean_test_beam'])
 	
 	with John.handle_task('clean_test_beam_plots') as Johns_eployee:
-		parsed_from_waveforms = load_whole_dataframe(bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
-		extra_stuff = load_whole_dataframe(bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite')
-		signal_names = extra_stuff.reset_index(drop=False).set_index('slot_number')['signal_name']
-		signal_names = signal_names[~signal_names.index.duplicated(keep='first')]
-		df = parsed_from_waveforms.join(signal_names, on='slot_number')
-		
-		df = tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam(John, df)
+		df = load_analysis_dataset(bureaucrat)
 		df = df.reset_index().sort_values('signal_name')
 		
 		if distributions:
 			path_to_save_plots = Johns_eployee.path_to_directory_of_my_task/'distributions'
 			path_to_save_plots.mkdir(exist_ok = True)
 			for col in df.columns:
-				if col in {'signal_name','n_trigger','is_background'}:
+				if col in {'signal_name','n_trigger','is_background','device_name'}:
 					continue
 				fig = px.histogram(
 					df,
@@ -170,10 +356,10 @@ def clean_test_beam_plots(bureaucrat:RunBureaucrat, scatter_plot:bool=True, lang
 				
 		if scatter_plot:
 			columns_for_scatter_matrix_plot = set(df.columns) 
-			columns_for_scatter_matrix_plot -= {'n_trigger','signal_name','is_background','n_waveform','slot_number'} 
+			columns_for_scatter_matrix_plot -= {'n_trigger','signal_name','is_background','n_waveform','slot_number','device_name'}
 			columns_for_scatter_matrix_plot -= {f't_{i} (s)' for i in [10,20,30,40,60,70,80,90]}
 			columns_for_scatter_matrix_plot -= {f'Time over {i}% (s)' for i in [10,30,40,50,60,70,80,90]}
-			fig = px.scatter_matrix(
+			fig = scatter_matrix(
 				df,
 				dimensions = sorted(columns_for_scatter_matrix_plot),
 				title = f'Scatter matrix plot<br><sup>Run: {John.run_name}</sup>',
@@ -181,17 +367,9 @@ def clean_test_beam_plots(bureaucrat:RunBureaucrat, scatter_plot:bool=True, lang
 				color = 'is_background',
 				hover_data = ['n_trigger'],
 				color_discrete_map = COLOR_DISCRETE_MAP,
+				max_points = max_points_in_scatter_matrix,
+				large_data = scatter_matrix_large_data,
 			)
-			fig.update_traces(diagonal_visible=False, showupperhalf=False, marker = {'size': 3})
-			for k in range(len(fig.data)):
-				fig.data[k].update(
-					selected = dict(
-						marker = dict(
-							opacity = 1,
-							color = 'black',
-						)
-					),
-				)
 			fig.write_html(
 				str(Johns_eployee.path_to_directory_of_my_task/Path('scatter matrix plot.html')),
 				include_plotlyjs = 'cdn',
@@ -261,9 +439,13 @@ def plots_of_clean_test_beam_sweeping_bias_voltage(bureaucrat:RunBureaucrat, sca
 			with open(Ernestos_employee.path_to_directory_of_my_task/f'{plot_type} together.html', 'w') as ofile:
 				print(html_doc, file=ofile)
 
-def script_core(bureaucrat:RunBureaucrat):
+def script_core(bureaucrat:RunBureaucrat, scan:bool=False):
 	John = bureaucrat
-	if John.was_task_run_successfully('test_beam_sweeping_bias_voltage'):
+	if scan and John.was_task_run_successfully('test_beam_sweeping_bias_voltage'):
+		scan_cuts_test_beam_sweeping_bias_voltage(John)
+	elif scan and John.was_task_run_successfully('test_beam'):
+		scan_cuts_test_beam(John)
+	elif John.was_task_run_successfully('test_beam_sweeping_bias_voltage'):
 		clean_test_beam_sweeping_bias_voltage(John)
 		plots_of_clean_test_beam_sweeping_bias_voltage(John, scatter_plot=True, number_of_processes=max(multiprocessing.cpu_count()-1,1))
 	elif John.was_task_run_successfully('test_beam'):
@@ -321,8 +503,15 @@ if __name__ == '__main__':
 		dest = 'directory',
 		type = str,
 	)
+	parser.add_argument(
+		'--scan',
+		help = 'If this flag is passed, instead of cleaning, the candidate cuts in the file `cuts_scan.csv` are evaluated, see `scan_cuts_test_beam`.',
+		required = False,
+		dest = 'scan',
+		action = 'store_true'
+	)
 
 	args = parser.parse_args()
 	bureaucrat = RunBureaucrat(Path(args.directory))
-	script_core(bureaucrat)
+	script_core(bureaucrat, scan=args.scan)
 	
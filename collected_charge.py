@@ -5,14 +5,13 @@ import plotly.express as px
 import plotly.graph_objects as go
 import grafica.plotly_utils.utils # https://github.com/SengerM/grafica
 import numpy
-from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
+from parsed_data_loader import load_analysis_dataset, columns_of_sqlite_dataframe
 from summarize_parameters import read_summarized_data
 
 import sys 
 sys.path.append(str(Path.home()/'scripts_and_codes/repos/robocold_beta_setup/analysis_scripts'))
 from plot_beta_scan import binned_fit_langauss, hex_to_rgba
 
-from clean_test_beam import tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam
 from landaupy import langauss, landau # https://github.com/SengerM/landaupy
 from jitter_calculation import resample_measured_data
 from grafica.plotly_utils.utils import scatter_histogram # https://github.com/SengerM/grafica
@@ -53,19 +52,11 @@ def collected_charge_in_test_beam(bureaucrat:RunBureaucrat, force:bool=False):
 		return
 	
 	with Norberto.handle_task(TASK_NAME) as task_handler:
-		data_df = load_whole_dataframe(Norberto.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
-		
-		if set(data_df.index.names) != {'n_trigger','slot_number'}:
-			raise ValueError(f'The data does not posses the correct index.')
-		if 'Collected charge (V s)' not in data_df.columns:
+		if 'Collected charge (V s)' not in columns_of_sqlite_dataframe(Norberto.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite'):
 			raise ValueError(f'The data does not posses information about the collected charge.')
+		data_df = load_analysis_dataset(Norberto, columns=['Collected charge (V s)'])
+		data_df = data_df.query('is_background==False')[['Collected charge (V s)','signal_name']] # If there was no cleaning nothing is background.
 		
-		if Norberto.was_task_run_successfully('clean_test_beam'):
-			data_df = tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam(Norberto, data_df).query('is_background==False').drop(columns='is_background')
-		
-		slots_configuration = pandas.read_csv(Norberto.path_to_directory_of_task('test_beam')/'slots_configuration.csv').set_index('slot_number')
-		
-		data_df = data_df.join(slots_configuration['signal_name'], on='slot_number')
 		data_df = data_df.droplevel(level='slot_number')
 		data_df.set_index('signal_name',append=True,inplace=True)
 		
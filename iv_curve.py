@@ -54,6 +54,7 @@ def measure_iv_curve(bureaucrat:RunBureaucrat, voltages:list, slot_number:int, n
 				print(the_setup.get_description(), file=ofile)
 			with SQLiteDataFrameDumper(measure_iv_curve_task_handler.path_to_directory_of_my_task/Path('measured_data.sqlite'), dump_after_n_appends=1e3, dump_after_seconds=10) as measured_data_dumper:
 				the_setup.set_current_compliance(slot_number=slot_number, amperes=current_compliance, who=name_to_access_to_the_setup)
+				device_name = the_setup.get_slots_configuration_snapshot().device_name(slot_number)
 				for n_voltage,voltage in enumerate(voltages):
 					if not silent:
 						print(f'Measuring n_voltage={n_voltage}/{len(voltages)-1} on slot {slot_number}...')
@@ -69,17 +70,18 @@ def measure_iv_curve(bureaucrat:RunBureaucrat, voltages:list, slot_number:int, n
 						elapsed_seconds = 9999999999
 						while elapsed_seconds > 5: # Because of multiple threads locking the different elements of the_setup, it can happen that this gets blocked for a long time. Thus, the measured data will no longer belong to a single point in time as we expect...:
 							measurement_started = time.time()
+							measured_bias = the_setup.measure_bias_all_slots([slot_number])
 							measured_data_df = pandas.DataFrame(
 								{
 									'n_voltage': n_voltage,
 									'n_measurement': n_measurement,
-									'When': datetime.datetime.now(),
+									'When': measured_bias['When'],
 									'Set voltage (V)': voltage,
-									'Bias voltage (V)': the_setup.measure_bias_voltage(slot_number),
-									'Bias current (A)': the_setup.measure_bias_current(slot_number),
+									'Bias voltage (V)': measured_bias['Bias voltage (V)'][0],
+									'Bias current (A)': measured_bias['Bias current (A)'][0],
 									'Temperature (°C)': the_setup.measure_temperature(),
 									'Humidity (%RH)': the_setup.measure_humidity(),
-									'device_name': the_setup.get_name_of_device_in_slot_number(slot_number),
+									'device_name': device_name,
 								},
 								index = [0],
 							)
@@ -149,13 +151,14 @@ def measure_iv_curves_on_multiple_slots(bureaucrat:RunBureaucrat, voltages:dict,
 		telegram_token = my_telegram_bots.robobot.token, 
 		telegram_chat_id = my_telegram_bots.chat_ids['Robobot TCT setup'],
 	)
+	slots_configuration = the_setup.get_slots_configuration_snapshot()
 	with Richard.handle_task('measure_iv_curves_on_multiple_slots') as measure_iv_curves_on_multiple_slots_task_handler, \
 		reporter.report_for_loop(sum([len(v) for _,v in voltages.items()])*n_measurements_per_voltage, bureaucrat.run_name) as reporter \
 	:
 		threads = []
 		for slot_number in set(voltages):
 			thread = MeasureIVCurveThread(
-				bureaucrat = measure_iv_curves_on_multiple_slots_task_handler.create_subrun(subrun_name=f'IV_curve_{the_setup.get_name_of_device_in_slot_number(slot_number)}'),
+				bureaucrat = measure_iv_curves_on_multiple_slots_task_handler.create_subrun(subrun_name=f'IV_curve_{slots_configuration.device_name(slot_number)}'),
 				slot_number = slot_number,
 				name_to_access_to_the_setup = name_to_access_to_the_setup,
 				voltages_to_measure = voltages[slot_number],
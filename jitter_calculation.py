@@ -7,16 +7,19 @@ import numpy as np
 from grafica.plotly_utils.utils import scatter_histogram
 from scipy.stats import median_abs_deviation
 from scipy.optimize import curve_fit
-from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import shutil
-from clean_test_beam import tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam
 import multiprocessing
 import pickle
 import uncertainties
 import numpy
 from summarize_parameters import read_summarized_data
+from CFD_times_store import read_CFD_times_as_dataframe, CFD_TIMES_DIRECTORY_NAME
+from parsed_data_loader import load_analysis_dataset, columns_of_sqlite_dataframe
+import re
 
 N_BOOTSTRAP = 33
+N_CFD_THRESHOLDS_AROUND_THE_OPTIMUM_FOR_THE_BOOTSTRAP = 8 # The bootstrapped replicas only look for the best pair of CFD thresholds within this number of thresholds around the one of the real data. With the 9 thresholds 10, 20, ..., 90 % this is the whole grid.
+N_CFD_THRESHOLDS_IN_THE_COARSE_SEARCH = 9 # `sigma_from_gaussian_fit` needs one fit per pair of CFD thresholds, so for finer grids it is first computed on a grid of about this number of thresholds per signal and then only around the best pair of it. With the 9 thresholds 10, 20, ..., 90 % this is the whole grid.
 STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION = 'sigma_from_gaussian_fit' # For the time resolution I will use the `sigma_from_gaussian_fit` because in practice ends up being the most robust and reliable of all.
 
 def kMAD(x,nan_policy='omit'):
@@ -63,6 +66,17 @@ def resample_measured_data(data_df):
 	resampled_df = resampled_df.stack()
 	return resampled_df
 
+def _CFD_threshold_columns(columns_names:list)->dict:
+	"""Returns a dictionary of the form `{percentage: column_name}` with
+	each `t_whatever (s)` column in `columns_names`, sorted by percentage."""
+	columns = {}
+	for col in columns_names:
+		match = re.fullmatch(r't_([0-9.]+) \(s\)', str(col))
+		if match is not None:
+			percentage = float(match.group(1))
+			columns[int(percentage) if percentage.is_integer() else percentage] = col
+	return dict(sorted(columns.items()))
+
 def calculate_Δt(data_df:pandas.DataFrame)->pandas.DataFrame:
 	"""Calculate the time difference between each `t_whatever (s)` column
 	between two signals.
@@ -71,7 +85,8 @@ def calculate_Δt(data_df:pandas.DataFrame)->pandas.DataFrame:
 	---------
 	data_df: pandas.DataFrame
 		A data frame with index `('n_trigger','signal_name')` and columns
-		`('t_10 (s)','t_20 (s)',...,'t_90 (s)')`.
+		`('t_10 (s)','t_20 (s)',...,'t_90 (s)')`, or whatever other CFD
+		thresholds.
 	
 	Returns
 	-------
@@ -115,9 +130,9 @@ def calculate_Δt(data_df:pandas.DataFrame)->pandas.DataFrame:
 	
 	if data_df.index.names != ['n_trigger','signal_name']:
 		raise ValueError(f"I am expecting a data frame with a multi index with columns `['n_trigger','signal_name']`, but instead received one with columns `{data_df.index.names}`")
-	TIME_THRESHOLD_COLUMNS = {f't_{i} (s)' for i in [10,20,30,40,50,60,70,80,90]}
-	if not TIME_THRESHOLD_COLUMNS.issubset(set(data_df.columns)):
-		raise ValueError(f'I am expecting a data frame with the columns `{sorted(TIME_THRESHOLD_COLUMNS)}`, but at least one of them is not in `data_df`, which columns are {sorted(data_df.columns)}.')
+	TIME_THRESHOLD_COLUMNS = _CFD_threshold_columns(data_df.columns)
+	if len(TIME_THRESHOLD_COLUMNS) == 0:
+		raise ValueError(f'I am expecting a data frame with columns like `t_10 (s)`, `t_20 (s)`, etc., but there is none in `data_df`, which columns are {sorted(data_df.columns)}.')
 	set_of_signal_names = set(data_df.index.get_level_values('signal_name'))
 	if len(set_of_signal_names) != 2:
 		raise ValueError(f'Cannot calculate Δt in a data frame that does not have exactly two signals. The data frame you gave me has signal names {sorted(set_of_signal_names)}. I need exactly two, not {len(set_of_signal_names)}.')
@@ -127,10 +142,10 @@ def calculate_Δt(data_df:pandas.DataFrame)->pandas.DataFrame:
 	signal_2_name = sorted(set_of_signal_names)[1]
 
 	Δts_list = []
-	for k1 in [10,20,30,40,50,60,70,80,90]:
-		for k2 in [10,20,30,40,50,60,70,80,90]:
-			t1 = df.loc[pandas.IndexSlice[:, signal_1_name], f't_{k1} (s)']
-			t2 = df.loc[pandas.IndexSlice[:, signal_2_name], f't_{k2} (s)']
+	for k1,col1 in TIME_THRESHOLD_COLUMNS.items():
+		for k2,col2 in TIME_THRESHOLD_COLUMNS.items():
+			t1 = df.loc[pandas.IndexSlice[:, signal_1_name], col1]
+			t2 = df.loc[pandas.IndexSlice[:, signal_2_name], col2]
 			for t in [t1,t2]:
 				t.index = t.index.droplevel('signal_name')
 			Δt = t1 - t2
@@ -150,6 +165,110 @@ def sigma_from_gaussian_fit(x, nan_policy='drop')->float:
 	_, sigma, _ = fit_gaussian_to_samples(samples=x, bins='auto', nan_policy=nan_policy)
 	return sigma
 
+def _times_at_each_CFD_threshold(data_df:pandas.DataFrame)->dict:
+	"""Returns a dictionary with the `'percentages'` of the CFD thresholds
+	and, for each of the two signals in `data_df`, a 2D array with the times
+	at each of them, one row per `n_trigger` in the same order for both."""
+	if data_df.index.names != ['n_trigger','signal_name']:
+		raise ValueError(f"I am expecting a data frame with a multi index with columns `['n_trigger','signal_name']`, but instead received one with columns `{data_df.index.names}`")
+	TIME_THRESHOLD_COLUMNS = _CFD_threshold_columns(data_df.columns)
+	if len(TIME_THRESHOLD_COLUMNS) == 0:
+		raise ValueError(f'I am expecting a data frame with columns like `t_10 (s)`, `t_20 (s)`, etc., but there is none in `data_df`, which columns are {sorted(data_df.columns)}.')
+	set_of_signal_names = set(data_df.index.get_level_values('signal_name'))
+	if len(set_of_signal_names) != 2:
+		raise ValueError(f'Cannot calculate Δt in a data frame that does not have exactly two signals. The data frame you gave me has signal names {sorted(set_of_signal_names)}. I need exactly two, not {len(set_of_signal_names)}.')
+	times = data_df[list(TIME_THRESHOLD_COLUMNS.values())].unstack('signal_name') # Triggers in which one of the signals is missing get NaN, as in `calculate_Δt`.
+	return {
+		'percentages': list(TIME_THRESHOLD_COLUMNS),
+		**{signal_name: times.xs(signal_name, axis=1, level='signal_name')[list(TIME_THRESHOLD_COLUMNS.values())].to_numpy() for signal_name in sorted(set_of_signal_names)},
+	}
+
+def _jitter_for_each_pair_of_columns(t1:numpy.ndarray, t2:numpy.ndarray, pairs:list, pairs_to_fit:list=None)->dict:
+	"""Computes `kMAD`, `std` and `sigma_from_gaussian_fit` of `t1[:,i]-t2[:,j]`
+	for each `(i,j)` in `pairs`, one `i` at a time so only one row of the
+	grid of Δt is in memory. If `pairs_to_fit` is given, `sigma_from_gaussian_fit`
+	is only computed for those of `pairs` that are in it."""
+	pairs_to_fit = set(pairs) if pairs_to_fit is None else set(pairs_to_fit)
+	jitters = {statistic: {} for statistic in ['kMAD','std','sigma_from_gaussian_fit']}
+	for i in sorted({i for i,j in pairs}):
+		js = [j for _i,j in pairs if _i==i]
+		Δt = t1[:,[i]] - t2[:,js]
+		kMAD_of_each_j = 1.4826*numpy.nanmedian(numpy.abs(Δt - numpy.nanmedian(Δt, axis=0)), axis=0) # Same as `kMAD`.
+		std_of_each_j = numpy.nanstd(Δt, axis=0, ddof=1) # Same as `pandas.Series.std`.
+		for n,j in enumerate(js):
+			jitters['kMAD'][(i,j)] = kMAD_of_each_j[n]
+			jitters['std'][(i,j)] = std_of_each_j[n]
+			if (i,j) in pairs_to_fit:
+				jitters['sigma_from_gaussian_fit'][(i,j)] = sigma_from_gaussian_fit(Δt[:,n])
+	return jitters
+
+def _jitter_searching_the_optimum_coarse_to_fine(t1:numpy.ndarray, t2:numpy.ndarray, pairs:list, pairs_to_fit:list=[])->tuple:
+	"""Same as `_jitter_for_each_pair_of_columns` followed by finding
+	the pair with the lowest `STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION`,
+	but `sigma_from_gaussian_fit` is only computed on a coarse grid of
+	`pairs`, with about `N_CFD_THRESHOLDS_IN_THE_COARSE_SEARCH` thresholds
+	per signal, then on all the pairs around the best one of the coarse
+	grid, and on `pairs_to_fit`. The pairs that were not fitted are not
+	in `jitters['sigma_from_gaussian_fit']`.
+	
+	Returns
+	-------
+	jitters: dict
+		As returned by `_jitter_for_each_pair_of_columns`.
+	optimum_pair: tuple
+		The pair `(i,j)` with the lowest `STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION`.
+	"""
+	i_min = min(i for i,j in pairs)
+	j_min = min(j for i,j in pairs)
+	step = int(numpy.ceil(max(len({i for i,j in pairs}),len({j for i,j in pairs}))/N_CFD_THRESHOLDS_IN_THE_COARSE_SEARCH))
+	coarse_pairs = [(i,j) for i,j in pairs if (i-i_min)%step==0 and (j-j_min)%step==0]
+	jitters = _jitter_for_each_pair_of_columns(t1, t2, pairs, pairs_to_fit=coarse_pairs+list(pairs_to_fit))
+	if step > 1:
+		coarse_optimum = pandas.Series(jitters[STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION]).loc[coarse_pairs].idxmin()
+		pairs_around_the_coarse_optimum = [(i,j) for i,j in pairs if abs(i-coarse_optimum[0])<step and abs(j-coarse_optimum[1])<step and (i,j) not in jitters['sigma_from_gaussian_fit']]
+		jitters['sigma_from_gaussian_fit'].update(_jitter_for_each_pair_of_columns(t1, t2, pairs_around_the_coarse_optimum)['sigma_from_gaussian_fit'])
+	optimum_pair = pandas.Series(jitters[STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION]).idxmin()
+	return jitters, optimum_pair
+
+def jitter_for_each_pair_of_CFD_thresholds(data_df:pandas.DataFrame, pairs_of_thresholds:list=None)->pandas.DataFrame:
+	"""Same as aggregating the output of `calculate_Δt` with `kMAD`, `std`
+	and `sigma_from_gaussian_fit` for each pair of CFD thresholds, but
+	without producing Δt for all the pairs at once, which for a fine
+	grid of thresholds is too much.
+	
+	Arguments
+	---------
+	data_df: pandas.DataFrame
+		Same as in `calculate_Δt`.
+	pairs_of_thresholds: list of tuples, optional
+		The pairs of thresholds, e.g. `[(20,50)]`, in the order of the
+		signals names. If not given, all the pairs are used.
+	
+	Returns
+	-------
+	jitter_df: pandas.DataFrame
+		A data frame like the `jitter_df` of `plot_cfd`.
+	"""
+	times = _times_at_each_CFD_threshold(data_df)
+	signal_1_name, signal_2_name = [_ for _ in times if _ != 'percentages']
+	percentages = times['percentages']
+	if pairs_of_thresholds is None:
+		pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages))]
+	else:
+		pairs = [(percentages.index(k1),percentages.index(k2)) for k1,k2 in pairs_of_thresholds]
+	return _jitter_df(
+		jitters = _jitter_for_each_pair_of_columns(times[signal_1_name], times[signal_2_name], pairs),
+		percentages = percentages,
+		index_names = [f'k_{signal_1_name} (%)',f'k_{signal_2_name} (%)'],
+	)
+
+def _jitter_df(jitters:dict, percentages:list, index_names:list)->pandas.DataFrame:
+	jitter_df = pandas.DataFrame(
+		{('Δt (s)',statistic): pandas.Series(values) for statistic,values in jitters.items()}
+	)
+	jitter_df.index = pandas.MultiIndex.from_tuples([(percentages[i],percentages[j]) for i,j in jitter_df.index], names=index_names)
+	return jitter_df
+
 def plot_cfd(jitter_df, constant_fraction_discriminator_thresholds_to_use_for_the_jitter):
 	"""Plot the color map of the constant fraction discriminator thresholds
 	and the resulting jitter.
@@ -269,69 +388,81 @@ def jitter_calculation_test_beam(bureaucrat:RunBureaucrat, signals_names:set, CF
 		return
 	
 	with Norberto.handle_task(TASK_NAME) as Norbertos_employee:
-		data_df = load_whole_dataframe(Norberto.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
+		path_to_CFD_times = Norberto.path_to_directory_of_task('parse_waveforms')/CFD_TIMES_DIRECTORY_NAME
+		data_df = load_analysis_dataset( # Only the times at the CFD thresholds of the two signals are needed.
+			Norberto,
+			columns = list(_CFD_threshold_columns(columns_of_sqlite_dataframe(Norberto.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')).values()) if not path_to_CFD_times.is_dir() else [],
+			signals_names = sorted(signals_names),
+		)
 		
 		if Norberto.check_these_tasks_were_run_successfully('clean_test_beam', raise_error=False): # If there was a cleaning done, let's take it into account...
 			shutil.copyfile( # Put a copy of the cuts in the output directory so there is a record of what was done.
 				Norberto.path_to_directory_of_task('clean_test_beam')/Path('cuts.backup.csv'),
 				Norbertos_employee.path_to_directory_of_my_task/'cuts_that_were_applied.csv',
 			)
-			data_df = tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam(Norberto, data_df).query('is_background==False').drop(columns='is_background')
+		data_df = data_df.query('is_background==False').drop(columns=['is_background','device_name']) # If there was no cleaning nothing is background.
 		
-		extra_stuff = load_whole_dataframe(bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite')
-		signal_names = extra_stuff.reset_index(drop=False).set_index('slot_number')['signal_name']
-		signal_names = signal_names[~signal_names.index.duplicated(keep='first')]
-		data_df = data_df.join(signal_names, on='slot_number')
-
-		if any([sn not in set(data_df['signal_name']) for sn in signals_names]):
-			raise ValueError(f'One (or the two) of `signals_names` {signals_names} is not present in the data...')
-		data_df = data_df.query(f'signal_name in {list(signals_names)}')
+		if path_to_CFD_times.is_dir(): # There is a finer grid of CFD thresholds than the `t_whatever (s)` columns, use it.
+			data_df = data_df.join(read_CFD_times_as_dataframe(path_to_CFD_times, slots_numbers=sorted(set(data_df.index.get_level_values('slot_number')))))
 		
 		data_df.reset_index(inplace=True, drop=False)
 		data_df.set_index(['n_trigger','signal_name'], inplace=True)
 		
+		times = _times_at_each_CFD_threshold(data_df)
+		signal_1_name, signal_2_name = [_ for _ in times if _ != 'percentages']
+		percentages = times['percentages']
+		index_names = [f'k_{signal_1_name} (%)',f'k_{signal_2_name} (%)']
+		
+		if CFD_thresholds != 'best': # It is a dictionary specifying the threshold for each signal.
+			set_of_signals_in_this_measurement = set(data_df.index.get_level_values('signal_name'))
+			if set_of_signals_in_this_measurement != set(CFD_thresholds.keys()):
+				raise ValueError(f'`CFD_thresholds` specifies signal names that are not found in the data. According to the data the signal names are {set_of_signals_in_this_measurement} and `CFD_thresholds` specifies signal names {set(CFD_thresholds.keys())}.')
+			if any([not 0 <=CFD_thresholds[s] <= 100 for s in set_of_signals_in_this_measurement]):
+				raise ValueError(f'`CFD_thresholds` contains values outside the range from 0 to 100, which is wrong. Received `CFD_thresholds = {CFD_thresholds}`.')
+			if any([not numpy.isclose(percentages, CFD_thresholds[s]).any() for s in set_of_signals_in_this_measurement]):
+				raise ValueError(f'`CFD_thresholds` contains values that are not among the CFD thresholds that were computed, which are {percentages}. Received `CFD_thresholds = {CFD_thresholds}`.')
+			pair_to_use_for_the_jitter = tuple([int(numpy.argmax(numpy.isclose(percentages, CFD_thresholds[s]))) for s in [signal_1_name,signal_2_name]])
+		
 		jitter_results = []
-		bootstrapped_replicas_data = []
 		for k_bootstrap in range(N_BOOTSTRAP+1):
 			bootstrapped_iteration = False
 			if k_bootstrap > 0:
 				bootstrapped_iteration = True
 
 			if bootstrapped_iteration == False:
-				df = data_df.copy()
-			else:
-				df = resample_measured_data(data_df)
-
-			Δt_df = calculate_Δt(df)
-			Δt_df.index = Δt_df.index.droplevel('n_trigger')
-			jitter_df = Δt_df.groupby(level=Δt_df.index.names).agg(func=(kMAD, np.std, sigma_from_gaussian_fit))
+				rows = slice(None)
+				pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages))]
+			else: # Same as `resample_measured_data`.
+				rows = numpy.random.randint(len(times[signal_1_name]), size=len(times[signal_1_name]))
+				if CFD_thresholds == 'best':
+					pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages)) if abs(i-pair_to_use_for_the_jitter[0])<=N_CFD_THRESHOLDS_AROUND_THE_OPTIMUM_FOR_THE_BOOTSTRAP and abs(j-pair_to_use_for_the_jitter[1])<=N_CFD_THRESHOLDS_AROUND_THE_OPTIMUM_FOR_THE_BOOTSTRAP]
+				else:
+					pairs = [pair_to_use_for_the_jitter]
+			
+			jitters, optimum_pair = _jitter_searching_the_optimum_coarse_to_fine(times[signal_1_name][rows], times[signal_2_name][rows], pairs, pairs_to_fit=[pair_to_use_for_the_jitter] if CFD_thresholds != 'best' else [])
 			
 			if CFD_thresholds == 'best':
-				optimum_constant_fraction_discriminator_thresholds = jitter_df.idxmin()
-				optimum_constant_fraction_discriminator_thresholds = optimum_constant_fraction_discriminator_thresholds[('Δt (s)',STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION)]
-				constant_fraction_discriminator_thresholds_to_use_for_the_jitter = optimum_constant_fraction_discriminator_thresholds
-			else: # It is a dictionary specifying the threshold for each signal.
-				set_of_signals_in_this_measurement = set(data_df.index.get_level_values('signal_name'))
-				if set_of_signals_in_this_measurement != set(CFD_thresholds.keys()):
-					raise ValueError(f'`CFD_thresholds` specifies signal names that are not found in the data. According to the data the signal names are {set_of_signals_in_this_measurement} and `CFD_thresholds` specifies signal names {set(CFD_thresholds.keys())}.')
-				if any([not 0 <=CFD_thresholds[s] <= 100 for s in set_of_signals_in_this_measurement]):
-					raise ValueError(f'`CFD_thresholds` contains values outside the range from 0 to 100, which is wrong. Received `CFD_thresholds = {CFD_thresholds}`.')
-				constant_fraction_discriminator_thresholds_to_use_for_the_jitter = tuple([CFD_thresholds[k_name[2:-4]] for k_name in jitter_df.index.names]) # The `k_name` is e.g. "'k_DUT (%)'" and here we want just `"DUT"`.
+				if bootstrapped_iteration == False:
+					pair_to_use_for_the_jitter = optimum_pair
+			else:
+				optimum_pair = pair_to_use_for_the_jitter
+			constant_fraction_discriminator_thresholds_to_use_for_the_jitter = (percentages[optimum_pair[0]],percentages[optimum_pair[1]])
 			
-			jitter_final_number = jitter_df.loc[constant_fraction_discriminator_thresholds_to_use_for_the_jitter,('Δt (s)',STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION)]
+			jitter_final_number = jitters[STATISTIC_TO_USE_FOR_THE_FINAL_JITTER_CALCULATION][optimum_pair]
 			
 			jitter_results.append(
 				{
 					'measured_on': 'real data' if bootstrapped_iteration == False else 'resampled data',
 					'Jitter (s)': jitter_final_number,
-					jitter_df.index.names[0]: constant_fraction_discriminator_thresholds_to_use_for_the_jitter[0],
-					jitter_df.index.names[1]: constant_fraction_discriminator_thresholds_to_use_for_the_jitter[1],
+					index_names[0]: constant_fraction_discriminator_thresholds_to_use_for_the_jitter[0],
+					index_names[1]: constant_fraction_discriminator_thresholds_to_use_for_the_jitter[1],
 				}
 			)
 			
 			if bootstrapped_iteration == True:
 				continue
 			else: # Do some plots
+				jitter_df = _jitter_df(jitters, percentages, index_names)
 				figs = plot_cfd(jitter_df, constant_fraction_discriminator_thresholds_to_use_for_the_jitter)
 				for key,fig in figs.items():
 					fig.update_layout(title=f'CFD jitter measured using {key} from Δt<br><sup>Run: {Norberto.run_name}</sup>')
@@ -341,10 +472,9 @@ def jitter_calculation_test_beam(bureaucrat:RunBureaucrat, signals_names:set, CF
 				fig.update_layout(
 					yaxis_title = 'count',
 					xaxis_title = 'Δt (s)',
-					title = f'Δt for {Δt_df.index.names[0]}={constant_fraction_discriminator_thresholds_to_use_for_the_jitter[0]} and {Δt_df.index.names[1]}={constant_fraction_discriminator_thresholds_to_use_for_the_jitter[1]}<br><sup>Run: {Norberto.run_name}</sup>'
+					title = f'Δt for {index_names[0]}={constant_fraction_discriminator_thresholds_to_use_for_the_jitter[0]} and {index_names[1]}={constant_fraction_discriminator_thresholds_to_use_for_the_jitter[1]}<br><sup>Run: {Norberto.run_name}</sup>'
 				)
-				selected_Δt_samples = Δt_df.loc[constant_fraction_discriminator_thresholds_to_use_for_the_jitter]
-				selected_Δt_samples = selected_Δt_samples.to_numpy()
+				selected_Δt_samples = times[signal_1_name][:,optimum_pair[0]] - times[signal_2_name][:,optimum_pair[1]]
 				selected_Δt_samples = selected_Δt_samples[~np.isnan(selected_Δt_samples)] # Remove NaN values because otherwise the histograms complain...
 				fig.add_trace(
 					scatter_histogram(
@@ -1,11 +1,21 @@
 from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
 from pathlib import Path
 import pandas
-from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe, load_only_index_without_repeated_entries # https://github.com/SengerM/huge_dataframe
+from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import sqlite3
 from signals.PeakSignal import PeakSignal, draw_in_plotly # https://github.com/SengerM/signals
 import numpy
 import plotly.graph_objects as go
+import json
+import multiprocessing
+from contextlib import nullcontext, ExitStack
+from waveforms_store import WaveformsReader, WAVEFORMS_STORE_DIRECTORY_NAME, INDEX_COLUMNS
+from waveform_features import analyze_peaks, compute_features, compute_CFD_times
+from CFD_times_store import append_CFD_times, CFD_TIMES_DIRECTORY_NAME
+from reservoir_sampling import StratifiedReservoir
+
+CHECKPOINT_FILE_NAME = 'checkpoint.json'
+SNR_BANDS_FOR_THE_GALLERY = [0,5,10,50,float('inf')]
 
 def parse_waveform(signal:PeakSignal)->dict:
 	parsed = {
@@ -72,66 +82,401 @@ def plot_waveform(signal):
 			pass
 	return fig
 
-def parse_waveforms(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str, continue_from_where_we_left_last_time:bool=True, silent:bool=True):
+def _read_manifest_of_sqlite_file(path_to_waveforms_file:Path, after_rowid:int=0)->pandas.DataFrame:
+	"""Same as `WaveformsReader.read_manifest` but for an old style
+	`waveforms.sqlite` file, which has one row per sample. Returns a data
+	frame with `INDEX_COLUMNS` as index, one row per waveform with samples
+	after the row `after_rowid`, and the columns `first_rowid` and `rowid`
+	with the first and last rows of its samples. This needs only one pass
+	over the rows, and those before `after_rowid` are not even read."""
+	with sqlite3.connect(path_to_waveforms_file) as connection:
+		manifest = pandas.read_sql_query(
+			f'SELECT {", ".join(INDEX_COLUMNS)}, MIN(rowid) AS first_rowid, MAX(rowid) AS rowid FROM dataframe_table WHERE rowid > ? GROUP BY {", ".join(INDEX_COLUMNS)}',
+			connection,
+			params = (after_rowid,),
+		)
+	return manifest.set_index(INDEX_COLUMNS)
+
+def _iterate_waveforms_from_sqlite_file(path_to_waveforms_file:Path, manifest:pandas.DataFrame):
+	"""Yields `(idx, time, samples)` for each waveform in `manifest`, as
+	returned by `_read_manifest_of_sqlite_file`, from an old style
+	`waveforms.sqlite` file. All of them are read with a single query over
+	a range of `rowid`, which is the primary key of the table, instead of
+	one query per waveform that has to scan the whole table."""
+	with sqlite3.connect(path_to_waveforms_file) as connection:
+		samples = pandas.read_sql_query(
+			f'SELECT {", ".join(INDEX_COLUMNS)}, "Time (s)", "Amplitude (V)" FROM dataframe_table WHERE rowid BETWEEN ? AND ? ORDER BY rowid',
+			connection,
+			params = (int(manifest['first_rowid'].min()), int(manifest['rowid'].max())),
+		)
+	samples_of_each_waveform = samples.groupby(INDEX_COLUMNS)
+	for idx in manifest.index:
+		waveform_df = samples_of_each_waveform.get_group(idx)
+		yield idx, waveform_df['Time (s)'], waveform_df['Amplitude (V)']
+
+def _read_checkpoint(path_to_checkpoint_file:Path)->dict:
+	with open(path_to_checkpoint_file) as ifile:
+		return json.load(ifile)
+
+def _write_checkpoint(path_to_checkpoint_file:Path, checkpoint:dict):
+	path_to_temporary_file = path_to_checkpoint_file.with_suffix('.tmp')
+	with open(path_to_temporary_file, 'w') as ofile:
+		json.dump(checkpoint, ofile)
+	path_to_temporary_file.replace(path_to_checkpoint_file) # So it is never half written.
+
+def _iterate_waveforms_from_store(waveforms_reader:WaveformsReader, index_of_waveforms_to_read:list, manifest:pandas.DataFrame=None):
+	"""Yields `(idx, time, samples)` for each waveform in a waveforms store."""
+	for batch in waveforms_reader.iterate_batches(index=index_of_waveforms_to_read, manifest=manifest):
+		for i,idx in enumerate(zip(batch['n_trigger'], batch['slot_number'])):
+			yield tuple(int(_) for _ in idx), batch['Time (s)'][i], batch['Amplitude (V)'][i]
+
+def _iterate_batches_of_waveforms(chunk:dict):
+	"""Yields `(index, time, samples)` where `index` is a list with the
+	`idx` of each waveform and `time` and `samples` are 2D arrays with one
+	waveform per row, grouping together waveforms with the same number
+	of samples."""
+	if chunk['path_to_waveforms'].is_dir():
+		for batch in WaveformsReader(chunk['path_to_waveforms']).iterate_batches(index=chunk['index_of_waveforms_to_parse'], manifest=chunk['manifest']):
+			yield list(zip(batch['n_trigger'].tolist(), batch['slot_number'].tolist())), batch['Time (s)'], batch['Amplitude (V)']
+	else:
+		waveforms_by_number_of_samples = {}
+		for idx,time,samples in _iterate_waveforms_from_sqlite_file(chunk['path_to_waveforms'], chunk['manifest']):
+			waveforms_by_number_of_samples.setdefault(len(samples), []).append((idx,time.to_numpy(),samples.to_numpy()))
+		for waveforms in waveforms_by_number_of_samples.values():
+			yield [_[0] for _ in waveforms], numpy.array([_[1] for _ in waveforms]), numpy.array([_[2] for _ in waveforms])
+
+def _parse_chunk_of_waveforms(chunk:dict)->tuple:
+	"""Parses some waveforms and returns a data frame with the results,
+	one row per waveform, and the times at the CFD thresholds in
+	`chunk['CFD_percentages']` as returned by `compute_CFD_times` plus
+	`'n_trigger'` and `'slot_number'`, or `None`. This is what each process
+	does when parsing with many processes, see `parse_waveforms`.
+	
+	Arguments
+	---------
+	chunk: dict
+		A dictionary with the keys `'path_to_waveforms'` (the waveforms
+		store or the old style `waveforms.sqlite` file), `'index_of_waveforms_to_parse'`,
+		`'manifest'` (the rows of the manifest of those waveforms), `'vectorized'`
+		(whether to use `waveform_features.compute_features`) and `'CFD_percentages'`.
+	"""
+	if chunk['vectorized']:
+		parsed = []
+		CFD_times = []
+		for index,time,samples in _iterate_batches_of_waveforms(chunk):
+			peaks = analyze_peaks(time, samples)
+			parsed_from_batch = compute_features(time, samples, peaks=peaks)
+			parsed_from_batch.index = pandas.MultiIndex.from_tuples(index, names=INDEX_COLUMNS)
+			parsed.append(parsed_from_batch)
+			if chunk['CFD_percentages'] is not None:
+				CFD_times.append(compute_CFD_times(time, samples, percentages=chunk['CFD_percentages'], peaks=peaks))
+				for i,idx_name in enumerate(INDEX_COLUMNS):
+					CFD_times[-1][idx_name] = numpy.array([idx[i] for idx in index])
+		if len(CFD_times) > 0:
+			CFD_times = {key: numpy.concatenate([_[key] for _ in CFD_times]) if key != 'percentages' else CFD_times[0][key] for key in CFD_times[0]}
+		else:
+			CFD_times = None
+		return pandas.concat(parsed), CFD_times
+	
+	if chunk['path_to_waveforms'].is_dir():
+		waveforms = _iterate_waveforms_from_store(WaveformsReader(chunk['path_to_waveforms']), chunk['index_of_waveforms_to_parse'], chunk['manifest'])
+	else:
+		waveforms = _iterate_waveforms_from_sqlite_file(chunk['path_to_waveforms'], chunk['manifest'])
+	parsed = []
+	for idx,time,samples in waveforms:
+		parsed_from_waveform = parse_waveform(PeakSignal(time=time, samples=samples))
+		for idx_val, idx_name in zip(idx, INDEX_COLUMNS):
+			parsed_from_waveform[idx_name] = idx_val
+		parsed.append(parsed_from_waveform)
+	return pandas.DataFrame.from_records(parsed).set_index(INDEX_COLUMNS, drop=True), None
+
+def _SNR_bands(SNR:numpy.ndarray)->list:
+	"""Returns the band of `SNR_BANDS_FOR_THE_GALLERY` in which each SNR is,
+	as a string like `'SNR 10-50'`."""
+	labels = [f'SNR {low}-{high}' for low,high in zip(SNR_BANDS_FOR_THE_GALLERY[:-1], SNR_BANDS_FOR_THE_GALLERY[1:])]
+	n_band = numpy.digitize(SNR, SNR_BANDS_FOR_THE_GALLERY) - 1
+	return [labels[n] if 0 <= n < len(labels) else 'SNR unknown' for n in n_band]
+
+def parse_waveforms(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str, continue_from_where_we_left_last_time:bool=True, silent:bool=True, only_if_the_task_that_produced_the_waveforms_finished:bool=True, number_of_processes:int=1, chunk_size:int=1111, vectorized:bool=False, n_waveforms_per_stratum_for_the_gallery:int=2, CFD_percentages:list=None):
+	"""Parses the waveforms produced by some task. Only the waveforms that
+	were stored since the last call are parsed: the position reached in
+	the waveforms is kept in a checkpoint file, so each call does not get
+	slower as the number of waveforms grows.
+	
+	Arguments
+	---------
+	continue_from_where_we_left_last_time: bool, default True
+		If `False`, everything parsed before is deleted and all the 
+		waveforms are parsed again.
+	only_if_the_task_that_produced_the_waveforms_finished: bool, default True
+		If `False`, the waveforms are parsed even if the task that produces
+		them is still running, see `parse_waveforms_while_acquiring`.
+	number_of_processes: int, default 1
+		Number of processes among which to split the parsing.
+	chunk_size: int, default 1111
+		Number of waveforms given to each process at a time. The parsed
+		data is stored after each chunk.
+	vectorized: bool, default False
+		If `True`, the features of all the waveforms in each chunk are
+		computed at once with `waveform_features.compute_features` instead
+		of one `PeakSignal` at a time, which is much faster. Small
+		differences with respect to `PeakSignal` are possible, see
+		`waveform_features.compare_with_parse_waveform`.
+	n_waveforms_per_stratum_for_the_gallery: int, default 2
+		Number of waveforms of each slot and SNR band that are randomly
+		selected, among all those parsed, to be plotted afterwards by
+		`waveforms_gallery.render_waveforms_gallery`. Nothing is plotted
+		here. If there is already a selection from a previous call it is
+		continued, and this is ignored.
+	CFD_percentages: list of float, optional
+		If given, the time at which each waveform crosses each of these
+		CFD thresholds, e.g. `numpy.arange(5,96)`, is also computed and
+		stored in the `CFD_times` directory, see `CFD_times_store`. Only
+		with `vectorized`.
+	"""
 	Quique = bureaucrat
 	
-	Quique.check_these_tasks_were_run_successfully(name_of_task_that_produced_the_waveforms_to_parse)
+	if CFD_percentages is not None and not vectorized:
+		raise ValueError(f'`CFD_percentages` can only be used with `vectorized=True`.')
+	
+	if only_if_the_task_that_produced_the_waveforms_finished:
+		Quique.check_these_tasks_were_run_successfully(name_of_task_that_produced_the_waveforms_to_parse)
 	
 	with Quique.handle_task('parse_waveforms', drop_old_data=not continue_from_where_we_left_last_time) as Quiques_employee:
-		try:
-			index_of_waveforms_already_parsed_in_the_past = set(load_whole_dataframe(Quiques_employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite').index)
-		except Exception:
-			index_of_waveforms_already_parsed_in_the_past = set()
+		path_to_checkpoint_file = Quiques_employee.path_to_directory_of_my_task/CHECKPOINT_FILE_NAME
+		path_to_parsed_data_file = Quiques_employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite'
+		checkpoint = _read_checkpoint(path_to_checkpoint_file) if path_to_checkpoint_file.is_file() else {'watermark': 0}
+		waveforms_for_the_gallery = StratifiedReservoir.from_state(checkpoint['gallery']) if 'gallery' in checkpoint else StratifiedReservoir(n_per_stratum=n_waveforms_per_stratum_for_the_gallery)
 		
+		path_to_waveforms_store = Quiques_employee.path_to_directory_of_task(name_of_task_that_produced_the_waveforms_to_parse)/WAVEFORMS_STORE_DIRECTORY_NAME
 		path_to_waveforms_file = Quiques_employee.path_to_directory_of_task(name_of_task_that_produced_the_waveforms_to_parse)/'waveforms.sqlite'
+		if path_to_waveforms_store.is_dir():
+			waveforms_reader = WaveformsReader(path_to_waveforms_store)
+			manifest = waveforms_reader.read_manifest(after_rowid=checkpoint['watermark'])
+		elif path_to_waveforms_file.is_file(): # Measurements from before the waveforms store existed.
+			manifest = _read_manifest_of_sqlite_file(path_to_waveforms_file, after_rowid=checkpoint['watermark'])
+		else:
+			raise FileNotFoundError(f'Cannot find the waveforms of task {repr(name_of_task_that_produced_the_waveforms_to_parse)} in run {repr(Quique.run_name)}.')
+		rowid_of_new_waveforms = dict(zip(manifest.index, manifest['rowid']))
 		
-		sqlite_connection = sqlite3.connect(path_to_waveforms_file)
-		
-		index_df = load_only_index_without_repeated_entries(path_to_waveforms_file)
-		index_df = index_df.set_index(list(index_df.columns))
-		index_of_waveforms_that_still_need_to_be_parsed = set(index_df.index) - index_of_waveforms_already_parsed_in_the_past
-		index_of_waveforms_that_still_need_to_be_parsed = sorted(index_of_waveforms_that_still_need_to_be_parsed)
+		index_of_waveforms_that_still_need_to_be_parsed = set(rowid_of_new_waveforms)
+		if not path_to_checkpoint_file.is_file() and path_to_parsed_data_file.is_file(): # Parsed before checkpoints existed, the only way to know what was parsed is to look at it.
+			index_of_waveforms_that_still_need_to_be_parsed -= set(load_whole_dataframe(path_to_parsed_data_file).index)
+		index_of_waveforms_that_still_need_to_be_parsed = sorted(index_of_waveforms_that_still_need_to_be_parsed, key=rowid_of_new_waveforms.get) # In the order in which they were stored, so each chunk is read sequentially.
 		if not silent:
 			print(f'{len(index_of_waveforms_that_still_need_to_be_parsed)} waveforms still need to be parsed. The others were already parsed beforehand. Will now proceed...')
 		
-		with SQLiteDataFrameDumper(Quiques_employee.path_to_directory_of_my_task/Path('parsed_from_waveforms.sqlite'), dump_after_n_appends = 1111, dump_after_seconds = 60, delete_database_if_already_exists=False) as parsed_data_dumper: 
-			for k,idx in enumerate(index_of_waveforms_that_still_need_to_be_parsed):
-				sqlite_query = f'SELECT * from dataframe_table where ('
-				index_to_select = ''
-				for idx_val, idx_name in zip(idx, list(index_df.index.names)):
-					index_to_select += f'{idx_name}=={idx_val}'
-					index_to_select += ' and '
-				index_to_select = index_to_select[:-5]
-				sqlite_query += index_to_select + ')'
-				if not silent:
-					print(f'Processing {index_to_select} ({int(k/len(index_of_waveforms_that_still_need_to_be_parsed)*100)} %)...')
-				waveform_df = pandas.read_sql_query(
-					sqlite_query,
-					sqlite_connection,
+		chunks = [index_of_waveforms_that_still_need_to_be_parsed[i:i+chunk_size] for i in range(0, len(index_of_waveforms_that_still_need_to_be_parsed), chunk_size)]
+		chunks_to_parse = (
+			dict(
+				path_to_waveforms = path_to_waveforms_store if path_to_waveforms_store.is_dir() else path_to_waveforms_file,
+				index_of_waveforms_to_parse = chunk,
+				manifest = manifest.loc[chunk],
+				vectorized = vectorized,
+				CFD_percentages = CFD_percentages,
+			) for chunk in chunks
+		)
+		
+		index_of_waveforms_parsed_now = set()
+		try:
+			with SQLiteDataFrameDumper(path_to_parsed_data_file, dump_after_n_appends = 1111, dump_after_seconds = 60, delete_database_if_already_exists=False) as parsed_data_dumper, \
+				multiprocessing.Pool(number_of_processes) if number_of_processes > 1 else nullcontext() as pool \
+			:
+				parsed_chunks = pool.imap(_parse_chunk_of_waveforms, chunks_to_parse) if pool is not None else map(_parse_chunk_of_waveforms, chunks_to_parse) # `imap` keeps the order, so the result is the same as with one process.
+				for k,(chunk,parsed_chunk) in enumerate(zip(chunks, parsed_chunks)):
+					if not silent:
+						print(f'Parsed chunk {k+1} out of {len(chunks)} ({int((k+1)/len(chunks)*100)} %)...')
+					parsed_df, CFD_times = parsed_chunk
+					parsed_data_dumper.append(parsed_df)
+					if CFD_times is not None:
+						append_CFD_times(Quiques_employee.path_to_directory_of_my_task/CFD_TIMES_DIRECTORY_NAME, CFD_times['n_trigger'], CFD_times['slot_number'], CFD_times)
+					waveforms_for_the_gallery.add(
+						items = [tuple(int(_) for _ in idx) for idx in parsed_df.index],
+						strata = list(zip(parsed_df.index.get_level_values('slot_number').tolist(), _SNR_bands(parsed_df['SNR'].to_numpy()))),
+					)
+					index_of_waveforms_parsed_now.update(chunk)
+		finally:
+			# Move the watermark up to the last waveform before the first one that was not parsed, so nothing is lost if this failed in the middle.
+			index_of_waveforms_done = index_of_waveforms_parsed_now.union(set(rowid_of_new_waveforms) - set(index_of_waveforms_that_still_need_to_be_parsed))
+			watermark = checkpoint['watermark']
+			for idx,rowid in sorted(rowid_of_new_waveforms.items(), key=lambda _: _[1]):
+				if idx not in index_of_waveforms_done:
+					break
+				watermark = int(rowid)
+			_write_checkpoint(
+				path_to_checkpoint_file,
+				{
+					'watermark': watermark,
+					'gallery': waveforms_for_the_gallery.to_state(),
+				},
+			)
+
+class SpillsParser:
+	"""Parses the waveforms of each spill right after they are acquired,
+	without reading them back from disk, and tells which of them should
+	be stored, so most of the raw waveforms never need to be written.
+	It produces the same `parse_waveforms` task as `parse_waveforms`.
+	Use it within a `with` statement that is entered before, and hence
+	exited after, the `WaveformsDumper` that stores the waveforms to keep:
+	```
+	with SpillsParser(bureaucrat, path_to_waveforms_store, fraction_of_raw_waveforms_to_keep=.01) as spills_parser, WaveformsDumper(path_to_waveforms_store) as waveforms_dumper:
+		for spill in spills:
+			keep = spills_parser.parse(spill)
+			waveforms_dumper.append({key: spill[key][keep] for key in spill})
+	```
+	"""
+	def __init__(self, bureaucrat:RunBureaucrat, path_to_waveforms_store:Path, fraction_of_raw_waveforms_to_keep:float=1, keep_raw_waveforms_if=None, n_waveforms_per_stratum_for_the_gallery:int=2, CFD_percentages:list=None, vectorized:bool=False):
+		"""
+		Arguments
+		---------
+		bureaucrat: RunBureaucrat
+			The run in which to create the `parse_waveforms` task.
+		path_to_waveforms_store: Path
+			The waveforms store where the kept waveforms are stored, so
+			a later call to `parse_waveforms` knows they were parsed.
+		fraction_of_raw_waveforms_to_keep: float, default 1
+			Fraction of the triggers, randomly selected, for which the
+			waveforms of all the slots are kept.
+		keep_raw_waveforms_if: callable, optional
+			A function that receives the parsed data of a spill, a data
+			frame with the columns of `parse_waveform` and `INDEX_COLUMNS`
+			as index, and returns a boolean array telling which waveforms
+			are interesting. All the waveforms of the triggers with at
+			least one interesting waveform are kept, in addition to those
+			randomly selected.
+		n_waveforms_per_stratum_for_the_gallery: int, default 2
+			See `parse_waveforms`. They are selected among the waveforms
+			kept.
+		CFD_percentages: list of float, optional
+			See `parse_waveforms`.
+		vectorized: bool, default False
+			See `parse_waveforms`.
+		"""
+		if CFD_percentages is not None and not vectorized:
+			raise ValueError(f'`CFD_percentages` can only be used with `vectorized=True`.')
+		self.bureaucrat = bureaucrat
+		self.path_to_waveforms_store = path_to_waveforms_store
+		self.fraction_of_raw_waveforms_to_keep = fraction_of_raw_waveforms_to_keep
+		self.keep_raw_waveforms_if = keep_raw_waveforms_if
+		self.CFD_percentages = CFD_percentages
+		self.vectorized = vectorized
+		self._waveforms_for_the_gallery = StratifiedReservoir(n_per_stratum=n_waveforms_per_stratum_for_the_gallery)
+
+	def __enter__(self):
+		with ExitStack() as stack:
+			employee = stack.enter_context(self.bureaucrat.handle_task('parse_waveforms'))
+			self._path_to_checkpoint_file = employee.path_to_directory_of_my_task/CHECKPOINT_FILE_NAME
+			self._path_to_CFD_times = employee.path_to_directory_of_my_task/CFD_TIMES_DIRECTORY_NAME
+			self._parsed_data_dumper = stack.enter_context(
+				SQLiteDataFrameDumper(
+					employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite',
+					dump_after_n_appends = 1111,
+					dump_after_seconds = 60,
 				)
-				signal = PeakSignal(time=waveform_df['Time (s)'], samples=waveform_df['Amplitude (V)'])
-				parsed_from_waveform = parse_waveform(signal)
-				for idx_val, idx_name in zip(idx, list(index_df.index.names)):
-					parsed_from_waveform[idx_name] = idx_val
-				parsed_from_waveform_df = pandas.DataFrame(
-					parsed_from_waveform,
-					index = [0],
-				).set_index(list(index_df.index.names), drop=True)
-				parsed_data_dumper.append(parsed_from_waveform_df)
-				
-				if numpy.random.rand() < 20/len(index_df):
-					if signal.SNR > 10 or numpy.random.rand() < .4:
-						if not silent:
-							print(f'Doing plot of this signal...')
-						path_for_plots = Quiques_employee.path_to_directory_of_my_task/'plots_of_some_randomly_selected_waveforms'
-						path_for_plots.mkdir(exist_ok=True)
-						fig = plot_waveform(signal)
-						fig.write_html(
-							path_for_plots/f'{index_to_select.replace("==","_")}.html',
-							include_plotlyjs = 'cdn',
-						)
+			)
+			self._exit_stack = stack.pop_all()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			waveforms_stored = WaveformsReader(self.path_to_waveforms_store).read_manifest() if (self.path_to_waveforms_store/'manifest.sqlite').is_file() else pandas.DataFrame({'rowid': []})
+			_write_checkpoint(
+				self._path_to_checkpoint_file,
+				{
+					'watermark': int(waveforms_stored['rowid'].max()) if len(waveforms_stored) > 0 else 0, # Everything stored was parsed here.
+					'gallery': self._waveforms_for_the_gallery.to_state(),
+				},
+			)
+		except BaseException as e:
+			self._exit_stack.__exit__(type(e), e, e.__traceback__)
+			raise
+		return self._exit_stack.__exit__(exc_type, exc_value, traceback)
+
+	def parse(self, spill:dict)->numpy.ndarray:
+		"""Parses the waveforms of one spill and stores the result.
+
+		Arguments
+		---------
+		spill: dict
+			A spill as returned by `acquire_test_beam.build_spill`.
+
+		Returns
+		-------
+		keep: numpy.ndarray
+			A boolean array telling which of the waveforms of `spill` should
+			be stored.
+		"""
+		if self.vectorized:
+			peaks = analyze_peaks(spill['Time (s)'], spill['Amplitude (V)'])
+			parsed = compute_features(spill['Time (s)'], spill['Amplitude (V)'], peaks=peaks)
+		else:
+			parsed = pandas.DataFrame.from_records([parse_waveform(PeakSignal(time=time, samples=samples)) for time,samples in zip(spill['Time (s)'], spill['Amplitude (V)'])])
+		parsed.index = pandas.MultiIndex.from_arrays([spill[_] for _ in INDEX_COLUMNS], names=INDEX_COLUMNS)
+		self._parsed_data_dumper.append(parsed)
+		if self.CFD_percentages is not None:
+			append_CFD_times(self._path_to_CFD_times, spill['n_trigger'], spill['slot_number'], compute_CFD_times(spill['Time (s)'], spill['Amplitude (V)'], percentages=self.CFD_percentages, peaks=peaks))
+
+		if self.fraction_of_raw_waveforms_to_keep >= 1:
+			keep = numpy.ones(len(parsed), dtype=bool)
+		else:
+			n_triggers, n_trigger_of_each_waveform = numpy.unique(spill['n_trigger'], return_inverse=True)
+			keep_trigger = numpy.random.rand(len(n_triggers)) < self.fraction_of_raw_waveforms_to_keep
+			if self.keep_raw_waveforms_if is not None:
+				interesting = numpy.asarray(self.keep_raw_waveforms_if(parsed), dtype=bool)
+				keep_trigger |= numpy.bincount(n_trigger_of_each_waveform, weights=interesting, minlength=len(n_triggers)) > 0
+			keep = keep_trigger[n_trigger_of_each_waveform]
+
+		self._waveforms_for_the_gallery.add(
+			items = [tuple(int(_) for _ in idx) for idx in parsed.index[keep]],
+			strata = list(zip(spill['slot_number'][keep].tolist(), _SNR_bands(parsed['SNR'].to_numpy()[keep]))),
+		)
+		return keep
 
-def parse_waveforms_recursively(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str, continue_from_where_we_left_last_time:bool=True, silent:bool=True):
+def parse_waveforms_while_acquiring(path_to_run_directory:Path, name_of_task_that_produced_the_waveforms_to_parse:str, acquisition_finished:multiprocessing.Event, seconds_between_passes:float=1):
+	"""Calls `parse_waveforms` over and over until `acquisition_finished`
+	is set, and then once more to parse whatever was left. This is meant
+	to be run in a separate process, see `start_parsing_while_acquiring`."""
+	bureaucrat = RunBureaucrat(path_to_run_directory)
+	args = dict(
+		bureaucrat = bureaucrat,
+		name_of_task_that_produced_the_waveforms_to_parse = name_of_task_that_produced_the_waveforms_to_parse,
+		silent = True,
+		continue_from_where_we_left_last_time = True,
+		only_if_the_task_that_produced_the_waveforms_finished = False,
+	)
+	while not acquisition_finished.is_set():
+		try:
+			parse_waveforms(**args)
+		except Exception: # E.g. the waveforms are not yet there, so just try again later.
+			pass
+		acquisition_finished.wait(seconds_between_passes)
+	parse_waveforms(**args) # This last call is in case there is a bunch of waveforms left.
+
+def start_parsing_while_acquiring(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str)->tuple:
+	"""Starts `parse_waveforms_while_acquiring` in a separate process, so
+	it does not compete with the acquisition for the GIL.
+	
+	Returns
+	-------
+	process: multiprocessing.Process
+		The process doing the parsing.
+	acquisition_finished: multiprocessing.Event
+		Set it when the acquisition finished, then wait for the process
+		to finish with `process.join()`.
+	"""
+	acquisition_finished = multiprocessing.Event()
+	process = multiprocessing.Process(
+		target = parse_waveforms_while_acquiring,
+		kwargs = dict(
+			path_to_run_directory = bureaucrat.path_to_run_directory,
+			name_of_task_that_produced_the_waveforms_to_parse = name_of_task_that_produced_the_waveforms_to_parse,
+			acquisition_finished = acquisition_finished,
+		),
+	)
+	process.start()
+	return process, acquisition_finished
+
+def parse_waveforms_recursively(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str, continue_from_where_we_left_last_time:bool=True, silent:bool=True, number_of_processes:int=1, vectorized:bool=False, CFD_percentages:list=None):
 	if bureaucrat.was_task_run_successfully(name_of_task_that_produced_the_waveforms_to_parse):
 		if not silent:
 			print(f'Going to parse {bureaucrat.run_name}...')
@@ -140,6 +485,9 @@ def parse_waveforms_recursively(bureaucrat:RunBureaucrat, name_of_task_that_prod
 			name_of_task_that_produced_the_waveforms_to_parse = name_of_task_that_produced_the_waveforms_to_parse,
 			continue_from_where_we_left_last_time = continue_from_where_we_left_last_time,
 			silent = silent,
+			number_of_processes = number_of_processes,
+			vectorized = vectorized,
+			CFD_percentages = CFD_percentages,
 		)
 	else:
 		for path_to_task in bureaucrat.path_to_run_directory.iterdir():
@@ -150,6 +498,9 @@ def parse_waveforms_recursively(bureaucrat:RunBureaucrat, name_of_task_that_prod
 						name_of_task_that_produced_the_waveforms_to_parse = name_of_task_that_produced_the_waveforms_to_parse,
 						continue_from_where_we_left_last_time = continue_from_where_we_left_last_time,
 						silent = silent,
+						number_of_processes = number_of_processes,
+						vectorized = vectorized,
+						CFD_percentages = CFD_percentages,
 					)
 
 if __name__=='__main__':
@@ -163,6 +514,28 @@ if __name__=='__main__':
 		dest = 'directory',
 		type = str,
 	)
+	parser.add_argument('--processes',
+		metavar = 'N',
+		help = f'Number of processes to use for parsing. Default is 1, i.e. no parallel processes. This computer has {multiprocessing.cpu_count()} CPUs.',
+		default = 1,
+		dest = 'processes',
+		type = int,
+	)
+	parser.add_argument(
+		'--vectorized',
+		help = 'If this flag is passed, the waveforms are parsed in batches with `waveform_features.compute_features` instead of one by one with `PeakSignal`.',
+		required = False,
+		dest = 'vectorized',
+		action = 'store_true'
+	)
+	parser.add_argument(
+		'--CFD_step',
+		metavar = 'percent',
+		help = 'If given, the time at each CFD threshold from 5 %% to 95 %% in steps of this value is also computed and stored. Requires `--vectorized`.',
+		default = None,
+		dest = 'CFD_step',
+		type = float,
+	)
 
 	args = parser.parse_args()
 	parse_waveforms_recursively(
@@ -170,4 +543,7 @@ if __name__=='__main__':
 		name_of_task_that_produced_the_waveforms_to_parse = 'test_beam',
 		silent = False,
 		continue_from_where_we_left_last_time = True,
+		number_of_processes = args.processes,
+		vectorized = args.vectorized,
+		CFD_percentages = numpy.arange(5,95+args.CFD_step/2,args.CFD_step) if args.CFD_step is not None else None,
 	)
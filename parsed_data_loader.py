@@ -0,0 +1,194 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+import pandas
+import sqlite3
+import json
+import pyarrow # https://github.com/apache/arrow
+import pyarrow.feather
+import pyarrow.compute
+import pyarrow.ipc
+from waveforms_store import INDEX_COLUMNS
+
+ANALYSIS_DATASET_TASK_NAME = 'analysis_dataset'
+
+def columns_of_sqlite_dataframe(path_to_sqlite_file:Path)->list:
+	"""Returns the names of the columns of a file produced by `SQLiteDataFrameDumper`,
+	without the index columns and without reading any row."""
+	with sqlite3.connect(path_to_sqlite_file) as connection:
+		columns = [row[1] for row in connection.execute('PRAGMA table_info(dataframe_table)')]
+	return [_ for _ in columns if _ not in INDEX_COLUMNS]
+
+def load_sqlite_dataframe(path_to_sqlite_file:Path, columns:list=None, slots_numbers:list=None, n_trigger_range:tuple=None)->pandas.DataFrame:
+	"""Same as `load_whole_dataframe` for a file produced by `SQLiteDataFrameDumper`
+	with `INDEX_COLUMNS` as index, but reading only what is asked for. The
+	filters are part of the SQL query, so the rest of the file is never
+	loaded into memory.
+
+	Arguments
+	---------
+	path_to_sqlite_file: Path
+		Path to the file, e.g. `parsed_from_waveforms.sqlite`.
+	columns: list of str, optional
+		The columns to read, besides the index. If not given, all of them
+		are read.
+	slots_numbers: list of int, optional
+		If given, only the rows of these slots are read.
+	n_trigger_range: tuple of int, optional
+		A tuple `(start, stop)`, if given only the rows with `start <= n_trigger < stop`
+		are read.
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		A data frame with `INDEX_COLUMNS` as index.
+	"""
+	existing_columns = columns_of_sqlite_dataframe(path_to_sqlite_file)
+	if columns is None:
+		columns = existing_columns
+	elif not set(columns).issubset(set(existing_columns)): # Has to be checked because SQLite takes an unknown "column" as a string literal.
+		raise ValueError(f'Columns {sorted(set(columns)-set(existing_columns))} are not in {path_to_sqlite_file}, which columns are {existing_columns}.')
+
+	conditions = []
+	params = []
+	if slots_numbers is not None:
+		slots_numbers = [int(_) for _ in slots_numbers]
+		conditions.append(f'slot_number IN ({", ".join(["?"]*len(slots_numbers))})')
+		params += slots_numbers
+	if n_trigger_range is not None:
+		conditions.append('n_trigger >= ? AND n_trigger < ?')
+		params += [int(_) for _ in n_trigger_range]
+	columns_to_read = ', '.join([f'"{_}"' for _ in INDEX_COLUMNS+list(columns)])
+	where = f'WHERE {" AND ".join(conditions)}' if len(conditions) > 0 else ''
+	with sqlite3.connect(path_to_sqlite_file) as connection:
+		df = pandas.read_sql_query(
+			f'SELECT {columns_to_read} FROM dataframe_table {where}',
+			connection,
+			params = params,
+		)
+	return df.set_index(INDEX_COLUMNS)
+
+def load_slots_names(bureaucrat:RunBureaucrat)->pandas.DataFrame:
+	"""Returns a data frame with `slot_number` as index and the `signal_name`
+	and `device_name` of each slot, as the first time it appears in
+	`extra_stuff.sqlite`, reading only those rows."""
+	bureaucrat.check_these_tasks_were_run_successfully('test_beam')
+	with sqlite3.connect(bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite') as connection:
+		slots_names = pandas.read_sql_query(
+			'SELECT slot_number, signal_name, device_name FROM dataframe_table WHERE rowid IN (SELECT MIN(rowid) FROM dataframe_table GROUP BY slot_number)',
+			connection,
+		)
+	return slots_names.set_index('slot_number')
+
+def load_signals_names(bureaucrat:RunBureaucrat)->pandas.Series:
+	"""Returns a series with `slot_number` as index and the `signal_name`
+	of each slot, see `load_slots_names`."""
+	return load_slots_names(bureaucrat)['signal_name']
+
+def load_parsed_from_waveforms(bureaucrat:RunBureaucrat, columns:list=None, signals_names:list=None, slots_numbers:list=None, n_trigger_range:tuple=None)->pandas.DataFrame:
+	"""Loads the data from `parse_waveforms` with the column `signal_name`
+	added, reading only what is asked for, see `load_sqlite_dataframe`.
+
+	Arguments
+	---------
+	bureaucrat: RunBureaucrat
+		The bureaucrat of the run.
+	columns: list of str, optional
+		The columns to read. If not given, all of them are read.
+	signals_names: list of str, optional
+		If given, only the rows of these signals are read.
+	slots_numbers: list of int, optional
+		If given, only the rows of these slots are read.
+	n_trigger_range: tuple of int, optional
+		See `load_sqlite_dataframe`.
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		A data frame with `INDEX_COLUMNS` as index, `columns` and `signal_name`
+		as columns.
+	"""
+	bureaucrat.check_these_tasks_were_run_successfully('parse_waveforms')
+	signal_names = load_signals_names(bureaucrat)
+	if signals_names is not None:
+		if any([_ not in set(signal_names) for _ in signals_names]):
+			raise ValueError(f'One (or more) of `signals_names` {signals_names} is not present in the data, the signal names are {sorted(set(signal_names))}.')
+		slots_of_these_signals = set(signal_names[signal_names.isin(signals_names)].index)
+		slots_numbers = slots_of_these_signals if slots_numbers is None else slots_of_these_signals & set(slots_numbers)
+	df = load_sqlite_dataframe(
+		bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite',
+		columns = columns,
+		slots_numbers = sorted(slots_numbers) if slots_numbers is not None else None,
+		n_trigger_range = n_trigger_range,
+	)
+	return df.join(signal_names, on='slot_number')
+
+def _fingerprint_of_analysis_dataset_sources(bureaucrat:RunBureaucrat)->dict:
+	"""Size and modification time of each file from which the analysis
+	dataset is produced, so it can be known whether it is outdated without
+	reading them."""
+	sources = {
+		'parsed_from_waveforms': bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite',
+		'extra_stuff': bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite',
+		'slots_configuration': bureaucrat.path_to_directory_of_task('test_beam')/'slots_configuration.csv',
+	}
+	if bureaucrat.was_task_run_successfully('clean_test_beam'):
+		sources['clean_test_beam'] = bureaucrat.path_to_directory_of_task('clean_test_beam')/'result.fd'
+	return {name: [path.stat().st_size, path.stat().st_mtime_ns] if path.is_file() else None for name,path in sources.items()}
+
+def _produce_analysis_dataset(bureaucrat:RunBureaucrat, fingerprint:dict):
+	with bureaucrat.handle_task(ANALYSIS_DATASET_TASK_NAME) as employee:
+		df = load_sqlite_dataframe(bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
+		df = df.join(load_slots_names(bureaucrat), on='slot_number')
+		if fingerprint.get('clean_test_beam') is not None:
+			df = df.join(pandas.read_feather(bureaucrat.path_to_directory_of_task('clean_test_beam')/'result.fd').set_index('n_trigger'), on='n_trigger', how='inner') # Same as `clean_test_beam.tag_n_trigger_as_background_according_to_the_result_of_clean_test_beam`.
+		else:
+			df['is_background'] = False
+		df.reset_index(drop=False).to_feather(employee.path_to_directory_of_my_task/'analysis_dataset.feather', compression='uncompressed') # Uncompressed so it can be memory mapped.
+		with open(employee.path_to_directory_of_my_task/'fingerprint.json', 'w') as ofile:
+			json.dump(fingerprint, ofile)
+
+def load_analysis_dataset(bureaucrat:RunBureaucrat, columns:list=None, signals_names:list=None)->pandas.DataFrame:
+	"""Loads the data from `parse_waveforms` together with the `signal_name`
+	and `device_name` of each slot and the `is_background` tag from
+	`clean_test_beam`, which is `False` for all the triggers if there was
+	no cleaning. This is stored in an `analysis_dataset` task the first
+	time, and produced again only when `parsed_from_waveforms.sqlite`,
+	the slots configuration or the result of `clean_test_beam` change,
+	so each analysis script just memory maps it.
+
+	Arguments
+	---------
+	bureaucrat: RunBureaucrat
+		The bureaucrat of the run.
+	columns: list of str, optional
+		The columns from `parse_waveforms` to read. If not given, all
+		of them are read. `signal_name`, `device_name` and `is_background`
+		are always read.
+	signals_names: list of str, optional
+		If given, only the rows of these signals are read.
+
+	Returns
+	-------
+	df: pandas.DataFrame
+		A data frame with `INDEX_COLUMNS` as index.
+	"""
+	bureaucrat.check_these_tasks_were_run_successfully(['test_beam','parse_waveforms'])
+
+	fingerprint = _fingerprint_of_analysis_dataset_sources(bureaucrat)
+	path_to_fingerprint = bureaucrat.path_to_directory_of_task(ANALYSIS_DATASET_TASK_NAME)/'fingerprint.json'
+	if not bureaucrat.was_task_run_successfully(ANALYSIS_DATASET_TASK_NAME) or not path_to_fingerprint.is_file() or json.loads(path_to_fingerprint.read_text()) != fingerprint:
+		_produce_analysis_dataset(bureaucrat, fingerprint)
+
+	path_to_dataset = bureaucrat.path_to_directory_of_task(ANALYSIS_DATASET_TASK_NAME)/'analysis_dataset.feather'
+	if columns is not None:
+		existing_columns = pyarrow.ipc.open_file(pyarrow.memory_map(str(path_to_dataset))).schema.names
+		if not set(columns).issubset(set(existing_columns)):
+			raise ValueError(f'Columns {sorted(set(columns)-set(existing_columns))} are not in the data of run {repr(bureaucrat.run_name)}, which columns are {existing_columns}.')
+		columns = INDEX_COLUMNS + list(columns) + ['signal_name','device_name','is_background']
+	table = pyarrow.feather.read_table(path_to_dataset, columns=columns, memory_map=True)
+	if signals_names is not None:
+		existing_signals_names = pyarrow.compute.unique(table['signal_name']).to_pylist()
+		if any([_ not in existing_signals_names for _ in signals_names]):
+			raise ValueError(f'One (or more) of `signals_names` {signals_names} is not present in the data, the signal names are {sorted(existing_signals_names)}.')
+		table = table.filter(pyarrow.compute.is_in(table['signal_name'], value_set=pyarrow.array(list(signals_names))))
+	return table.to_pandas().set_index(INDEX_COLUMNS)
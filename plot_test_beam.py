@@ -2,21 +2,20 @@ from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/Senger
 from pathlib import Path
 import pandas
 import dominate # https://github.com/Knio/dominate
-from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import plotly.express as px
+from parsed_data_loader import load_analysis_dataset
+from scatter_matrix_plot import scatter_matrix, MAX_POINTS_IN_SCATTER_MATRIX
 
-def plot_test_beam(bureaucrat:RunBureaucrat):
+def plot_test_beam(bureaucrat:RunBureaucrat, max_points_in_scatter_matrix:int=MAX_POINTS_IN_SCATTER_MATRIX, scatter_matrix_large_data:str='subsample'):
+	"""Plots the distributions of everything that was parsed from the
+	waveforms. For the arguments `max_points_in_scatter_matrix` and
+	`scatter_matrix_large_data` see `scatter_matrix_plot.scatter_matrix`."""
 	bureaucrat.check_these_tasks_were_run_successfully(['test_beam','parse_waveforms'])
 	
 	with bureaucrat.handle_task('plot_test_beam') as employee:
-		parsed_from_waveforms = load_whole_dataframe(bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
-		extra_stuff = load_whole_dataframe(bureaucrat.path_to_directory_of_task('test_beam')/'extra_stuff.sqlite')
+		data = load_analysis_dataset(bureaucrat)
 		
-		variables_to_plot = set(parsed_from_waveforms.columns)
-		
-		signal_names = extra_stuff.reset_index(drop=False).set_index('slot_number')['signal_name']
-		signal_names = signal_names[~signal_names.index.duplicated(keep='first')]
-		data = parsed_from_waveforms.join(signal_names, on='slot_number')
+		variables_to_plot = set(data.columns) - {'signal_name','device_name','is_background'}
 		
 		PATH_FOR_DISTRIBUTION_PLOTS = employee.path_to_directory_of_my_task/'distributions'
 		PATH_FOR_DISTRIBUTION_PLOTS.mkdir(exist_ok=True)
@@ -32,22 +31,14 @@ def plot_test_beam(bureaucrat:RunBureaucrat):
 				include_plotlyjs = 'cdn',
 			)
 		dimensions = set(variables_to_plot) - {f't_{i} (s)' for i in [10,20,30,40,60,70,80,90]} - {f'Time over {i}% (s)' for i in [10,30,40,50,60,70,80,90]} - {'device_name'} - {'signal_name'}
-		fig = px.scatter_matrix(
+		fig = scatter_matrix(
 			data.reset_index(drop=False),
 			dimensions = sorted(dimensions),
 			color = 'signal_name',
 			title = f'Scatter matrix plot<br><sup>Run: {bureaucrat.run_name}',
+			max_points = max_points_in_scatter_matrix,
+			large_data = scatter_matrix_large_data,
 		)
-		fig.update_traces(diagonal_visible=False, showupperhalf=False, marker = {'size': 3})
-		for k in range(len(fig.data)):
-			fig.data[k].update(
-				selected = dict(
-					marker = dict(
-						opacity = 1,
-						color = 'black',
-					)
-				),
-			)
 		fig.write_html(
 			employee.path_to_directory_of_my_task/'scatter_matrix_plot.html',
 			include_plotlyjs = 'cdn',
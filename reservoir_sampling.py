@@ -0,0 +1,72 @@
+import random
+
+class StratifiedReservoir:
+	"""Keeps a uniform random sample of at most `n_per_stratum` items of
+	each stratum out of a stream of items whose length is not known in
+	advance (reservoir sampling, "algorithm R"), so the memory needed
+	does not grow with the stream. The state can be saved as JSON and
+	restored, so the stream can be split among many calls.
+
+	Example
+	-------
+	```
+	reservoir = StratifiedReservoir(n_per_stratum=2)
+	reservoir.add(items=[(0,1),(0,2),(1,1)], strata=['a','b','a'])
+	print(reservoir.sample) # {'a': [(0,1),(1,1)], 'b': [(0,2)]}
+	```
+	"""
+	def __init__(self, n_per_stratum:int):
+		self.n_per_stratum = n_per_stratum
+		self._reservoirs = {}
+
+	def add(self, items:list, strata:list):
+		"""Adds each of the `items` to the stream of its stratum.
+
+		Arguments
+		---------
+		items: list of tuples
+			The items, e.g. the `(n_trigger, slot_number)` of waveforms.
+		strata: list of tuples or strings
+			The stratum to which each item belongs.
+		"""
+		for item,stratum in zip(items, strata):
+			reservoir = self._reservoirs.setdefault(stratum, {'seen': 0, 'items': []})
+			reservoir['seen'] += 1
+			if len(reservoir['items']) < self.n_per_stratum:
+				reservoir['items'].append(item)
+			else:
+				i = random.randrange(reservoir['seen'])
+				if i < self.n_per_stratum:
+					reservoir['items'][i] = item
+
+	@property
+	def sample(self)->dict:
+		"""A dictionary of the form `{stratum: list_of_items}`."""
+		return {stratum: list(reservoir['items']) for stratum,reservoir in self._reservoirs.items()}
+
+	@property
+	def n_seen(self)->dict:
+		"""A dictionary of the form `{stratum: number_of_items_added}`."""
+		return {stratum: reservoir['seen'] for stratum,reservoir in self._reservoirs.items()}
+
+	def to_state(self)->dict:
+		"""Returns the state as a dictionary that can be dumped to JSON."""
+		return {
+			'n_per_stratum': self.n_per_stratum,
+			'reservoirs': [
+				{
+					'stratum': list(stratum) if isinstance(stratum, tuple) else stratum,
+					'seen': reservoir['seen'],
+					'items': [list(item) for item in reservoir['items']],
+				} for stratum,reservoir in self._reservoirs.items()
+			],
+		}
+
+	@classmethod
+	def from_state(cls, state:dict):
+		"""Creates a `StratifiedReservoir` from what `to_state` returned."""
+		reservoir = cls(n_per_stratum=state['n_per_stratum'])
+		for r in state['reservoirs']:
+			stratum = tuple(r['stratum']) if isinstance(r['stratum'], list) else r['stratum']
+			reservoir._reservoirs[stratum] = {'seen': r['seen'], 'items': [tuple(item) for item in r['items']]}
+		return reservoir
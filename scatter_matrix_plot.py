@@ -0,0 +1,143 @@
+import pandas
+import numpy
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+MAX_POINTS_IN_SCATTER_MATRIX = 22222
+LINE_DASHES = ['solid','dash','dot','dashdot','longdash','longdashdot']
+
+def _scatter_matrix_of_points(df:pandas.DataFrame, dimensions:list, **kwargs)->go.Figure:
+	fig = px.scatter_matrix(
+		df,
+		dimensions = dimensions,
+		**kwargs,
+	)
+	fig.update_traces(diagonal_visible=False, showupperhalf=False, marker = {'size': 3})
+	for k in range(len(fig.data)):
+		fig.data[k].update(
+			selected = dict(
+				marker = dict(
+					opacity = 1,
+					color = 'black',
+				)
+			),
+		)
+	return fig
+
+def _scatter_matrix_of_densities(df:pandas.DataFrame, dimensions:list, color:str=None, symbol:str=None, title:str=None, color_discrete_map:dict=None, n_bins:int=44)->go.Figure:
+	"""Same layout as `_scatter_matrix_of_points` (only the lower half)
+	but each group of points, given by `color` and `symbol`, is drawn as
+	the contour lines of its 2D histogram, computed here, so the size of
+	the figure does not depend on the number of points. The bins span
+	from the 0.5 to the 99.5 percentile of each dimension."""
+	colors = iter(px.colors.qualitative.Plotly)
+	groups = [_ for _ in [color,symbol] if _ is not None]
+	groups_colors = {}
+	groups_dashes = {}
+	for group in (sorted(set(df[color])) if color is not None else [None]):
+		groups_colors[group] = color_discrete_map[group] if color_discrete_map is not None and group in color_discrete_map else next(colors)
+	for k,group in enumerate(sorted(set(df[symbol])) if symbol is not None else [None]):
+		groups_dashes[group] = LINE_DASHES[k%len(LINE_DASHES)]
+	bins_edges = {}
+	for dimension in dimensions:
+		lowest, highest = numpy.nanpercentile(df[dimension], [.5,99.5]) if df[dimension].notna().any() else (0,1)
+		if lowest == highest:
+			lowest, highest = lowest-.5, highest+.5
+		bins_edges[dimension] = numpy.linspace(lowest, highest, n_bins+1)
+
+	fig = make_subplots(
+		rows = len(dimensions)-1,
+		cols = len(dimensions)-1,
+		shared_xaxes = True,
+		shared_yaxes = True,
+		horizontal_spacing = .01,
+		vertical_spacing = .01,
+	)
+	for group,group_df in (df.groupby(groups) if len(groups) > 0 else [((),df)]):
+		group = group if isinstance(group, tuple) else (group,)
+		group_color = groups_colors[group[0]] if color is not None else groups_colors[None]
+		group_dash = groups_dashes[group[-1]] if symbol is not None else groups_dashes[None]
+		name = ', '.join([str(_) for _ in group]) if len(group) > 0 else 'Density'
+		for i in range(1,len(dimensions)):
+			for j in range(i):
+				density, _, _ = numpy.histogram2d(group_df[dimensions[j]], group_df[dimensions[i]], bins=[bins_edges[dimensions[j]],bins_edges[dimensions[i]]])
+				fig.add_trace(
+					go.Contour(
+						x = (bins_edges[dimensions[j]][1:]+bins_edges[dimensions[j]][:-1])/2,
+						y = (bins_edges[dimensions[i]][1:]+bins_edges[dimensions[i]][:-1])/2,
+						z = density.T,
+						contours_coloring = 'lines',
+						line = dict(color=group_color, dash=group_dash),
+						colorscale = [[0,group_color],[1,group_color]],
+						showscale = False,
+						name = name,
+						legendgroup = name,
+						showlegend = i==1 and j==0,
+						hovertemplate = f'{dimensions[j]}: %{{x:.2e}}<br>{dimensions[i]}: %{{y:.2e}}<br>count: %{{z}}',
+					),
+					row = i,
+					col = j+1,
+				)
+	for k,dimension in enumerate(dimensions[:-1]):
+		fig.update_xaxes(title_text=dimension, row=len(dimensions)-1, col=k+1)
+	for k,dimension in enumerate(dimensions[1:]):
+		fig.update_yaxes(title_text=dimension, row=k+1, col=1)
+	fig.update_layout(title=title, legend_title_text=', '.join(groups))
+	return fig
+
+def scatter_matrix(df:pandas.DataFrame, dimensions:list, color:str=None, symbol:str=None, title:str=None, hover_data:list=None, color_discrete_map:dict=None, max_points:int=MAX_POINTS_IN_SCATTER_MATRIX, large_data:str='subsample')->go.Figure:
+	"""Produces the scatter matrix plot of `dimensions`, as `px.scatter_matrix`
+	with only the lower half, for any number of rows in `df`. If there
+	are more than `max_points` rows, the size of the plot is kept bounded
+	by either plotting a random subsample of them or the density of
+	points, according to `large_data`.
+
+	Arguments
+	---------
+	df: pandas.DataFrame
+		The data, one point per row.
+	dimensions: list of str
+		The columns to plot against each other.
+	color, symbol, title, hover_data, color_discrete_map:
+		Same as for `px.scatter_matrix`. With `large_data='density'`
+		each value of `symbol` is drawn with a different line dash and
+		`hover_data` is ignored.
+	max_points: int
+		Maximum number of points to plot one by one.
+	large_data: str, default `'subsample'`
+		What to do when there are more than `max_points` rows. `'subsample'`
+		plots `max_points` rows randomly selected, `'density'` plots
+		the contours of the 2D histogram of each group of points given
+		by `color` and `symbol`.
+
+	Returns
+	-------
+	fig: go.Figure
+		The figure.
+	"""
+	if large_data not in {'subsample','density'}:
+		raise ValueError(f'`large_data` must be `"subsample"` or `"density"`, received {repr(large_data)}.')
+	if len(df) > max_points and large_data == 'density':
+		if len(dimensions) < 2:
+			raise ValueError(f'`large_data="density"` needs at least 2 `dimensions` to plot one against the other, received {repr(dimensions)}.')
+		return _scatter_matrix_of_densities(
+			df,
+			dimensions = dimensions,
+			color = color,
+			symbol = symbol,
+			title = f'{title}<br><sup>Density of {len(df)} points</sup>' if title is not None else None,
+			color_discrete_map = color_discrete_map,
+		)
+	if len(df) > max_points:
+		title = f'{title}<br><sup>Random subsample of {max_points} out of {len(df)} points</sup>' if title is not None else None
+		df = df.sample(n=max_points, random_state=0).sort_index()
+	return _scatter_matrix_of_points(
+		df,
+		dimensions = dimensions,
+		color = color,
+		symbol = symbol,
+		title = title,
+		hover_data = hover_data,
+		color_discrete_map = color_discrete_map,
+	)
@@ -0,0 +1,140 @@
+from multiprocessing import shared_memory
+import threading
+import time
+import numpy
+
+VARIABLES = ['Time (s)','Amplitude (V)']
+
+class SharedMemoryWaveformsRing:
+	"""A ring of preallocated shared memory buffers in which the setup
+	server puts the waveforms downloaded from the oscilloscope, so the
+	clients can read them directly instead of receiving them pickled.
+	Each buffer is lent to one client until it releases it. This only
+	works when the clients run in the same computer as the server.
+	"""
+	def __init__(self, n_buffers:int=8, buffer_size_bytes:int=2**25, lease_seconds:float=60):
+		"""
+		Arguments
+		---------
+		n_buffers: int, default 8
+			Number of buffers in the ring.
+		buffer_size_bytes: int, default 2**25
+			Size of each buffer. All the segments of one channel have to
+			fit in one buffer.
+		lease_seconds: float, default 60
+			If a client does not release a buffer within this time, e.g.
+			because it crashed, the buffer is taken back.
+		"""
+		self.buffer_size_bytes = buffer_size_bytes
+		self.lease_seconds = lease_seconds
+		self._buffers = [shared_memory.SharedMemory(create=True, size=buffer_size_bytes) for _ in range(n_buffers)]
+		for buffer in self._buffers: # So clients in this same process use them instead of attaching again, see `_attach`.
+			_attached_shared_memories[buffer.name] = buffer
+		self._lent_when = [None]*n_buffers
+		self._condition = threading.Condition()
+
+	def _borrow_buffer(self, timeout:float)->int:
+		def find_free_buffer():
+			for i,lent_when in enumerate(self._lent_when):
+				if lent_when is None or time.time() - lent_when > self.lease_seconds:
+					return i
+		with self._condition:
+			i = self._condition.wait_for(lambda: find_free_buffer() is not None, timeout=timeout)
+			if i is False:
+				raise TimeoutError(f'No shared memory buffer was released within {timeout} seconds.')
+			i = find_free_buffer()
+			self._lent_when[i] = time.time()
+			return i
+
+	def write(self, segments:list, timeout:float=None)->dict:
+		"""Copies the waveforms into a free buffer, waiting for one if all
+		of them are lent.
+
+		Arguments
+		---------
+		segments: list
+			A list with one `{'Time (s)': array, 'Amplitude (V)': array}`
+			per segment, all of them with the same number of samples, as
+			returned by the oscilloscope.
+		timeout: float, optional
+			Maximum number of seconds to wait for a free buffer.
+
+		Returns
+		-------
+		descriptor: dict
+			A small dictionary telling where the waveforms are, to be
+			given to `read_shared_memory_waveforms` and, afterwards, to
+			`release`.
+		"""
+		shape = (len(segments), len(segments[0]['Time (s)']) if len(segments)>0 else 0)
+		dtype = numpy.dtype('float64')
+		n_bytes_per_variable = shape[0]*shape[1]*dtype.itemsize
+		if n_bytes_per_variable*len(VARIABLES) > self.buffer_size_bytes:
+			raise ValueError(f'The waveforms need {n_bytes_per_variable*len(VARIABLES)} bytes but the shared memory buffers have {self.buffer_size_bytes} bytes.')
+		i = self._borrow_buffer(timeout)
+		descriptor = {
+			'n_buffer': i,
+			'shared_memory_name': self._buffers[i].name,
+			'lent_when': self._lent_when[i],
+			'shape': shape,
+			'dtype': dtype.str,
+			'offsets': {variable: n*n_bytes_per_variable for n,variable in enumerate(VARIABLES)},
+		}
+		for variable in VARIABLES:
+			destination = numpy.ndarray(shape, dtype=dtype, buffer=self._buffers[i].buf, offset=descriptor['offsets'][variable])
+			for n_segment,segment in enumerate(segments):
+				destination[n_segment] = segment[variable]
+		return descriptor
+
+	def release(self, descriptor:dict):
+		"""Gives back the buffer described by `descriptor`. If it was
+		already taken back because the lease expired, nothing is done."""
+		with self._condition:
+			if self._lent_when[descriptor['n_buffer']] == descriptor['lent_when']:
+				self._lent_when[descriptor['n_buffer']] = None
+				self._condition.notify_all()
+
+	def close(self):
+		"""Frees all the shared memory."""
+		for buffer in self._buffers:
+			_attached_shared_memories.pop(buffer.name, None)
+			buffer.close()
+			buffer.unlink()
+
+_attached_shared_memories = {}
+
+def _attach(shared_memory_name:str)->shared_memory.SharedMemory:
+	if shared_memory_name not in _attached_shared_memories:
+		try:
+			attached = shared_memory.SharedMemory(name=shared_memory_name, track=False)
+		except TypeError: # `track` is new in Python 3.13.
+			from multiprocessing import resource_tracker
+			attached = shared_memory.SharedMemory(name=shared_memory_name)
+			resource_tracker.unregister(attached._name, 'shared_memory') # Otherwise it is deleted when this process ends, but it belongs to the server.
+		_attached_shared_memories[shared_memory_name] = attached
+	return _attached_shared_memories[shared_memory_name]
+
+def read_shared_memory_waveforms(descriptor:dict, copy:bool=True)->dict:
+	"""Reads the waveforms written by `SharedMemoryWaveformsRing.write`.
+
+	Arguments
+	---------
+	descriptor: dict
+		What `SharedMemoryWaveformsRing.write` returned.
+	copy: bool, default True
+		If `False`, the arrays returned point directly to the shared
+		memory, so they are only valid until the buffer is released.
+
+	Returns
+	-------
+	waveforms: dict
+		A dictionary of the form `{'Time (s)': array, 'Amplitude (V)': array}`
+		where each array has one row per segment.
+	"""
+	buffer = _attach(descriptor['shared_memory_name'])
+	waveforms = {}
+	for variable in VARIABLES:
+		waveforms[variable] = numpy.ndarray(descriptor['shape'], dtype=numpy.dtype(descriptor['dtype']), buffer=buffer.buf, offset=descriptor['offsets'][variable])
+		if copy:
+			waveforms[variable] = waveforms[variable].copy()
+	return waveforms
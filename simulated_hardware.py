@@ -0,0 +1,296 @@
+from pathlib import Path
+import threading
+import time
+import numpy
+import pandas
+from TheSetup import TheRobocoldBetaSetup
+
+class _TimeAccounting:
+	"""Keeps track of the number of calls and the total time spent in
+	each method of a simulated instrument."""
+	def __init__(self):
+		self._statistics = {}
+		self._statistics_Lock = threading.Lock()
+
+	def _account(self, method_name:str, seconds:float):
+		with self._statistics_Lock:
+			n_calls, total_seconds = self._statistics.get(method_name, (0, 0))
+			self._statistics[method_name] = (n_calls+1, total_seconds+seconds)
+
+	def statistics(self)->pandas.DataFrame:
+		"""Returns a data frame with the number of calls and total time
+		spent in each method."""
+		with self._statistics_Lock:
+			statistics = pandas.DataFrame.from_records(
+				[{'method': method_name, 'n_calls': n_calls, 'Total time (s)': total_seconds} for method_name,(n_calls,total_seconds) in self._statistics.items()],
+				columns = ['method','n_calls','Total time (s)'],
+			)
+		return statistics.set_index('method')
+
+class SimulatedOscilloscope(_TimeAccounting):
+	"""Mimics the `TeledyneLeCroyPy.LeCroyWaveRunner` in sequence mode.
+	Each trigger gives `n_segments` segments, each with one LGAD like
+	pulse in each channel (or only noise, with probability `probability_of_no_hit`)."""
+	def __init__(self, trigger_rate_hz:float=1000, n_segments:int=111, n_samples:int=1002, sampling_frequency_hz:float=20e9, transfer_bytes_per_second:float=40e6, n_channels:int=4, probability_of_no_hit:float=.1, noise_volts:float=2e-3, pulse_amplitude_volts:float=.1, rise_time_seconds:float=500e-12, fall_time_seconds:float=1e-9, jitter_seconds:float=30e-12, seed:int=None):
+		"""
+		Arguments
+		---------
+		trigger_rate_hz: float, default 1000
+			Mean rate of the (Poisson) triggers. The time to fill all the
+			segments is, on average, `n_segments/trigger_rate_hz`.
+		n_segments: int, default 111
+			Number of segments acquired each time `wait_for_single_trigger`
+			is called.
+		n_samples: int, default 1002
+			Number of samples in each segment.
+		sampling_frequency_hz: float, default 20e9
+			Sampling frequency.
+		transfer_bytes_per_second: float, default 40e6
+			Speed of the connection with the computer. Each sample is
+			transferred as 2 bytes, as the LeCroy does.
+		n_channels: int, default 4
+			Number of channels.
+		probability_of_no_hit: float, default .1
+			Probability that a segment of a channel has only noise.
+		noise_volts: float, default 2e-3
+			Standard deviation of the noise.
+		pulse_amplitude_volts: float, default .1
+			Most probable amplitude of the pulses, the amplitudes follow
+			a Moyal distribution (an approximation of Landau).
+		rise_time_seconds, fall_time_seconds: float
+			Time constants of the pulses.
+		jitter_seconds: float, default 30e-12
+			Time jitter of each pulse with respect to the trigger.
+		seed: int, optional
+			Seed for the random numbers.
+		"""
+		_TimeAccounting.__init__(self)
+		self.trigger_rate_hz = trigger_rate_hz
+		self.n_segments = n_segments
+		self.n_samples = n_samples
+		self.sampling_frequency_hz = sampling_frequency_hz
+		self.transfer_bytes_per_second = transfer_bytes_per_second
+		self.n_channels = n_channels
+		self.probability_of_no_hit = probability_of_no_hit
+		self.noise_volts = noise_volts
+		self.pulse_amplitude_volts = pulse_amplitude_volts
+		self.rise_time_seconds = rise_time_seconds
+		self.fall_time_seconds = fall_time_seconds
+		self.jitter_seconds = jitter_seconds
+		self._random = numpy.random.default_rng(seed)
+		self._vdiv = {n_channel: .05 for n_channel in range(1,n_channels+1)}
+		self._trigger_level = -.01
+		self._n_acquisition = 0
+		self._triggers_times = None
+
+	@property
+	def idn(self)->str:
+		return f'Simulated oscilloscope, {self.n_channels} channels, {self.n_segments} segments of {self.n_samples} samples, {self.trigger_rate_hz} Hz trigger rate'
+
+	def set_vdiv(self, channel:int, vdiv:float):
+		self._vdiv[channel] = vdiv
+
+	def get_trig_source(self)->str:
+		return 'C1'
+
+	def set_trig_level(self, trig_source:str, level:float):
+		self._trigger_level = level
+
+	def wait_for_single_trigger(self):
+		started = time.time()
+		# The time between Poisson events is exponential, so the time to fill all the segments is the sum of them.
+		time.sleep(self._random.gamma(shape=self.n_segments, scale=1/self.trigger_rate_hz))
+		self._n_acquisition += 1
+		self._triggers_times = self._random.uniform(.4, .6, size=self.n_segments)*self.n_samples/self.sampling_frequency_hz
+		self._account('wait_for_single_trigger', time.time()-started)
+
+	def get_waveform(self, channel:int)->list:
+		"""Returns a list with one `{'Time (s)': array, 'Amplitude (V)': array}`
+		for each segment of the last trigger."""
+		if self._triggers_times is None:
+			raise RuntimeError('There was no trigger yet.')
+		if channel not in self._vdiv:
+			raise ValueError(f'`channel` must be one of {sorted(self._vdiv)}, received {channel}.')
+		started = time.time()
+		time.sleep(self.n_segments*self.n_samples*2/self.transfer_bytes_per_second)
+		t = numpy.arange(self.n_samples)/self.sampling_frequency_hz
+		amplitude = self._random.normal(scale=self.noise_volts, size=(self.n_segments, self.n_samples))
+		pulses_amplitudes = self.pulse_amplitude_volts*(1-.2*numpy.log(self._random.chisquare(1, size=self.n_segments))) # Moyal distribution.
+		pulses_amplitudes[self._random.random(self.n_segments) < self.probability_of_no_hit] = 0
+		t_pulse = t[numpy.newaxis,:] - (self._triggers_times + self._random.normal(scale=self.jitter_seconds, size=self.n_segments))[:,numpy.newaxis]
+		with numpy.errstate(over='ignore'):
+			shape = numpy.where(t_pulse > 0, (1-numpy.exp(-t_pulse/self.rise_time_seconds))*numpy.exp(-t_pulse/self.fall_time_seconds), 0)
+		amplitude -= pulses_amplitudes[:,numpy.newaxis]*shape/shape.max(axis=1, initial=1e-99, keepdims=True) # LGAD signals are negative.
+		amplitude = numpy.clip(amplitude, -4*self._vdiv[channel], 4*self._vdiv[channel]) # The screen of the oscilloscope has 8 divisions.
+		ADC_step = 8*self._vdiv[channel]/2**8 # The digitizer has 8 bits for the 8 divisions.
+		amplitude = numpy.round(amplitude/ADC_step)*ADC_step
+		waveforms = [{'Time (s)': t + n_segment*1e-6, 'Amplitude (V)': amplitude[n_segment]} for n_segment in range(self.n_segments)]
+		self._account('get_waveform', time.time()-started)
+		return waveforms
+
+class SimulatedCAEN(_TimeAccounting):
+	"""Mimics a `CAENpy`'s `CAENDesktopHighVoltagePowerSupply`. Each
+	query takes `serial_latency_seconds`, and only one query at a time
+	can be done, as in a serial port. The voltage ramps at `ramp_speed_volts_per_second`."""
+	def __init__(self, serial_number:str='13398', n_channels:int=4, serial_latency_seconds:float=.03, ramp_speed_volts_per_second:float=5, breakdown_voltage:float=250, seed:int=None):
+		"""
+		Arguments
+		---------
+		serial_number: str, default '13398'
+			Serial number of the simulated CAEN.
+		n_channels: int, default 4
+			Number of channels.
+		serial_latency_seconds: float, default .03
+			Time that each query takes.
+		ramp_speed_volts_per_second: float, default 5
+			Speed with which the voltage goes towards the set value.
+		breakdown_voltage: float, default 250
+			Voltage at which the (simulated) leakage current explodes.
+		seed: int, optional
+			Seed for the random numbers.
+		"""
+		_TimeAccounting.__init__(self)
+		self.serial_number = serial_number
+		self.serial_latency_seconds = serial_latency_seconds
+		self.ramp_speed_volts_per_second = ramp_speed_volts_per_second
+		self.breakdown_voltage = breakdown_voltage
+		self._random = numpy.random.default_rng(seed)
+		self._serial_port_Lock = threading.Lock()
+		self._channels = {
+			n_channel: {
+				'VSET': 0.,
+				'ISET': 100., # µA, as in the CAEN.
+				'output': 'off',
+				'V_from': 0.,
+				'ramp_started': time.time(),
+			} for n_channel in range(n_channels)
+		}
+
+	@property
+	def idn(self)->str:
+		return f'Simulated CAEN DT1470ET, serial number {self.serial_number}'
+
+	def _query(self, method_name:str, function):
+		with self._serial_port_Lock:
+			started = time.time()
+			time.sleep(self.serial_latency_seconds)
+			result = function()
+			self._account(method_name, time.time()-started)
+			return result
+
+	def _target_voltage(self, channel:int)->float:
+		return self._channels[channel]['VSET'] if self._channels[channel]['output'] == 'on' else 0
+
+	def _start_ramp(self, channel:int):
+		self._channels[channel]['V_from'] = self._voltage(channel)
+		self._channels[channel]['ramp_started'] = time.time()
+
+	def _voltage(self, channel:int)->float:
+		c = self._channels[channel]
+		target = self._target_voltage(channel)
+		travelled = (time.time()-c['ramp_started'])*self.ramp_speed_volts_per_second
+		if travelled >= abs(target-c['V_from']):
+			return target
+		return c['V_from'] + numpy.sign(target-c['V_from'])*travelled
+
+	def _current(self, channel:int)->float:
+		V = self._voltage(channel)
+		current = 1e-9*(abs(V)/100) + 1e-9*numpy.exp((abs(V)-self.breakdown_voltage)/10)
+		current = min(current, self._channels[channel]['ISET']*1e-6)
+		return float(current*(1+.01*self._random.normal()))
+
+	def V_mon(self, channel:int)->float:
+		return self._query('V_mon', lambda: self._voltage(channel) + .1*self._random.normal())
+
+	def I_mon(self, channel:int)->float:
+		return self._query('I_mon', lambda: self._current(channel))
+
+	def is_ramping(self, channel:int)->bool:
+		return self._query('is_ramping', lambda: self._voltage(channel) != self._target_voltage(channel))
+
+	def set_VSET(self, channel:int, volts:float):
+		def f():
+			self._start_ramp(channel)
+			self._channels[channel]['VSET'] = float(volts)
+		self._query('set_VSET', f)
+
+	def set_output(self, channel:int, status:str):
+		def f():
+			self._start_ramp(channel)
+			self._channels[channel]['output'] = status
+		self._query('set_output', f)
+
+	def set_parameter(self, channel:int, parameter:str, value:float):
+		def f():
+			if parameter == 'VSET':
+				self._start_ramp(channel)
+			self._channels[channel][parameter] = value
+		self._query('set', f)
+
+	def get_parameter(self, channel:int, parameter:str):
+		return self._query('get', lambda: self._channels[channel][parameter])
+
+class SimulatedCAENChannel:
+	"""Mimics `CAENpy`'s `OneCAENChannel` for a `SimulatedCAEN`."""
+	def __init__(self, caen:SimulatedCAEN, channel_number:int):
+		self._caen = caen
+		self._channel_number = channel_number
+
+	@property
+	def V_mon(self)->float:
+		return self._caen.V_mon(self._channel_number)
+
+	@property
+	def I_mon(self)->float:
+		return self._caen.I_mon(self._channel_number)
+
+	@property
+	def V_set(self)->float:
+		return self._caen.get_parameter(self._channel_number, 'VSET')
+	@V_set.setter
+	def V_set(self, volts:float):
+		self._caen.set_VSET(self._channel_number, volts)
+
+	@property
+	def is_ramping(self)->bool:
+		return self._caen.is_ramping(self._channel_number)
+
+	@property
+	def output(self)->str:
+		return self._caen.get_parameter(self._channel_number, 'output')
+	@output.setter
+	def output(self, status:str):
+		self._caen.set_output(self._channel_number, status)
+
+	def set(self, PAR:str, VAL):
+		self._caen.set_parameter(self._channel_number, PAR, VAL)
+
+	def get(self, PAR:str):
+		return self._caen.get_parameter(self._channel_number, PAR)
+
+def build_simulated_setup(path_to_slots_configuration_file:Path=None, oscilloscope_kwargs:dict=None, caen_kwargs:dict=None, **kwargs)->TheRobocoldBetaSetup:
+	"""Creates a `TheRobocoldBetaSetup` with simulated instruments, so
+	it can be run (and profiled) in any computer.
+
+	Arguments
+	---------
+	path_to_slots_configuration_file: Path, optional
+		Slots configuration to use. If `None`, the one in `configuration_files`.
+		All the CAENs in it are simulated.
+	oscilloscope_kwargs: dict, optional
+		Arguments for `SimulatedOscilloscope`.
+	caen_kwargs: dict, optional
+		Arguments for `SimulatedCAEN`.
+	**kwargs:
+		Any other argument for `TheRobocoldBetaSetup`.
+	"""
+	if path_to_slots_configuration_file is None:
+		path_to_slots_configuration_file = Path(__file__).parent/'configuration_files/slots_configuration.csv'
+	slots_configuration = pandas.read_csv(path_to_slots_configuration_file, dtype={'caen_serial_number': str})
+	return TheRobocoldBetaSetup(
+		path_to_slots_configuration_file = path_to_slots_configuration_file,
+		oscilloscope = SimulatedOscilloscope(**(oscilloscope_kwargs or {})),
+		caens = {serial_number: SimulatedCAEN(serial_number=serial_number, **(caen_kwargs or {})) for serial_number in set(slots_configuration['caen_serial_number'])},
+		caen_channel_class = SimulatedCAENChannel,
+		**kwargs,
+	)
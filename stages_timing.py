@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+import time
+import pandas
+
+LIVE_TIME_STAGE = 'Trigger (s)' # While in this stage the oscilloscope is armed, i.e. "live".
+
+class StagesTimer:
+	"""Measures the time spent in each stage of e.g. one iteration of a
+	loop. It is just a call to `time.perf_counter` at the beginning and
+	end of each stage, so it can always be left on.
+
+	Example
+	-------
+	```
+	timer = StagesTimer()
+	with timer('Build spill (s)'):
+		spill = build_spill(...)
+	timer.add('Trigger (s)', seconds_measured_somewhere_else)
+	print(timer.seconds) # {'Build spill (s)': ..., 'Trigger (s)': ...}
+	```
+	"""
+	def __init__(self):
+		self.seconds = {}
+
+	@contextmanager
+	def __call__(self, stage:str):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(stage, time.perf_counter() - started)
+
+	def add(self, stage:str, seconds:float):
+		"""Adds `seconds` to the time spent in `stage`."""
+		self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+
+def summarize_stages_timing(stages_timing:pandas.DataFrame, elapsed_seconds:float)->str:
+	"""Returns a human readable summary of the time spent in each stage.
+
+	Arguments
+	---------
+	stages_timing: pandas.DataFrame
+		A data frame with one row per spill and one column per stage,
+		with the seconds spent in each stage.
+	elapsed_seconds: float
+		The duration of the whole run.
+	"""
+	live_seconds = stages_timing[LIVE_TIME_STAGE].sum() if LIVE_TIME_STAGE in stages_timing.columns else 0
+	summary = pandas.DataFrame(
+		{
+			'Total (s)': stages_timing.sum(),
+			'Mean per spill (s)': stages_timing.mean(),
+			'Max per spill (s)': stages_timing.max(),
+			'Fraction of the run': stages_timing.sum()/elapsed_seconds,
+		}
+	)
+	string = f'{len(stages_timing)} spills in {elapsed_seconds:.1f} s\n'
+	string += f'Live time: {live_seconds:.1f} s ({live_seconds/elapsed_seconds*100:.1f} %)\n'
+	string += f'Dead time: {elapsed_seconds-live_seconds:.1f} s ({(1-live_seconds/elapsed_seconds)*100:.1f} %)\n'
+	string += 'Stages (if the acquisition is pipelined, some of them overlap):\n'
+	string += summary.to_string()
+	return string
@@ -0,0 +1,82 @@
+import pytest
+import threading
+import time
+from CrossProcessLock import CrossProcessNamedLock
+
+def _wait_until(condition, timeout:float=5):
+	started = time.time()
+	while not condition():
+		if time.time() - started > timeout:
+			raise TimeoutError()
+		time.sleep(.001)
+
+def test_the_lock_is_given_in_the_order_in_which_it_was_asked_for():
+	lock = CrossProcessNamedLock('test')
+	lock.acquire('first')
+	order = []
+	def acquire_and_release(name):
+		lock.acquire(name)
+		order.append(name)
+		lock.release(name)
+	threads = []
+	for name in ['a','b','c','d']:
+		threads.append(threading.Thread(target=acquire_and_release, args=(name,)))
+		threads[-1].start()
+		_wait_until(lambda: lock.statistics()['n_waiting'] == len(threads)) # So each one asks for the lock after the previous one.
+	lock.release('first')
+	for thread in threads:
+		thread.join(timeout=5)
+	assert order == ['a','b','c','d']
+
+def test_the_owner_can_acquire_it_again():
+	lock = CrossProcessNamedLock('test')
+	assert lock.acquire('me', timeout=0)
+	assert lock.acquire('me', timeout=0)
+	lock.release('me')
+	assert lock.locked_by('me')
+	lock.release('me')
+	assert not lock.locked()
+
+def test_timeout():
+	lock = CrossProcessNamedLock('test')
+	lock.acquire('me')
+	started = time.time()
+	assert not lock.acquire('someone else', timeout=.1)
+	assert time.time() - started >= .1
+	assert lock.locked_by('me')
+	assert lock.statistics()['n_timeouts'] == 1
+	assert lock.statistics()['n_waiting'] == 0
+	with pytest.raises(TimeoutError):
+		with lock('someone else', timeout=.1):
+			pass
+
+def test_a_timeout_does_not_block_those_waiting_behind():
+	lock = CrossProcessNamedLock('test')
+	lock.acquire('me')
+	acquired = []
+	impatient = threading.Thread(target=lambda: acquired.append(('impatient', lock.acquire('impatient', timeout=.1))))
+	impatient.start()
+	_wait_until(lambda: lock.statistics()['n_waiting'] == 1)
+	patient = threading.Thread(target=lambda: acquired.append(('patient', lock.acquire('patient', timeout=5))))
+	patient.start()
+	impatient.join()
+	lock.release('me')
+	patient.join()
+	assert acquired == [('impatient',False), ('patient',True)]
+
+def test_only_the_owner_can_release_it():
+	lock = CrossProcessNamedLock('test')
+	with pytest.raises(RuntimeError):
+		lock.release('me') # Nobody has it.
+	lock.acquire('me')
+	with pytest.raises(RuntimeError):
+		lock.release('someone else')
+	assert lock.locked_by('me')
+
+def test_the_holder_releases_the_lock_when_destroyed():
+	lock = CrossProcessNamedLock('test')
+	holder = lock('me')
+	holder.acquire()
+	holder.acquire()
+	del holder # E.g. the process that was using it died.
+	assert not lock.locked()
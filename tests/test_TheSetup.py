@@ -0,0 +1,66 @@
+import pytest
+from simulated_hardware import build_simulated_setup
+from TheSetup import SetupCallsBatch
+
+@pytest.fixture
+def the_setup():
+	the_setup = build_simulated_setup(
+		oscilloscope_kwargs = dict(n_segments=2, n_samples=10, trigger_rate_hz=1e9, transfer_bytes_per_second=1e15),
+		caen_kwargs = dict(serial_latency_seconds=0),
+		bias_telemetry_polling_period_seconds = None,
+	)
+	yield the_setup
+	the_setup.close()
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_results_are_in_the_same_order_as_the_calls(the_setup, parallel):
+	slots_numbers = [3,1,2]
+	results = the_setup.call_batch([('measure_bias_all_slots', ([slot_number],), {}) for slot_number in slots_numbers], parallel=parallel)
+	assert [result['result']['slot_number'] for result in results] == [[slot_number] for slot_number in slots_numbers]
+	assert all(result['exception'] is None for result in results)
+
+	batch = SetupCallsBatch(the_setup, parallel=parallel)
+	futures = [batch.measure_bias_all_slots(slots_numbers=[slot_number]) for slot_number in slots_numbers]
+	assert [result['slot_number'] for result in batch.execute()] == [[slot_number] for slot_number in slots_numbers]
+	assert [future.result()['slot_number'] for future in futures] == [[slot_number] for slot_number in slots_numbers]
+	assert len(batch.elapsed_seconds) == len(slots_numbers)
+
+def test_a_call_that_fails_in_the_middle(the_setup):
+	batch = SetupCallsBatch(the_setup)
+	before = batch.get_slots_configuration_version()
+	failing = batch.get_waveform(99) # There is no such channel, and no trigger yet.
+	after = batch.get_slots_configuration_version()
+	with pytest.raises(RuntimeError, match='There was no trigger yet'):
+		batch.execute() # Raises the exception of the call that failed.
+	assert before.result() == 0
+	with pytest.raises(RuntimeError, match='There was no trigger yet'):
+		failing.result()
+	with pytest.raises(RuntimeError, match='was not executed because a previous call in the batch failed'):
+		after.result()
+	assert len(batch.elapsed_seconds) == 3
+	assert batch.elapsed_seconds[2] == 0
+
+def test_a_batch_can_only_be_sent_once(the_setup):
+	batch = SetupCallsBatch(the_setup)
+	batch.get_slots_configuration_version()
+	batch.execute()
+	with pytest.raises(RuntimeError):
+		batch.get_slots_configuration_version()
+
+@pytest.mark.parametrize('method_name', ['_read_slots_configuration_file','hold_signal_acquisition','hold_control_of_bias_for_slot_number','call_batch','not_a_method'])
+def test_methods_that_cannot_be_called_in_a_batch(the_setup, method_name):
+	with pytest.raises(ValueError):
+		the_setup.call_batch([('get_slots_configuration_version', (), {}), (method_name, (), {})])
+	if method_name.startswith('_'):
+		return # See `test_private_methods_are_not_even_added_to_the_batch`.
+	batch = SetupCallsBatch(the_setup)
+	valid = batch.get_slots_configuration_version()
+	getattr(batch, method_name)()
+	with pytest.raises(ValueError):
+		batch.execute()
+	with pytest.raises(ValueError): # Nothing was executed.
+		valid.result()
+
+def test_private_methods_are_not_even_added_to_the_batch(the_setup):
+	with pytest.raises(AttributeError):
+		SetupCallsBatch(the_setup)._read_slots_configuration_file
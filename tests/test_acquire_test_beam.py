@@ -0,0 +1,53 @@
+import pytest
+import numpy
+
+pytest.importorskip('the_bureaucrat')
+pytest.importorskip('huge_dataframe')
+pytest.importorskip('signals')
+pytest.importorskip('progressreporting')
+pytest.importorskip('my_telegram_bots')
+
+from benchmark_acquisition import simulated_setup, SLOTS_NUMBERS
+from acquire_test_beam import iterate_spills, build_spill
+from simulated_hardware import SimulatedOscilloscope
+
+N_SEGMENTS = 7
+
+@pytest.mark.parametrize('use_shared_memory', [False, True])
+def test_iterate_spills_counts_the_segments_of_each_spill(use_shared_memory):
+	with simulated_setup(through_server=False, oscilloscope_kwargs=dict(n_segments=N_SEGMENTS, n_samples=100, trigger_rate_hz=1e6, transfer_bytes_per_second=1e12)) as (the_setup, _):
+		spills = iterate_spills(
+			the_setup = the_setup,
+			name_to_access_to_the_setup = 'test_iterate_spills',
+			n_triggers = 30,
+			slots_numbers = SLOTS_NUMBERS,
+			slots_configuration = the_setup.get_slots_configuration_snapshot(),
+			use_shared_memory = use_shared_memory,
+		)
+		first_n_triggers = [first_n_trigger for first_n_trigger,_,_,_ in spills]
+	assert first_n_triggers == [0,7,14,21,28]
+
+def test_build_spill():
+	oscilloscope = SimulatedOscilloscope(n_segments=N_SEGMENTS, n_samples=100, trigger_rate_hz=1e9, transfer_bytes_per_second=1e15, seed=0)
+	oscilloscope.wait_for_single_trigger()
+	slots_numbers = [4,1,3] # Not sorted.
+	segments = {slot_number: oscilloscope.get_waveform(channel=slot_number) for slot_number in slots_numbers}
+	spill = build_spill(segments, first_n_trigger=10)
+
+	n_waveforms = N_SEGMENTS*len(slots_numbers)
+	assert spill['n_trigger'].shape == spill['slot_number'].shape == (n_waveforms,)
+	assert spill['Time (s)'].shape == spill['Amplitude (V)'].shape == (n_waveforms, oscilloscope.n_samples)
+	assert spill['Amplitude (V)'].dtype == numpy.float64
+	index = list(zip(spill['n_trigger'].tolist(), spill['slot_number'].tolist()))
+	assert index == [(n_trigger,slot_number) for n_trigger in range(10,10+N_SEGMENTS) for slot_number in sorted(slots_numbers)] # Sorted by `INDEX_COLUMNS`.
+	for row,(n_trigger,slot_number) in enumerate(index):
+		for variable in ['Time (s)','Amplitude (V)']:
+			assert numpy.array_equal(spill[variable][row], segments[slot_number][n_trigger-10][variable])
+
+	as_2D_arrays = {slot_number: {variable: numpy.array([segment[variable] for segment in segments[slot_number]]) for variable in ['Time (s)','Amplitude (V)']} for slot_number in slots_numbers} # As from shared memory.
+	for key,values in build_spill(as_2D_arrays, first_n_trigger=10).items():
+		assert numpy.array_equal(values, spill[key])
+
+	segments[1] = segments[1][:-1]
+	with pytest.raises(RuntimeError):
+		build_spill(segments, first_n_trigger=0)
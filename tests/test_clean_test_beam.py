@@ -0,0 +1,118 @@
+import pytest
+import numpy
+import pandas
+
+pytest.importorskip('the_bureaucrat')
+pytest.importorskip('plotly')
+pytest.importorskip('dominate')
+pytest.importorskip('plot_beta_scan')
+pytest.importorskip('pyarrow')
+
+from clean_test_beam import apply_cuts, scan_cuts
+
+SIGNALS_NAMES = ['DUT','reference_trigger']
+
+def _apply_cuts_one_cut_at_a_time(data_df:pandas.DataFrame, cuts_df:pandas.DataFrame)->pandas.DataFrame:
+	"""How `apply_cuts` used to do it, pivoting `data_df` and then applying
+	each cut after the other."""
+	data_df = data_df.reset_index(drop=False).pivot(
+		index = 'n_trigger',
+		columns = 'signal_name',
+		values = list(set(data_df.columns) - {'signal_name'}),
+	)
+	triggers_accepted_df = pandas.DataFrame({'is_background': True}, index=data_df.index)
+	for idx, cut_row in cuts_df.iterrows():
+		if cut_row['cut_type'] == 'lower':
+			triggers_accepted_df['is_background'] &= data_df[(cut_row['variable'],cut_row['signal_name'])] > cut_row['cut_value']
+		elif cut_row['cut_type'] == 'higher':
+			triggers_accepted_df['is_background'] &= data_df[(cut_row['variable'],cut_row['signal_name'])] < cut_row['cut_value']
+	triggers_accepted_df['is_background'] = ~triggers_accepted_df['is_background']
+	return triggers_accepted_df
+
+def _random_data(n_triggers:int, seed:int=0)->pandas.DataFrame:
+	"""Parsed data as `load_parsed_from_waveforms` gives it, with some NaN
+	values and some waveforms missing."""
+	random = numpy.random.default_rng(seed)
+	data_df = pandas.DataFrame(
+		{
+			'n_trigger': numpy.repeat(numpy.arange(n_triggers), len(SIGNALS_NAMES)),
+			'slot_number': numpy.tile(numpy.arange(len(SIGNALS_NAMES)), n_triggers),
+			'signal_name': numpy.tile(SIGNALS_NAMES, n_triggers),
+			'Amplitude (V)': random.uniform(0, .3, size=n_triggers*len(SIGNALS_NAMES)),
+			'SNR': random.uniform(0, 100, size=n_triggers*len(SIGNALS_NAMES)),
+		}
+	)
+	data_df.loc[random.random(len(data_df)) < .05, 'Amplitude (V)'] = float('NaN')
+	data_df = data_df.loc[random.random(len(data_df)) > .02] # Missing waveforms.
+	return data_df.set_index(['n_trigger','slot_number'])
+
+def _random_cuts(seed:int=0)->pandas.DataFrame:
+	random = numpy.random.default_rng(seed)
+	return pandas.DataFrame(
+		{
+			'signal_name': ['DUT','DUT','reference_trigger','reference_trigger'],
+			'variable': ['Amplitude (V)','Amplitude (V)','SNR','Amplitude (V)'],
+			'cut_type': ['lower','higher','lower','higher'],
+			'cut_value': [random.uniform(0,.1), random.uniform(.2,.3), random.uniform(0,50), random.uniform(.2,.3)],
+		}
+	)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_apply_cuts_is_the_same_as_one_cut_at_a_time(seed):
+	data_df = _random_data(n_triggers=555, seed=seed)
+	cuts_df = _random_cuts(seed=seed)
+	result = apply_cuts(data_df, cuts_df)
+	expected = _apply_cuts_one_cut_at_a_time(data_df, cuts_df)
+	assert result.index.equals(expected.index)
+	assert numpy.array_equal(result['is_background'].to_numpy(), expected['is_background'].to_numpy())
+	assert 0 < result['is_background'].sum() < len(result) # So the test means something.
+
+def test_apply_cuts_without_cuts():
+	data_df = _random_data(n_triggers=55)
+	cuts_df = _random_cuts().iloc[:0]
+	result = apply_cuts(data_df, cuts_df)
+	expected = _apply_cuts_one_cut_at_a_time(data_df, cuts_df)
+	assert result.index.equals(expected.index)
+	assert not result['is_background'].any()
+	assert not expected['is_background'].any()
+
+@pytest.mark.parametrize('seed', range(3))
+def test_scan_cuts_is_the_same_as_applying_each_candidate(seed):
+	random = numpy.random.default_rng(seed)
+	data_df = _random_data(n_triggers=333, seed=seed)
+	cuts_df = _random_cuts(seed=seed)
+	candidate_cuts_df = pandas.concat(
+		[
+			pandas.DataFrame( # Replaces one of the cuts in `cuts_df`.
+				{
+					'signal_name': 'DUT',
+					'variable': 'Amplitude (V)',
+					'cut_type': 'lower',
+					'cut_value': numpy.append(random.uniform(0, .3, size=11), data_df.query('signal_name=="DUT"')['Amplitude (V)'].iloc[:3]), # Also values that are in the data, to check the `>` is strict.
+				}
+			),
+			pandas.DataFrame( # Not in `cuts_df`.
+				{
+					'signal_name': 'DUT',
+					'variable': 'SNR',
+					'cut_type': 'higher',
+					'cut_value': random.uniform(0, 100, size=11),
+				}
+			),
+		]
+	)
+	cut_flow_df, scan_df = scan_cuts(data_df, cuts_df, candidate_cuts_df)
+	
+	n_triggers = len(set(data_df.index.get_level_values('n_trigger')))
+	for k in range(len(cuts_df)):
+		assert cut_flow_df.loc[k,'n_triggers surviving'] == (~apply_cuts(data_df, cuts_df.iloc[:k+1])['is_background']).sum()
+	
+	CUT_COLUMNS = ['signal_name','variable','cut_type']
+	assert len(scan_df) == len(candidate_cuts_df)
+	for _,candidate in scan_df.iterrows():
+		is_the_same_cut = (cuts_df[CUT_COLUMNS]==candidate[CUT_COLUMNS]).all(axis=1)
+		cuts_with_the_candidate = pandas.concat([cuts_df.loc[~is_the_same_cut], candidate[CUT_COLUMNS+['cut_value']].to_frame().T])
+		n_accepted = (~apply_cuts(data_df, cuts_with_the_candidate)['is_background']).sum()
+		assert candidate['n_triggers accepted'] == n_accepted
+		assert candidate['n_triggers rejected'] == n_triggers - n_accepted
+		assert candidate['Efficiency'] == pytest.approx(n_accepted/n_triggers)
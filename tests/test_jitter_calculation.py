@@ -0,0 +1,50 @@
+import pytest
+import numpy
+
+pytest.importorskip('the_bureaucrat')
+pytest.importorskip('grafica')
+pytest.importorskip('scipy')
+pytest.importorskip('uncertainties')
+pytest.importorskip('pyarrow')
+
+import jitter_calculation
+from jitter_calculation import _jitter_for_each_pair_of_columns, _jitter_searching_the_optimum_coarse_to_fine
+
+def _times(percentages:numpy.ndarray, best_percentage_1:float, best_percentage_2:float, n_triggers:int=2222)->tuple:
+	"""Times at each CFD threshold of two signals, whose jitter is minimum
+	at `best_percentage_1` and `best_percentage_2`."""
+	random = numpy.random.default_rng(0)
+	common = random.normal(size=(n_triggers,1))*1e-10
+	t1 = common + percentages*1e-12 + random.normal(size=(n_triggers,1))*30e-12*(1+((percentages-best_percentage_1)/30)**2)
+	t2 = common + percentages*1e-12 + random.normal(size=(n_triggers,1))*20e-12*(1+((percentages-best_percentage_2)/30)**2)
+	return t1, t2
+
+def test_coarse_to_fine_finds_the_same_optimum_with_less_fits(monkeypatch):
+	percentages = numpy.arange(5,96,3)
+	t1, t2 = _times(percentages, best_percentage_1=41, best_percentage_2=62)
+	pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages))]
+	
+	all_jitters = _jitter_for_each_pair_of_columns(t1, t2, pairs)
+	n_fits = []
+	sigma_from_gaussian_fit = jitter_calculation.sigma_from_gaussian_fit
+	monkeypatch.setattr(jitter_calculation, 'sigma_from_gaussian_fit', lambda x: n_fits.append(1) or sigma_from_gaussian_fit(x))
+	jitters, optimum_pair = _jitter_searching_the_optimum_coarse_to_fine(t1, t2, pairs)
+	
+	assert optimum_pair == min(all_jitters['sigma_from_gaussian_fit'], key=all_jitters['sigma_from_gaussian_fit'].get)
+	assert len(n_fits) < len(pairs)/3
+	assert jitters['kMAD'] == all_jitters['kMAD'] and jitters['std'] == all_jitters['std']
+	assert all(all_jitters['sigma_from_gaussian_fit'][pair] == sigma for pair,sigma in jitters['sigma_from_gaussian_fit'].items())
+
+def test_coarse_to_fine_fits_every_pair_of_a_coarse_grid():
+	percentages = numpy.arange(10,91,10)
+	t1, t2 = _times(percentages, best_percentage_1=40, best_percentage_2=60)
+	pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages))]
+	jitters, optimum_pair = _jitter_searching_the_optimum_coarse_to_fine(t1, t2, pairs)
+	assert jitters == _jitter_for_each_pair_of_columns(t1, t2, pairs)
+
+def test_coarse_to_fine_fits_the_pairs_that_are_asked_for():
+	percentages = numpy.arange(5,96,3)
+	t1, t2 = _times(percentages, best_percentage_1=41, best_percentage_2=62)
+	pairs = [(i,j) for i in range(len(percentages)) for j in range(len(percentages))]
+	jitters, _ = _jitter_searching_the_optimum_coarse_to_fine(t1, t2, pairs, pairs_to_fit=[(1,2)])
+	assert (1,2) in jitters['sigma_from_gaussian_fit']
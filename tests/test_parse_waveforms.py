@@ -0,0 +1,71 @@
+import pytest
+import numpy
+
+pytest.importorskip('the_bureaucrat')
+pytest.importorskip('huge_dataframe')
+pytest.importorskip('signals')
+pytest.importorskip('plotly')
+
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
+from parse_waveforms import parse_waveforms
+from waveforms_store import WaveformsDumper, WAVEFORMS_STORE_DIRECTORY_NAME
+from CFD_times_store import read_CFD_times, CFD_TIMES_DIRECTORY_NAME
+
+N_TRIGGERS = 33
+SLOTS_NUMBERS = [1,2]
+N_SAMPLES = 444
+SAMPLING_PERIOD_SECONDS = 50e-12
+
+def _small_run(path):
+	"""Creates a run with a `test_beam` task with a few LGAD like pulses
+	in a waveforms store, as `acquire_test_beam.test_beam` produces."""
+	random = numpy.random.default_rng(0)
+	n_waveforms = N_TRIGGERS*len(SLOTS_NUMBERS)
+	time = numpy.tile(numpy.arange(N_SAMPLES)*SAMPLING_PERIOD_SECONDS, (n_waveforms,1))
+	x = (time - random.uniform(8e-9, 12e-9, size=(n_waveforms,1)))/500e-12
+	amplitude = random.normal(scale=2e-3, size=time.shape) + random.uniform(.05, .2, size=(n_waveforms,1))*numpy.where(x>0, x*numpy.exp(1-x), 0)
+	bureaucrat = RunBureaucrat(path)
+	bureaucrat.create_run()
+	with bureaucrat.handle_task('test_beam') as employee:
+		with WaveformsDumper(employee.path_to_directory_of_my_task/WAVEFORMS_STORE_DIRECTORY_NAME) as waveforms_dumper:
+			waveforms_dumper.append(
+				{
+					'n_trigger': numpy.repeat(numpy.arange(N_TRIGGERS), len(SLOTS_NUMBERS)),
+					'slot_number': numpy.tile(SLOTS_NUMBERS, N_TRIGGERS),
+					'Time (s)': time,
+					'Amplitude (V)': amplitude,
+				}
+			)
+	return bureaucrat
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_parse_waveforms_parses_every_waveform_of_the_store(tmp_path, vectorized):
+	bureaucrat = _small_run(tmp_path/'run')
+	parse_waveforms(
+		bureaucrat = bureaucrat,
+		name_of_task_that_produced_the_waveforms_to_parse = 'test_beam',
+		chunk_size = 10, # So there are several chunks.
+		vectorized = vectorized,
+	)
+	assert bureaucrat.was_task_run_successfully('parse_waveforms')
+	parsed = load_whole_dataframe(bureaucrat.path_to_directory_of_task('parse_waveforms')/'parsed_from_waveforms.sqlite')
+	assert len(parsed) == N_TRIGGERS*len(SLOTS_NUMBERS)
+	assert not parsed.index.duplicated().any()
+	assert parsed['Amplitude (V)'].gt(.04).all()
+
+def test_parse_waveforms_stores_CFD_times(tmp_path):
+	bureaucrat = _small_run(tmp_path/'run')
+	CFD_percentages = numpy.arange(5,96)
+	parse_waveforms(
+		bureaucrat = bureaucrat,
+		name_of_task_that_produced_the_waveforms_to_parse = 'test_beam',
+		chunk_size = 10,
+		vectorized = True,
+		CFD_percentages = CFD_percentages,
+	)
+	CFD_times = read_CFD_times(bureaucrat.path_to_directory_of_task('parse_waveforms')/CFD_TIMES_DIRECTORY_NAME)
+	assert numpy.array_equal(CFD_times['percentages'], CFD_percentages)
+	assert CFD_times['t (s)'].shape == (N_TRIGGERS*len(SLOTS_NUMBERS), len(CFD_percentages))
+	assert set(zip(CFD_times['n_trigger'].tolist(), CFD_times['slot_number'].tolist())) == {(n_trigger,slot_number) for n_trigger in range(N_TRIGGERS) for slot_number in SLOTS_NUMBERS}
+	assert numpy.all(numpy.diff(CFD_times['t (s)'], axis=1) >= 0) # Higher thresholds are crossed later on the rising edge.
@@ -0,0 +1,20 @@
+import pytest
+import numpy
+import pandas
+
+pytest.importorskip('plotly')
+
+from scatter_matrix_plot import scatter_matrix
+
+def _random_df(n_rows:int)->pandas.DataFrame:
+	random = numpy.random.default_rng(0)
+	return pandas.DataFrame({'x': random.normal(size=n_rows), 'y': random.normal(size=n_rows), 'z': random.normal(size=n_rows)})
+
+def test_density_with_less_than_two_dimensions():
+	with pytest.raises(ValueError, match='at least 2'):
+		scatter_matrix(_random_df(111), dimensions=['x'], max_points=11, large_data='density')
+
+def test_density_does_not_depend_on_the_number_of_points():
+	figures = [scatter_matrix(_random_df(n_rows), dimensions=['x','y','z'], max_points=11, large_data='density') for n_rows in [111,1111]]
+	assert [len(fig.data) for fig in figures] == [3,3] # One per pair of dimensions.
+	assert all(trace.z.shape == (44,44) for fig in figures for trace in fig.data)
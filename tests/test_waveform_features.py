@@ -0,0 +1,87 @@
+import pytest
+import numpy
+from waveform_features import analyze_peaks, compute_features, compute_CFD_times, THRESHOLDS_PERCENTAGES
+
+N_SAMPLES = 200
+BASELINE = .1
+NOISE = .01
+AMPLITUDE = 1
+RISE_START = 100 # Sample at which the pulse starts.
+RISE_SAMPLES = 10 # Number of samples from the start of the pulse to its peak.
+FALL_SAMPLES = 20 # Number of samples from the peak to the end of the pulse.
+
+def _triangular_pulse(n_samples:int=N_SAMPLES, rise_start:int=RISE_START)->numpy.ndarray:
+	"""A triangular pulse on top of a baseline whose noise alternates between
+	`+NOISE` and `-NOISE`, so its mean and standard deviation are known."""
+	samples = BASELINE + NOISE*(-1)**numpy.arange(n_samples)
+	k = numpy.arange(n_samples)
+	rising = (k >= rise_start) & (k <= rise_start+RISE_SAMPLES)
+	falling = (k > rise_start+RISE_SAMPLES) & (k <= rise_start+RISE_SAMPLES+FALL_SAMPLES)
+	samples[rising] = BASELINE + AMPLITUDE*(k[rising]-rise_start)/RISE_SAMPLES
+	samples[falling] = BASELINE + AMPLITUDE*(1-(k[falling]-rise_start-RISE_SAMPLES)/FALL_SAMPLES)
+	return samples
+
+def test_amplitude_noise_and_rise_time():
+	time = numpy.arange(N_SAMPLES)*1e-9
+	features = compute_features(time, _triangular_pulse()[numpy.newaxis,:]).iloc[0]
+	assert features['Amplitude (V)'] == pytest.approx(AMPLITUDE, rel=1e-2)
+	assert features['Noise (V)'] == pytest.approx(NOISE, rel=1e-2)
+	assert features['SNR'] == pytest.approx(AMPLITUDE/NOISE, rel=2e-2)
+	assert features['Rise time (s)'] == pytest.approx(.8*RISE_SAMPLES*1e-9, rel=1e-2)
+	assert features['t_50 (s)'] == pytest.approx((RISE_START+RISE_SAMPLES/2)*1e-9, rel=1e-3)
+	assert features['Time over 50% (s)'] == pytest.approx((RISE_SAMPLES+FALL_SAMPLES)/2*1e-9, rel=1e-2)
+
+def test_time_can_be_given_for_each_waveform():
+	samples = numpy.array([_triangular_pulse(), _triangular_pulse(rise_start=50)])
+	time = numpy.arange(N_SAMPLES)*1e-9
+	shared_time = compute_features(time, samples)
+	own_time = compute_features(numpy.array([time, time+1e-6]), samples)
+	assert own_time['Amplitude (V)'].to_numpy() == pytest.approx(shared_time['Amplitude (V)'].to_numpy())
+	assert own_time['t_50 (s)'].to_numpy() == pytest.approx(shared_time['t_50 (s)'].to_numpy() + numpy.array([0,1e-6]))
+
+def test_no_crossing_after_the_peak():
+	samples = _triangular_pulse(n_samples=RISE_START+RISE_SAMPLES+1) # Ends at the peak.
+	features = compute_features(numpy.arange(len(samples)), samples[numpy.newaxis,:]).iloc[0]
+	assert numpy.isfinite(features['t_50 (s)'])
+	assert numpy.isnan(features['Time over 50% (s)'])
+	assert numpy.isnan(features['Collected charge (V s)'])
+
+def test_crossing_between_the_last_two_samples():
+	samples = _triangular_pulse(n_samples=RISE_START+RISE_SAMPLES+FALL_SAMPLES//2+2) # The last sample is the first one below 50 % after the peak.
+	features = compute_features(numpy.arange(len(samples)), samples[numpy.newaxis,:]).iloc[0]
+	assert features['Time over 50% (s)'] == pytest.approx((RISE_SAMPLES+FALL_SAMPLES)/2, rel=1e-2)
+
+def test_peak_on_the_first_sample():
+	samples = numpy.array([_triangular_pulse(rise_start=-RISE_SAMPLES)]) # Starts at the peak, so there is nothing before it.
+	features = compute_features(numpy.arange(N_SAMPLES), samples).iloc[0]
+	assert numpy.isnan(features['Amplitude (V)'])
+	assert all(numpy.isnan(features[f't_{p} (s)']) for p in THRESHOLDS_PERCENTAGES)
+
+def test_all_NaN_waveform_does_not_affect_the_others():
+	samples = numpy.array([numpy.full(N_SAMPLES, float('NaN')), _triangular_pulse()])
+	time = numpy.arange(N_SAMPLES)*1e-9
+	features = compute_features(time, samples)
+	assert features.iloc[0].drop('SNR').isna().all()
+	assert features.iloc[1].to_numpy() == pytest.approx(compute_features(time, samples[1:]).iloc[0].to_numpy(), nan_ok=True)
+
+def test_CFD_times_are_the_same_as_the_features():
+	samples = numpy.array([_triangular_pulse(), _triangular_pulse(rise_start=50)])
+	time = numpy.arange(N_SAMPLES)*1e-9
+	peaks = analyze_peaks(time, samples)
+	features = compute_features(time, samples, peaks=peaks)
+	CFD_times = compute_CFD_times(time, samples, percentages=THRESHOLDS_PERCENTAGES, peaks=peaks)
+	assert CFD_times['t (s)'] == pytest.approx(features[[f't_{p} (s)' for p in THRESHOLDS_PERCENTAGES]].to_numpy())
+	assert CFD_times['Time over threshold (s)'] == pytest.approx(features[[f'Time over {p}% (s)' for p in THRESHOLDS_PERCENTAGES]].to_numpy())
+
+def test_agrees_with_PeakSignal():
+	pytest.importorskip('signals')
+	from waveform_features import compare_with_parse_waveform
+
+	random = numpy.random.default_rng(0)
+	n_waveforms = 55
+	time = numpy.arange(444)*50e-12
+	x = (time[numpy.newaxis,:] - random.uniform(8e-9, 12e-9, size=(n_waveforms,1)))/500e-12
+	samples = random.normal(scale=2e-3, size=x.shape) + random.uniform(.05, .2, size=(n_waveforms,1))*numpy.where(x>0, x*numpy.exp(1-x), 0)
+	comparison = compare_with_parse_waveform(time, samples, relative_tolerance=1e-2)
+	features_with_the_same_definition = ['Amplitude (V)','Noise (V)','SNR','Rise time (s)','Peak start time (s)'] + [f't_{p} (s)' for p in THRESHOLDS_PERCENTAGES] + [f'Time over {p}% (s)' for p in THRESHOLDS_PERCENTAGES]
+	assert (comparison.loc[features_with_the_same_definition, 'Fraction that agrees'] >= .95).all(), comparison
@@ -0,0 +1,100 @@
+import numpy
+from waveforms_store import WaveformsDumper, WaveformsReader, INDEX_COLUMNS
+
+def _spill(first_n_trigger:int, n_triggers:int, slots_numbers:list, n_samples:int=50, seed:int=0)->dict:
+	random = numpy.random.default_rng(seed)
+	n_waveforms = n_triggers*len(slots_numbers)
+	return {
+		'n_trigger': numpy.repeat(numpy.arange(first_n_trigger, first_n_trigger+n_triggers), len(slots_numbers)),
+		'slot_number': numpy.tile(slots_numbers, n_triggers),
+		'Time (s)': random.normal(size=(n_waveforms,n_samples)),
+		'Amplitude (V)': random.normal(size=(n_waveforms,n_samples)),
+	}
+
+def test_round_trip(tmp_path):
+	spills = [_spill(0, 5, [1,2], seed=0), _spill(5, 3, [1,2], seed=1)]
+	with WaveformsDumper(tmp_path/'waveforms', dump_after_n_waveforms=1) as dumper: # One chunk per spill.
+		for spill in spills:
+			dumper.append(spill)
+	reader = WaveformsReader(tmp_path/'waveforms')
+
+	assert list(reader.index) == [(n_trigger,slot_number) for spill in spills for n_trigger,slot_number in zip(spill['n_trigger'], spill['slot_number'])]
+	assert list(reader.manifest.columns) == ['n_chunk','n_row']
+	assert sorted(set(reader.manifest['n_chunk'])) == [0,1]
+	assert list(reader.read_manifest(after_rowid=10).index) == list(reader.index[10:])
+
+	waveform = reader.read_waveform(n_trigger=6, slot_number=2)
+	row = numpy.flatnonzero((spills[1]['n_trigger']==6) & (spills[1]['slot_number']==2))[0]
+	for variable in ['Time (s)','Amplitude (V)']:
+		assert numpy.array_equal(waveform[variable], spills[1][variable][row]) # The random data is not quantized, so it is stored as is.
+
+	batches = list(reader.iterate_batches())
+	for variable in INDEX_COLUMNS+['Time (s)','Amplitude (V)']:
+		assert numpy.array_equal(numpy.concatenate([batch[variable] for batch in batches]), numpy.concatenate([spill[variable] for spill in spills]))
+
+def test_append_to_an_existing_store(tmp_path):
+	with WaveformsDumper(tmp_path/'waveforms') as dumper:
+		dumper.append(_spill(0, 2, [1]))
+	with WaveformsDumper(tmp_path/'waveforms', delete_if_already_exists=False) as dumper:
+		dumper.append(_spill(2, 2, [1]))
+	assert list(WaveformsReader(tmp_path/'waveforms').index) == [(n_trigger,1) for n_trigger in range(4)]
+
+def test_delete_if_already_exists(tmp_path):
+	with WaveformsDumper(tmp_path/'waveforms') as dumper:
+		dumper.append(_spill(0, 2, [1]))
+	(tmp_path/'waveforms'/'some_directory').mkdir()
+	with WaveformsDumper(tmp_path/'waveforms', delete_if_already_exists=True) as dumper:
+		dumper.append(_spill(7, 1, [1]))
+	assert list(WaveformsReader(tmp_path/'waveforms').index) == [(7,1)]
+	assert not (tmp_path/'waveforms'/'some_directory').exists()
+
+def _spill_from_the_simulated_oscilloscope(vdivs:dict)->dict:
+	"""A spill as digitized by `SimulatedOscilloscope`, whose 8 bits ADC
+	step is `8*vdiv/2**8` for each slot, with slot number = channel."""
+	from simulated_hardware import SimulatedOscilloscope
+	oscilloscope = SimulatedOscilloscope(n_segments=22, n_samples=333, trigger_rate_hz=1e9, transfer_bytes_per_second=1e15, seed=0)
+	for channel,vdiv in vdivs.items():
+		oscilloscope.set_vdiv(channel, vdiv)
+	oscilloscope.wait_for_single_trigger()
+	segments = {channel: oscilloscope.get_waveform(channel) for channel in vdivs}
+	return {
+		'n_trigger': numpy.repeat(numpy.arange(oscilloscope.n_segments), len(vdivs)),
+		'slot_number': numpy.tile(sorted(vdivs), oscilloscope.n_segments),
+		'Time (s)': numpy.array([segments[channel][n_segment]['Time (s)'] for n_segment in range(oscilloscope.n_segments) for channel in sorted(vdivs)]),
+		'Amplitude (V)': numpy.array([segments[channel][n_segment]['Amplitude (V)'] for n_segment in range(oscilloscope.n_segments) for channel in sorted(vdivs)]),
+	}
+
+def _read_everything(path_to_directory)->dict:
+	batches = list(WaveformsReader(path_to_directory).iterate_batches())
+	return {variable: numpy.concatenate([batch[variable] for batch in batches]) for variable in batches[0]}
+
+def test_compact_store_reproduces_the_samples_of_the_oscilloscope(tmp_path):
+	vdivs = {1: .05, 2: .1, 3: .02, 4: .5}
+	spill = _spill_from_the_simulated_oscilloscope(vdivs)
+	with WaveformsDumper(tmp_path/'waveforms', compact=True) as dumper:
+		dumper.append(spill)
+	with numpy.load(tmp_path/'waveforms'/'chunk_000000.npz') as npz:
+		assert npz['amplitude_codes'].dtype == numpy.uint8 # 8 bits, as the digitizer.
+		assert 'time_dt' in npz
+
+	read = _read_everything(tmp_path/'waveforms')
+	ADC_step = numpy.array([8*vdivs[slot_number]/2**8 for slot_number in spill['slot_number']])[:,numpy.newaxis]
+	assert numpy.array_equal(numpy.round(read['Amplitude (V)']/ADC_step), numpy.round(spill['Amplitude (V)']/ADC_step)) # Same ADC code for every sample...
+	assert numpy.abs(read['Amplitude (V)'] - spill['Amplitude (V)']).max() <= 1e-9*ADC_step.min() # ...and the same value, up to floating point rounding.
+	sampling_period = spill['Time (s)'][0,1] - spill['Time (s)'][0,0]
+	assert numpy.abs(read['Time (s)'] - spill['Time (s)']).max() <= 1e-6*sampling_period
+
+def test_compact_store_falls_back_to_floats_for_data_that_is_not_quantized(tmp_path):
+	spill = _spill_from_the_simulated_oscilloscope({1: .05, 2: .1})
+	random = numpy.random.default_rng(0)
+	spill['Amplitude (V)'] = spill['Amplitude (V)'] + random.normal(scale=1e-5, size=spill['Amplitude (V)'].shape) # E.g. the oscilloscope was averaging.
+	spill['Time (s)'] = spill['Time (s)'] + random.normal(scale=1e-13, size=spill['Time (s)'].shape) # Not uniformly sampled.
+	with WaveformsDumper(tmp_path/'waveforms', compact=True) as dumper:
+		dumper.append(spill)
+	with numpy.load(tmp_path/'waveforms'/'chunk_000000.npz') as npz:
+		assert 'amplitude' in npz and 'amplitude_codes' not in npz
+		assert 'time' in npz and 'time_dt' not in npz
+
+	read = _read_everything(tmp_path/'waveforms')
+	assert numpy.array_equal(read['Amplitude (V)'], spill['Amplitude (V)'])
+	assert numpy.array_equal(read['Time (s)'], spill['Time (s)'])
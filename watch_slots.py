@@ -3,11 +3,16 @@ import time
 import argparse
 
 s = connect_me_with_the_setup()
+slots_configuration = s.get_slots_configuration_snapshot()
 while True:
 	time.sleep(1)
-	bias_voltages = [s.measure_bias_voltage(slot_number) for slot_number in s.get_slots_configuration_df().index]
-	bias_currents = [s.measure_bias_current(slot_number) for slot_number in s.get_slots_configuration_df().index]
-	devices_namces = [s.get_name_of_device_in_slot_number(slot_number) for slot_number in s.get_slots_configuration_df().index]
+	if s.get_slots_configuration_version() != slots_configuration.version:
+		slots_configuration = s.get_slots_configuration_snapshot()
+	slots_numbers = slots_configuration.slots_numbers
+	measured_bias = s.get_latest_bias_telemetry(slots_numbers, max_age_seconds=2)
+	bias_voltages = measured_bias['Bias voltage (V)']
+	bias_currents = measured_bias['Bias current (A)']
+	devices_namces = [slots_configuration.device_name(slot_number) for slot_number in slots_numbers]
 	print('\n---')
-	for sn,V,I,device_name in zip(s.get_slots_configuration_df().index, bias_voltages, bias_currents, devices_namces):
+	for sn,V,I,device_name in zip(slots_numbers, bias_voltages, bias_currents, devices_namces):
 		print(f'\n{sn}: {repr(device_name)} {V:.2f} V | {I*1e6:.2f} µA', end='')
@@ -0,0 +1,266 @@
+import numpy
+import pandas
+
+THRESHOLDS_PERCENTAGES = [10,20,30,40,50,60,70,80,90]
+k_MAD_TO_STD = 1.4826 # Converts the median absolute deviation into the standard deviation, for Gaussian noise.
+
+def _first_true_index(mask:numpy.ndarray)->numpy.ndarray:
+	"""For each row of `mask`, the index of the first `True`, or -1 if
+	there is none."""
+	return numpy.where(mask.any(axis=1), numpy.argmax(mask, axis=1), -1)
+
+def _last_true_index(mask:numpy.ndarray)->numpy.ndarray:
+	"""For each row of `mask`, the index of the last `True`, or -1 if
+	there is none."""
+	return numpy.where(mask.any(axis=1), mask.shape[1]-1-numpy.argmax(mask[:,::-1], axis=1), -1)
+
+def _median_of_first_samples(values:numpy.ndarray, n_first:numpy.ndarray)->numpy.ndarray:
+	"""For each row `i`, the median of `values[i,:n_first[i]]`, or `NaN`
+	if `n_first[i]` is 0. Much faster than `numpy.nanmedian`."""
+	n_columns = values.shape[1]
+	sorted_values = numpy.sort(numpy.where(numpy.arange(n_columns)[numpy.newaxis,:] < n_first[:,numpy.newaxis], values, numpy.inf), axis=1)
+	lower = numpy.take_along_axis(sorted_values, numpy.clip((n_first-1)//2, 0, n_columns-1)[:,numpy.newaxis], axis=1)[:,0]
+	upper = numpy.take_along_axis(sorted_values, numpy.clip(n_first//2, 0, n_columns-1)[:,numpy.newaxis], axis=1)[:,0]
+	return numpy.where(n_first > 0, (lower+upper)/2, float('NaN'))
+
+def _interpolate_crossing_time(time:numpy.ndarray, samples:numpy.ndarray, index:numpy.ndarray, level:numpy.ndarray)->numpy.ndarray:
+	"""For each row, and each column of `index` and `level` if they are
+	2D, the time at which the straight line between the samples `index`
+	and `index+1` crosses `level`. `NaN` where `index` is -1 or the last
+	sample."""
+	rows = numpy.arange(samples.shape[0]).reshape((-1,)+(1,)*(index.ndim-1))
+	valid = (index >= 0) & (index < samples.shape[1]-1)
+	i = numpy.where(valid, index, 0)
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		crossing_time = time[rows,i] + (level-samples[rows,i])/(samples[rows,i+1]-samples[rows,i])*(time[rows,i+1]-time[rows,i])
+	return numpy.where(valid, crossing_time, float('NaN'))
+
+def analyze_peaks(time:numpy.ndarray, samples:numpy.ndarray)->dict:
+	"""Finds the peak, baseline, noise and amplitude of many waveforms at
+	once, following the definitions of `PeakSignal`: the peak starts at
+	the last sample before the maximum that is below the median plus one
+	standard deviation of the samples before the maximum, and the baseline
+	and noise are the mean and standard deviation of the samples before
+	that. The result is what `compute_features` and `compute_CFD_times`
+	need, so if both are wanted this is done only once.
+
+	Arguments
+	---------
+	time: numpy.ndarray
+		Either a 1D array with the time of each sample, shared by all the
+		waveforms, or a 2D array with the same shape as `samples`.
+	samples: numpy.ndarray
+		A 2D array with one waveform per row.
+
+	Returns
+	-------
+	peaks: dict
+		A dictionary with 2D arrays `'time'` and `'samples'` and with 1D
+		arrays, one entry per waveform, `'peak_index'`, `'peak_start_index'`,
+		`'baseline'`, `'noise'` and `'amplitude'`.
+	"""
+	samples = numpy.asarray(samples, dtype=float)
+	if samples.ndim != 2:
+		raise ValueError(f'`samples` must be a 2D array, received an array with shape {samples.shape}.')
+	time = numpy.asarray(time, dtype=float)
+	if time.ndim == 1:
+		time = numpy.broadcast_to(time, samples.shape) # This does not copy anything.
+	if time.shape != samples.shape:
+		raise ValueError(f'`time` must have shape {samples.shape} or {samples.shape[1:]}, received {time.shape}.')
+	n_samples = samples.shape[1]
+	j = numpy.arange(n_samples)[numpy.newaxis,:]
+
+	peak_index = numpy.argmax(samples, axis=1)
+	before_peak = j < peak_index[:,numpy.newaxis]
+	median_before_peak = _median_of_first_samples(samples, peak_index)
+	std_before_peak = _median_of_first_samples(numpy.abs(samples-median_before_peak[:,numpy.newaxis]), peak_index)*k_MAD_TO_STD
+	peak_start_index = _last_true_index((samples <= (median_before_peak+std_before_peak)[:,numpy.newaxis]) & before_peak)
+
+	# Baseline and noise from `samples[:peak_start_index-1]`, as `PeakSignal` does.
+	baseline_window_end = peak_start_index - 1
+	baseline_window_end = numpy.where(baseline_window_end < 0, baseline_window_end+n_samples, baseline_window_end)
+	in_baseline_window = (j < baseline_window_end[:,numpy.newaxis]) & (peak_start_index >= 0)[:,numpy.newaxis]
+	n_samples_in_baseline_window = in_baseline_window.sum(axis=1)
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		baseline = numpy.where(in_baseline_window, samples, 0).sum(axis=1)/n_samples_in_baseline_window
+		noise = (numpy.where(in_baseline_window, (samples-baseline[:,numpy.newaxis])**2, 0).sum(axis=1)/n_samples_in_baseline_window)**.5
+	baseline[n_samples_in_baseline_window==0] = float('NaN')
+	noise[n_samples_in_baseline_window==0] = float('NaN')
+
+	return {
+		'time': time,
+		'samples': samples,
+		'peak_index': peak_index,
+		'peak_start_index': peak_start_index,
+		'baseline': baseline,
+		'noise': noise,
+		'amplitude': samples[numpy.arange(len(samples)),peak_index] - baseline,
+	}
+
+def _rising_and_falling_times(peaks:dict, fractions:numpy.ndarray)->tuple:
+	"""Returns `(rising, falling)`, two arrays with the same shape as `fractions`,
+	which is a 2D array with one row per waveform, with the times at which
+	each waveform crosses `baseline + fraction*amplitude` before and after
+	its peak. All the fractions are found in a single pass: the minimum
+	of the samples from each one up to the peak is monotonic, so the last
+	sample before the peak that is below each level can be looked up with
+	a binary search instead of comparing all the samples with each level.
+	The same goes for the first sample after the peak."""
+	samples = peaks['samples']
+	n_waveforms, n_samples = samples.shape
+	j = numpy.arange(n_samples)[numpy.newaxis,:]
+	rows = numpy.arange(n_waveforms)[:,numpy.newaxis]
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		normalized_samples = (samples-peaks['baseline'][:,numpy.newaxis])/peaks['amplitude'][:,numpy.newaxis]
+	can_be_normalized = numpy.isfinite(peaks['baseline']) & numpy.isfinite(peaks['amplitude']) & (peaks['amplitude'] > 0)
+	fractions = numpy.where(can_be_normalized[:,numpy.newaxis] & numpy.isfinite(fractions), fractions, float('NaN'))
+	# Clipping does not change which samples are below which fractions, and leaves each row within a range so all the rows can be searched at once.
+	low = -1
+	high = max(2, numpy.nanmax(fractions, initial=0)+1)
+	normalized_samples = numpy.clip(numpy.nan_to_num(normalized_samples, nan=high), low, high)
+	clipped_fractions = numpy.clip(numpy.nan_to_num(fractions, nan=low), low, high)
+	offset_of_each_row = rows*(high-low+1)
+
+	# Last sample before the peak below each fraction.
+	minimum_from_here_to_peak = numpy.minimum.accumulate(numpy.where(j < peaks['peak_index'][:,numpy.newaxis], normalized_samples, high)[:,::-1], axis=1)[:,::-1]
+	n_below = numpy.searchsorted((minimum_from_here_to_peak + offset_of_each_row).ravel(), (clipped_fractions + offset_of_each_row).ravel(), side='left').reshape(fractions.shape) - rows*n_samples
+	last_below_before_peak = n_below - 1
+
+	# First sample after the peak below each fraction.
+	minimum_from_peak_to_here = numpy.minimum.accumulate(numpy.where(j > peaks['peak_index'][:,numpy.newaxis], normalized_samples, high), axis=1)
+	n_not_below = numpy.searchsorted((-minimum_from_peak_to_here + offset_of_each_row).ravel(), (-clipped_fractions + offset_of_each_row).ravel(), side='right').reshape(fractions.shape) - rows*n_samples
+	first_below_after_peak = numpy.where(n_not_below < n_samples, n_not_below, -1)
+
+	level = peaks['baseline'][:,numpy.newaxis] + fractions*peaks['amplitude'][:,numpy.newaxis]
+	has_fraction = numpy.isfinite(fractions)
+	rising = _interpolate_crossing_time(peaks['time'], samples, numpy.where(has_fraction, last_below_before_peak, -1), level)
+	falling = _interpolate_crossing_time(peaks['time'], samples, numpy.where(has_fraction & (first_below_after_peak >= 0), first_below_after_peak-1, -1), level)
+	return rising, falling
+
+def compute_features(time:numpy.ndarray, samples:numpy.ndarray, peaks:dict=None)->pandas.DataFrame:
+	"""Computes the same features as `parse_waveforms.parse_waveform` but
+	for many waveforms at once, using only vectorized operations. The
+	definitions follow those of `PeakSignal`, see `analyze_peaks`, and the
+	times at which the signal crosses each threshold are linearly
+	interpolated between samples. Features that cannot be computed for
+	some waveform are `NaN`.
+
+	Arguments
+	---------
+	time: numpy.ndarray
+		Either a 1D array with the time of each sample, shared by all the
+		waveforms, or a 2D array with the same shape as `samples`.
+	samples: numpy.ndarray
+		A 2D array with one waveform per row.
+	peaks: dict, optional
+		What `analyze_peaks` returned for these waveforms, if it was
+		already called.
+
+	Returns
+	-------
+	features: pandas.DataFrame
+		A data frame with one row per waveform and the same columns as
+		the dictionary returned by `parse_waveforms.parse_waveform`.
+	"""
+	if peaks is None:
+		peaks = analyze_peaks(time, samples)
+	time = peaks['time']
+	samples = peaks['samples']
+	baseline = peaks['baseline']
+	noise = peaks['noise']
+	amplitude = peaks['amplitude']
+	n_samples = samples.shape[1]
+	rows = numpy.arange(samples.shape[0])
+	j = numpy.arange(n_samples)[numpy.newaxis,:]
+	before_peak = j < peaks['peak_index'][:,numpy.newaxis]
+	after_peak = j > peaks['peak_index'][:,numpy.newaxis]
+
+	peak_start_time = numpy.where(peaks['peak_start_index'] >= 0, time[rows,peaks['peak_start_index']], float('NaN'))
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		SNR = amplitude/noise
+		noise_fraction = noise/amplitude
+
+	# The last column is for the time over noise.
+	fractions = numpy.concatenate([numpy.broadcast_to(numpy.array(THRESHOLDS_PERCENTAGES)/100, (len(samples),len(THRESHOLDS_PERCENTAGES))), noise_fraction[:,numpy.newaxis]], axis=1)
+	rising, falling = _rising_and_falling_times(peaks, fractions)
+	time_over = falling - rising
+
+	# Integrals of the linearly interpolated signal, i.e. trapezoids.
+	signal = samples - baseline[:,numpy.newaxis]
+	trapezoids = (signal[:,:-1] + signal[:,1:])/2*numpy.diff(time, axis=1)
+	peak_starts = _last_true_index((signal <= 0) & before_peak)
+	peak_ends = _first_true_index((signal <= 0) & after_peak)
+	k = numpy.arange(n_samples-1)[numpy.newaxis,:]
+	in_peak = (k >= peak_starts[:,numpy.newaxis]) & (k < peak_ends[:,numpy.newaxis])
+	peak_integral = numpy.where((peak_starts >= 0) & (peak_ends >= 0), numpy.where(in_peak, trapezoids, 0).sum(axis=1), float('NaN'))
+
+	features = {}
+	features['Amplitude (V)'] = amplitude
+	features['Noise (V)'] = noise
+	features['Rise time (s)'] = rising[:,THRESHOLDS_PERCENTAGES.index(90)] - rising[:,THRESHOLDS_PERCENTAGES.index(10)]
+	features['Collected charge (V s)'] = peak_integral
+	features['Time over noise (s)'] = time_over[:,-1]
+	features['Peak start time (s)'] = peak_start_time
+	features['Whole signal integral (V s)'] = trapezoids.sum(axis=1)
+	features['SNR'] = SNR
+	for i,threshold_percentage in enumerate(THRESHOLDS_PERCENTAGES):
+		features[f'Time over {threshold_percentage}% (s)'] = time_over[:,i]
+	for i,threshold_percentage in enumerate(THRESHOLDS_PERCENTAGES):
+		features[f't_{threshold_percentage} (s)'] = rising[:,i]
+	return pandas.DataFrame(features)
+
+def compute_CFD_times(time:numpy.ndarray, samples:numpy.ndarray, percentages:list, peaks:dict=None)->dict:
+	"""Computes the times at which many waveforms cross many constant
+	fraction discriminator thresholds, e.g. every 1 % from 5 to 95 %,
+	in a single vectorized pass, see `_rising_and_falling_times`.
+
+	Arguments
+	---------
+	time, samples, peaks:
+		Same as for `compute_features`.
+	percentages: list of float
+		The thresholds, as percentages of the amplitude of each waveform.
+
+	Returns
+	-------
+	CFD_times: dict
+		A dictionary with `'percentages'`, a 1D array, and `'t (s)'` and
+		`'Time over threshold (s)'`, 2D arrays with one row per waveform
+		and one column per percentage.
+	"""
+	percentages = numpy.asarray(percentages, dtype=float)
+	if percentages.ndim != 1 or not numpy.all((0 <= percentages) & (percentages <= 100)):
+		raise ValueError(f'`percentages` must be a list of numbers between 0 and 100, received {percentages}.')
+	if peaks is None:
+		peaks = analyze_peaks(time, samples)
+	rising, falling = _rising_and_falling_times(peaks, numpy.broadcast_to(percentages/100, (len(peaks['samples']),len(percentages))))
+	return {
+		'percentages': percentages,
+		't (s)': rising,
+		'Time over threshold (s)': falling - rising,
+	}
+
+def compare_with_parse_waveform(time:numpy.ndarray, samples:numpy.ndarray, relative_tolerance:float=1e-2)->pandas.DataFrame:
+	"""Computes the features with `compute_features` and, one waveform
+	at a time, with `parse_waveforms.parse_waveform`, and returns for each
+	feature the fraction of waveforms in which both agree within
+	`relative_tolerance` (or are both `NaN`) and the median relative
+	difference. Useful to check the batch engine against `PeakSignal`."""
+	from parse_waveforms import parse_waveform
+	from signals.PeakSignal import PeakSignal # https://github.com/SengerM/signals
+
+	time = numpy.asarray(time, dtype=float)
+	samples = numpy.asarray(samples, dtype=float)
+	batch = compute_features(time, samples)
+	one_by_one = pandas.DataFrame.from_records(
+		[parse_waveform(PeakSignal(time=time if time.ndim==1 else time[i], samples=samples[i])) for i in range(len(samples))]
+	)[batch.columns]
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		relative_difference = ((batch - one_by_one)/one_by_one).abs()
+	agree = (relative_difference <= relative_tolerance) | (batch.isna() & one_by_one.isna())
+	return pandas.DataFrame(
+		{
+			'Fraction that agrees': agree.mean(),
+			'Median relative difference': relative_difference.median(),
+		}
+	)
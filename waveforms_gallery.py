@@ -0,0 +1,121 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from signals.PeakSignal import PeakSignal # https://github.com/SengerM/signals
+from pathlib import Path
+import multiprocessing
+from contextlib import nullcontext
+from waveforms_store import WaveformsReader, WAVEFORMS_STORE_DIRECTORY_NAME
+from parse_waveforms import plot_waveform, CHECKPOINT_FILE_NAME, _read_checkpoint, _read_manifest_of_sqlite_file, _iterate_waveforms_from_sqlite_file
+from reservoir_sampling import StratifiedReservoir
+
+def _read_waveform(path_to_waveforms:Path, idx:tuple)->tuple:
+	"""Returns `(time, samples)` of one waveform from a waveforms store or
+	from an old style `waveforms.sqlite` file."""
+	if path_to_waveforms.is_dir():
+		waveform = WaveformsReader(path_to_waveforms).read_waveform(*idx)
+		return waveform['Time (s)'], waveform['Amplitude (V)']
+	manifest = _read_manifest_of_sqlite_file(path_to_waveforms)
+	_, time, samples = next(_iterate_waveforms_from_sqlite_file(path_to_waveforms, manifest.loc[[idx]]))
+	return time, samples
+
+def _render_waveform(job:dict):
+	time, samples = _read_waveform(job['path_to_waveforms'], job['idx'])
+	fig = plot_waveform(PeakSignal(time=time, samples=samples))
+	fig.write_html(
+		job['path_to_html_file'],
+		include_plotlyjs = 'cdn',
+	)
+
+def render_waveforms_gallery(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms:str, n_per_stratum:int=None, number_of_processes:int=1):
+	"""Plots the waveforms that `parse_waveforms` randomly selected for
+	each slot and SNR band. This is done apart from the parsing, so it
+	does not slow it down, and has to be done before the waveforms are
+	deleted.
+
+	Arguments
+	---------
+	n_per_stratum: int, optional
+		Maximum number of waveforms to plot for each slot and SNR band.
+		If not given, all the selected waveforms are plotted.
+	number_of_processes: int, default 1
+		Number of processes among which to split the plotting.
+	"""
+	bureaucrat.check_these_tasks_were_run_successfully('parse_waveforms')
+	checkpoint = _read_checkpoint(bureaucrat.path_to_directory_of_task('parse_waveforms')/CHECKPOINT_FILE_NAME)
+	if 'gallery' not in checkpoint:
+		raise RuntimeError(f'No waveforms were selected for the gallery when parsing run {repr(bureaucrat.run_name)}, parse it again with `continue_from_where_we_left_last_time=False`.')
+	waveforms_for_the_gallery = StratifiedReservoir.from_state(checkpoint['gallery']).sample
+
+	path_to_waveforms = bureaucrat.path_to_directory_of_task(name_of_task_that_produced_the_waveforms)/WAVEFORMS_STORE_DIRECTORY_NAME
+	if not path_to_waveforms.is_dir():
+		path_to_waveforms = bureaucrat.path_to_directory_of_task(name_of_task_that_produced_the_waveforms)/'waveforms.sqlite'
+
+	with bureaucrat.handle_task('waveforms_gallery') as employee:
+		jobs = []
+		for (slot_number,SNR_band),waveforms in sorted(waveforms_for_the_gallery.items()):
+			for idx in sorted(waveforms)[:n_per_stratum]:
+				jobs.append(
+					dict(
+						path_to_waveforms = path_to_waveforms,
+						idx = idx,
+						path_to_html_file = employee.path_to_directory_of_my_task/f'slot_number_{slot_number} {SNR_band} n_trigger_{idx[0]}.html',
+					)
+				)
+		with multiprocessing.Pool(number_of_processes) if number_of_processes > 1 else nullcontext() as pool:
+			list(pool.imap_unordered(_render_waveform, jobs) if pool is not None else map(_render_waveform, jobs))
+
+def render_waveforms_gallery_recursively(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms:str, n_per_stratum:int=None, number_of_processes:int=1, silent:bool=True):
+	if bureaucrat.was_task_run_successfully('parse_waveforms'):
+		if not silent:
+			print(f'Rendering waveforms gallery of {bureaucrat.run_name}...')
+		render_waveforms_gallery(
+			bureaucrat = bureaucrat,
+			name_of_task_that_produced_the_waveforms = name_of_task_that_produced_the_waveforms,
+			n_per_stratum = n_per_stratum,
+			number_of_processes = number_of_processes,
+		)
+	else:
+		for path_to_task in bureaucrat.path_to_run_directory.iterdir():
+			if path_to_task.is_dir():
+				for subrun in bureaucrat.list_subruns_of_task(path_to_task.parts[-1]):
+					render_waveforms_gallery_recursively(
+						bureaucrat = subrun,
+						name_of_task_that_produced_the_waveforms = name_of_task_that_produced_the_waveforms,
+						n_per_stratum = n_per_stratum,
+						number_of_processes = number_of_processes,
+						silent = silent,
+					)
+
+if __name__=='__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Plots some randomly selected waveforms of each slot and SNR band.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--n_per_stratum',
+		metavar = 'N',
+		help = 'Maximum number of waveforms to plot for each slot and SNR band. Default is all those selected when parsing.',
+		default = None,
+		dest = 'n_per_stratum',
+		type = int,
+	)
+	parser.add_argument('--processes',
+		metavar = 'N',
+		help = f'Number of processes to use for plotting. Default is 1, i.e. no parallel processes. This computer has {multiprocessing.cpu_count()} CPUs.',
+		default = 1,
+		dest = 'processes',
+		type = int,
+	)
+
+	args = parser.parse_args()
+	render_waveforms_gallery_recursively(
+		bureaucrat = RunBureaucrat(Path(args.directory)),
+		name_of_task_that_produced_the_waveforms = 'test_beam',
+		n_per_stratum = args.n_per_stratum,
+		number_of_processes = args.processes,
+		silent = False,
+	)
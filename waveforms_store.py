@@ -0,0 +1,328 @@
+from pathlib import Path
+import sqlite3
+import time
+import numpy
+import pandas
+import shutil
+
+INDEX_COLUMNS = ['n_trigger','slot_number']
+WAVEFORMS_STORE_DIRECTORY_NAME = 'waveforms'
+
+def _path_to_chunk_file(path_to_directory:Path, n_chunk:int)->Path:
+	return path_to_directory/f'chunk_{n_chunk:06d}.npz'
+
+def _encode_time_as_uniform_grid(time:numpy.ndarray)->dict:
+	"""If each row of `time` is `t0 + dt*numpy.arange(n_samples)`, within a
+	thousandth of `dt`, returns `{'time_t0': t0, 'time_dt': dt}` with one
+	`t0` and `dt` per row, otherwise returns `None`."""
+	t0 = time[:,0]
+	dt = (time[:,-1]-time[:,0])/(time.shape[1]-1) if time.shape[1] > 1 else numpy.zeros(len(time))
+	if not numpy.all(numpy.abs(t0[:,numpy.newaxis] + dt[:,numpy.newaxis]*numpy.arange(time.shape[1]) - time) <= numpy.abs(dt[:,numpy.newaxis])*1e-3):
+		return None
+	return {'time_t0': t0, 'time_dt': dt}
+
+def _encode_amplitude_as_ADC_codes(amplitude:numpy.ndarray, slot_number:numpy.ndarray)->dict:
+	"""If the amplitudes of each slot are on a grid of at most 2**16 levels,
+	as the samples of the digitizer of the oscilloscope, returns
+	`{'amplitude_codes': codes, 'amplitude_gain': gain, 'amplitude_offset': offset}`
+	such that `amplitude == offset + gain*codes` within a thousandth of
+	`gain`, with one `gain` and `offset` per row. Otherwise, e.g. if the
+	oscilloscope was averaging, returns `None`."""
+	if amplitude.size == 0 or not numpy.isfinite(amplitude).all():
+		return None
+	gain = numpy.ones(len(amplitude))
+	offset = numpy.zeros(len(amplitude))
+	for this_slot_number in numpy.unique(slot_number):
+		rows = slot_number == this_slot_number
+		levels = numpy.unique(amplitude[rows][:111]) # A few waveforms are enough to find the grid, all of them are checked below.
+		if len(levels) > 1:
+			span = levels[-1] - levels[0]
+			gain[rows] = span/numpy.round(span/numpy.diff(levels).min())
+		offset[rows] = levels[0] + gain[rows][0]*numpy.floor((amplitude[rows].min()-levels[0])/gain[rows][0] + .5)
+	codes = numpy.round((amplitude-offset[:,numpy.newaxis])/gain[:,numpy.newaxis])
+	if codes.min() < 0 or codes.max() >= 2**16 or not numpy.all(numpy.abs(offset[:,numpy.newaxis] + gain[:,numpy.newaxis]*codes - amplitude) <= gain[:,numpy.newaxis]*1e-3):
+		return None
+	return {
+		'amplitude_codes': codes.astype(numpy.uint8 if codes.max() < 2**8 else numpy.uint16),
+		'amplitude_gain': gain,
+		'amplitude_offset': offset,
+	}
+
+def _decode_chunk(npz)->dict:
+	"""Returns `{'Time (s)': array, 'Amplitude (V)': array}` from a chunk
+	file, whether it was stored compact or not."""
+	if 'time' in npz:
+		time = npz['time']
+	else:
+		time = npz['time_t0'][:,numpy.newaxis] + npz['time_dt'][:,numpy.newaxis]*numpy.arange(npz['amplitude_codes' if 'amplitude_codes' in npz else 'amplitude'].shape[1])
+	if 'amplitude' in npz:
+		amplitude = npz['amplitude']
+	else:
+		amplitude = npz['amplitude_offset'][:,numpy.newaxis] + npz['amplitude_gain'][:,numpy.newaxis]*npz['amplitude_codes']
+	return {'Time (s)': time, 'Amplitude (V)': amplitude}
+
+class WaveformsDumper:
+	"""Stores waveforms in a directory where each (n_trigger, slot_number)
+	waveform is one row of a fixed length array. Waveforms are grouped
+	in chunk files, and a manifest (an SQLite file) tells in which chunk
+	and row each of them is. Use it within a `with` statement, e.g.
+	```
+	with WaveformsDumper(path_to_directory) as dumper:
+		dumper.append(spill)
+	```
+	"""
+	def __init__(self, path_to_directory:Path, dump_after_n_waveforms:int=11111, dump_after_seconds:float=11, delete_if_already_exists:bool=True, compact:bool=True):
+		"""
+		Arguments
+		---------
+		path_to_directory: Path
+			Path to the directory where to store the waveforms.
+		dump_after_n_waveforms: int, default 11111
+			Number of waveforms to keep in memory before writing them to
+			a new chunk.
+		dump_after_seconds: float, default 11
+			Time after which the waveforms in memory are written to disk,
+			even if there are less than `dump_after_n_waveforms`.
+		delete_if_already_exists: bool, default True
+			If `True` and there is already a store in `path_to_directory`
+			it is deleted, otherwise new waveforms are appended to it.
+		compact: bool, default True
+			If `True`, the amplitudes are stored as the integer codes of the
+			digitizer of the oscilloscope plus a gain and offset, and the
+			time as a start time and sampling period, which needs 4 to 16
+			times less space than 64 bits floats. Chunks in which this
+			is not possible, e.g. because the oscilloscope was averaging,
+			are stored as floats. Either way, `WaveformsReader` gives
+			back seconds and volts.
+		"""
+		if not isinstance(path_to_directory, Path):
+			raise TypeError(f'`path_to_directory` must be an instance of {Path}, received object of type {type(path_to_directory)}.')
+		self.path_to_directory = path_to_directory
+		self.dump_after_n_waveforms = dump_after_n_waveforms
+		self.dump_after_seconds = dump_after_seconds
+		self.delete_if_already_exists = delete_if_already_exists
+		self.compact = compact
+
+	def __enter__(self):
+		if self.delete_if_already_exists and self.path_to_directory.is_dir():
+			shutil.rmtree(self.path_to_directory)
+		self.path_to_directory.mkdir(parents=True, exist_ok=True)
+		self._manifest_connection = sqlite3.connect(self.path_to_directory/'manifest.sqlite')
+		self._manifest_connection.execute('CREATE TABLE IF NOT EXISTS waveforms (n_trigger INTEGER, slot_number INTEGER, n_chunk INTEGER, n_row INTEGER)')
+		self._manifest_connection.execute('CREATE INDEX IF NOT EXISTS waveforms_index ON waveforms (n_trigger, slot_number)')
+		self._manifest_connection.commit()
+		last_chunk = self._manifest_connection.execute('SELECT MAX(n_chunk) FROM waveforms').fetchone()[0]
+		self._next_n_chunk = 0 if last_chunk is None else last_chunk+1
+		self._buffer = []
+		self._last_dump_time = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.dump()
+		self._manifest_connection.close()
+
+	def append(self, spill:dict):
+		"""Append waveforms to the store.
+
+		Arguments
+		---------
+		spill: dict
+			A dictionary with the keys `'n_trigger'` and `'slot_number'`,
+			each of them a 1D array with one entry per waveform, and
+			`'Time (s)'` and `'Amplitude (V)'`, each of them a 2D array
+			with one row per waveform. See `acquire_test_beam.build_spill`.
+		"""
+		if len(self._buffer) > 0 and self._buffer[0]['Time (s)'].shape[1] != spill['Time (s)'].shape[1]:
+			self.dump() # Each chunk holds waveforms of one length only.
+		self._buffer.append(spill)
+		if sum([len(_['n_trigger']) for _ in self._buffer]) >= self.dump_after_n_waveforms or time.time() - self._last_dump_time > self.dump_after_seconds:
+			self.dump()
+
+	def dump(self):
+		"""Write to disk whatever is in memory."""
+		self._last_dump_time = time.time()
+		if len(self._buffer) == 0:
+			return
+		chunk = {key: numpy.concatenate([_[key] for _ in self._buffer]) for key in INDEX_COLUMNS+['Time (s)','Amplitude (V)']}
+		self._buffer = []
+
+		path_to_chunk = _path_to_chunk_file(self.path_to_directory, self._next_n_chunk)
+		path_to_temporary_file = path_to_chunk.with_suffix('.tmp.npz')
+		arrays = {
+			'n_trigger': chunk['n_trigger'],
+			'slot_number': chunk['slot_number'],
+		}
+		encoded_time = _encode_time_as_uniform_grid(chunk['Time (s)']) if self.compact else None
+		arrays.update(encoded_time if encoded_time is not None else {'time': chunk['Time (s)']})
+		encoded_amplitude = _encode_amplitude_as_ADC_codes(chunk['Amplitude (V)'], chunk['slot_number']) if self.compact else None
+		arrays.update(encoded_amplitude if encoded_amplitude is not None else {'amplitude': chunk['Amplitude (V)']})
+		numpy.savez(path_to_temporary_file, **arrays)
+		path_to_temporary_file.rename(path_to_chunk) # So the chunk is in its final place before it appears in the manifest.
+
+		self._manifest_connection.executemany(
+			'INSERT INTO waveforms VALUES (?,?,?,?)',
+			zip(
+				chunk['n_trigger'].tolist(),
+				chunk['slot_number'].tolist(),
+				[self._next_n_chunk]*len(chunk['n_trigger']),
+				range(len(chunk['n_trigger'])),
+			),
+		)
+		self._manifest_connection.commit()
+		self._next_n_chunk += 1
+
+class WaveformsReader:
+	"""Reads waveforms stored by a `WaveformsDumper`."""
+	def __init__(self, path_to_directory:Path):
+		if not isinstance(path_to_directory, Path):
+			raise TypeError(f'`path_to_directory` must be an instance of {Path}, received object of type {type(path_to_directory)}.')
+		if not (path_to_directory/'manifest.sqlite').is_file():
+			raise FileNotFoundError(f'Cannot find a waveforms store in {path_to_directory}.')
+		self.path_to_directory = path_to_directory
+		self._cached_chunk = (None, None)
+
+	@property
+	def manifest(self)->pandas.DataFrame:
+		"""A data frame with `INDEX_COLUMNS` as index and the columns
+		`n_chunk` and `n_row` telling where each waveform is stored."""
+		return self.read_manifest().drop(columns='rowid')
+	
+	def read_manifest(self, after_rowid:int=0)->pandas.DataFrame:
+		"""Same as `.manifest` but only with the waveforms stored after
+		`after_rowid`, and with an extra column `rowid` that grows with
+		each stored waveform. This allows to read only the waveforms that
+		were stored since the last time, using the maximum `rowid` seen
+		as a watermark."""
+		with sqlite3.connect(self.path_to_directory/'manifest.sqlite') as connection:
+			manifest = pandas.read_sql_query('SELECT rowid, * FROM waveforms WHERE rowid > ?', connection, params=(after_rowid,))
+		return manifest.set_index(INDEX_COLUMNS)
+
+	@property
+	def index(self)->pandas.MultiIndex:
+		"""The `(n_trigger, slot_number)` of all the stored waveforms."""
+		return self.manifest.index
+
+	def _load_chunk(self, n_chunk:int)->dict:
+		if self._cached_chunk[0] != n_chunk:
+			with numpy.load(_path_to_chunk_file(self.path_to_directory, n_chunk)) as npz:
+				self._cached_chunk = (n_chunk, _decode_chunk(npz))
+		return self._cached_chunk[1]
+
+	def iterate_batches(self, index=None, manifest:pandas.DataFrame=None):
+		"""Iterate over the waveforms in batches. Each batch has the same
+		format as the dictionaries given to `WaveformsDumper.append`.
+
+		Arguments
+		---------
+		index: iterable of tuples, optional
+			The `(n_trigger, slot_number)` of the waveforms to read. If not
+			given, all the waveforms are read.
+		manifest: pandas.DataFrame, optional
+			The manifest as returned by `.manifest`. If you already have
+			it, passing it avoids reading it again.
+
+		Yields
+		------
+		batch: dict
+			All the requested waveforms stored in one chunk, sorted by
+			`INDEX_COLUMNS`.
+		"""
+		if manifest is None:
+			manifest = self.manifest
+		if index is not None:
+			manifest = manifest.loc[list(index)]
+		manifest = manifest.sort_index()
+		for n_chunk, waveforms_in_this_chunk in manifest.groupby('n_chunk', sort=False):
+			chunk = self._load_chunk(n_chunk)
+			rows = waveforms_in_this_chunk['n_row'].to_numpy()
+			yield {
+				'n_trigger': waveforms_in_this_chunk.index.get_level_values('n_trigger').to_numpy(),
+				'slot_number': waveforms_in_this_chunk.index.get_level_values('slot_number').to_numpy(),
+				'Time (s)': chunk['Time (s)'][rows],
+				'Amplitude (V)': chunk['Amplitude (V)'][rows],
+			}
+
+	def read_waveform(self, n_trigger:int, slot_number:int)->dict:
+		"""Returns one waveform as a dictionary of the form
+		`{'Time (s)': numpy.array, 'Amplitude (V)': numpy.array}`."""
+		batch = next(self.iterate_batches(index=[(n_trigger, slot_number)]))
+		return {variable: batch[variable][0] for variable in ['Time (s)','Amplitude (V)']}
+
+def convert_sqlite_waveforms_file_into_store(path_to_sqlite_file:Path, path_to_directory:Path, rows_per_read:int=1111111):
+	"""Converts a `waveforms.sqlite` file, with one row per sample, into
+	a waveforms store. The original file is not modified.
+
+	Arguments
+	---------
+	path_to_sqlite_file: Path
+		Path to the `waveforms.sqlite` file written by `SQLiteDataFrameDumper`.
+	path_to_directory: Path
+		Path to the directory where to create the waveforms store.
+	rows_per_read: int, default 1111111
+		Number of rows of the SQLite file to load in memory at once.
+	"""
+	with sqlite3.connect(path_to_sqlite_file) as connection, WaveformsDumper(path_to_directory) as dumper:
+		leftover = None
+		for df in pandas.read_sql_query('SELECT n_trigger, slot_number, "Time (s)", "Amplitude (V)" FROM dataframe_table ORDER BY rowid', connection, chunksize=rows_per_read):
+			if leftover is not None:
+				df = pandas.concat([leftover, df], ignore_index=True)
+			# The last waveform may continue in the next read, so keep it for later.
+			is_last_waveform = (df['n_trigger']==df['n_trigger'].iloc[-1]) & (df['slot_number']==df['slot_number'].iloc[-1])
+			leftover = df[is_last_waveform]
+			_append_long_format_dataframe_to_store(df[~is_last_waveform], dumper)
+		if leftover is not None:
+			_append_long_format_dataframe_to_store(leftover, dumper)
+
+def _append_long_format_dataframe_to_store(df:pandas.DataFrame, dumper:WaveformsDumper):
+	if len(df) == 0:
+		return
+	df = df.sort_values(INDEX_COLUMNS, kind='stable') # Stable so the samples of each waveform keep their order.
+	n_samples_of_each_row = df.groupby(INDEX_COLUMNS)['Time (s)'].transform('size').to_numpy()
+	for n_samples in sorted(set(n_samples_of_each_row)):
+		samples = df[n_samples_of_each_row==n_samples]
+		dumper.append(
+			{
+				'n_trigger': samples['n_trigger'].to_numpy()[::n_samples],
+				'slot_number': samples['slot_number'].to_numpy()[::n_samples],
+				'Time (s)': samples['Time (s)'].to_numpy().reshape(-1, n_samples),
+				'Amplitude (V)': samples['Amplitude (V)'].to_numpy().reshape(-1, n_samples),
+			}
+		)
+
+def convert_sqlite_waveforms_recursively(path_to_directory:Path, delete_sqlite_file:bool=False, silent:bool=True):
+	"""Looks for all the `waveforms.sqlite` files in `path_to_directory`
+	and its subdirectories and converts each of them into a waveforms
+	store next to it. Files that were already converted are skipped."""
+	for path_to_sqlite_file in sorted(path_to_directory.rglob('waveforms.sqlite')):
+		path_to_store = path_to_sqlite_file.parent/WAVEFORMS_STORE_DIRECTORY_NAME
+		if not (path_to_store/'manifest.sqlite').is_file():
+			if not silent:
+				print(f'Converting {path_to_sqlite_file}...')
+			convert_sqlite_waveforms_file_into_store(path_to_sqlite_file, path_to_store)
+		if delete_sqlite_file:
+			path_to_sqlite_file.unlink()
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Converts old `waveforms.sqlite` files into waveforms stores.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument(
+		'--delete',
+		help = 'If this flag is passed, the `waveforms.sqlite` files are deleted after being converted.',
+		required = False,
+		dest = 'delete',
+		action = 'store_true'
+	)
+	args = parser.parse_args()
+	convert_sqlite_waveforms_recursively(
+		path_to_directory = Path(args.directory),
+		delete_sqlite_file = args.delete,
+		silent = False,
+	)